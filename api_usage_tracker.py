@@ -0,0 +1,153 @@
+# api_usage_tracker.py
+
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Debugging setup ---
+DEBUG_USAGE_MODE = True
+
+def debug_usage_print(message):
+    if DEBUG_USAGE_MODE:
+        print(f"[DEBUG - API Usage]: {message}")
+
+# Estimated USD prices per 1M tokens: (input, output). Models not listed are recorded with cost 0.
+TEXT_MODEL_PRICING = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4": (30.00, 60.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-pro": (0.50, 1.50),
+}
+
+# Estimated USD price per generated image, keyed by (model, size).
+IMAGE_MODEL_PRICING = {
+    ("dall-e-3", "1024x1024"): 0.040,
+    ("dall-e-3", "1024x1792"): 0.080,
+    ("dall-e-3", "1792x1024"): 0.080,
+    ("dall-e-2", "1024x1024"): 0.020,
+    ("dall-e-2", "512x512"): 0.018,
+    ("dall-e-2", "256x256"): 0.016,
+}
+
+# Providers that run locally and cost nothing per call
+LOCAL_PROVIDERS = ("DeepSeek", "Mistral")
+
+# IDs of api_calls rows recorded since the last link_pending_calls_to_post(), per thread.
+_pending = threading.local()
+
+def estimate_text_cost(provider, model, prompt_tokens, completion_tokens):
+    if provider in LOCAL_PROVIDERS:
+        return 0.0
+    input_price, output_price = TEXT_MODEL_PRICING.get(model, (0.0, 0.0))
+    return ((prompt_tokens or 0) * input_price + (completion_tokens or 0) * output_price) / 1_000_000
+
+def estimate_image_cost(model, size, n=1):
+    return IMAGE_MODEL_PRICING.get((model, size), 0.0) * n
+
+def _pending_ids():
+    if not hasattr(_pending, "ids"):
+        _pending.ids = []
+    return _pending.ids
+
+def record_api_call(call_type, provider, model, started_at, outcome, prompt_tokens=None, completion_tokens=None,
+                    retries=0, estimated_cost=0.0, error_message=None, post_id=None, finished_at=None):
+    """
+    Stores one provider call in the api_calls table.
+
+    Args:
+        call_type (str): 'text' or 'image'.
+        started_at (float): time.perf_counter() value taken just before the call; wall time is measured from it.
+        outcome (str): 'success' or 'error'.
+        retries (int): Repeated requests made within this call (e.g. image download retries). The attempt
+                       number set by recording_retry() on this thread is added to it.
+        finished_at (float): time.perf_counter() value when the provider answered, if the call is recorded
+                             later (e.g. after its images were downloaded). Defaults to now.
+        post_id (int): Post the call belongs to, if already known. Otherwise the call is linked later
+                       by link_pending_calls_to_post().
+
+    Never raises; accounting must not break generation.
+    """
+    wall_time_ms = ((finished_at or time.perf_counter()) - started_at) * 1000.0
+    retries += getattr(_pending, "retry_attempt", 0)
+    try:
+        import database_manager # Imported lazily so generator modules stay cheap to import
+        call_id = database_manager.save_api_call(
+            call_type=call_type,
+            provider=provider,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            wall_time_ms=wall_time_ms,
+            retries=retries,
+            outcome=outcome,
+            estimated_cost=estimated_cost,
+            error_message=str(error_message)[:500] if error_message else None,
+            post_id=post_id
+        )
+        if call_id and post_id is None:
+            _pending_ids().append(call_id)
+        debug_usage_print(f"{call_type} call {provider}/{model}: {outcome}, {wall_time_ms:.0f} ms, "
+                          f"tokens {prompt_tokens}/{completion_tokens}, retries {retries}, est. ${estimated_cost:.5f}")
+        return call_id
+    except Exception as e:
+        debug_usage_print(f"WARNING: Could not record API call for {provider}/{model}: {e}")
+        return None
+
+def link_pending_calls_to_post(post_id):
+    """
+    Attaches every call recorded on this thread since the last link to the given post ID. A call linked to
+    several posts (a batch call whose results became several posts) has its cost split evenly between them.
+    """
+    call_ids = _pending_ids()
+    if not call_ids or post_id is None:
+        return 0
+    try:
+        import database_manager
+        database_manager.link_api_calls_to_post(call_ids, post_id)
+        return len(call_ids)
+    except Exception as e:
+        debug_usage_print(f"WARNING: Could not link API calls to post {post_id}: {e}")
+        return 0
+    finally:
+        call_ids.clear()
+
+def discard_pending_calls():
+    """Forgets unlinked calls (e.g. when a post ends up not being saved). The rows stay in the table."""
+    _pending_ids().clear()
+
+@contextmanager
+def collect_pending_calls_into(call_ids):
+    """
+    Makes calls recorded on this thread (without a post_id) go into `call_ids` instead of the thread's own
+    pending list. Used by worker pools so the submitting thread can adopt the calls once it knows the post.
+    """
+    previous = getattr(_pending, "ids", None)
+    _pending.ids = call_ids
+    try:
+        yield call_ids
+    finally:
+        if previous is None:
+            del _pending.ids
+        else:
+            _pending.ids = previous
+
+@contextmanager
+def recording_retry(attempt):
+    """
+    Counts calls recorded on this thread inside the block as retry number `attempt` of an earlier call for
+    the same post (e.g. regenerating a draft rejected as a near-duplicate).
+    """
+    previous = getattr(_pending, "retry_attempt", 0)
+    _pending.retry_attempt = attempt
+    try:
+        yield
+    finally:
+        _pending.retry_attempt = previous
+
+def adopt_pending_calls(call_ids):
+    """Adds calls recorded elsewhere (see collect_pending_calls_into) to this thread's pending list."""
+    _pending_ids().extend(call_ids)
@@ -2,6 +2,7 @@
 
 import sqlite3
 import os
+import time
 from datetime import datetime
 import pandas as pd
 
@@ -15,6 +16,8 @@ def connect_db():
 def create_tables():
     conn = connect_db()
     cursor = conn.cursor()
+    # Several publishing worker processes share this file; WAL lets their reads proceed during writes
+    cursor.execute("PRAGMA journal_mode=WAL")
 
     def column_exists(cursor_obj, table_name, column_name):
         cursor_obj.execute(f"PRAGMA table_info({table_name})")
@@ -58,7 +61,8 @@ def create_tables():
             facebook_page_id TEXT,
             facebook_access_token TEXT,
             text_gen_prompt_en TEXT,
-            text_gen_prompt_ar TEXT
+            text_gen_prompt_ar TEXT,
+            duplicate_of_post_id INTEGER
         )
     ''')
 
@@ -83,6 +87,30 @@ def create_tables():
     add_column_if_not_exists(cursor, 'posts', 'facebook_access_token', 'TEXT')
     add_column_if_not_exists(cursor, 'posts', 'text_gen_prompt_en', 'TEXT')
     add_column_if_not_exists(cursor, 'posts', 'text_gen_prompt_ar', 'TEXT')
+    add_column_if_not_exists(cursor, 'posts', 'duplicate_of_post_id', 'INTEGER')
+    add_column_if_not_exists(cursor, 'posts', 'updated_at', 'REAL')
+
+    # Image files are content-addressed and may be shared by several posts; lookups by key must be cheap
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_generated_image_filename ON posts (generated_image_filename)")
+    # Used by the publishing daemon: due-post range scans and incremental change polling
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_schedule ON posts (posted, is_approved, post_date, post_hour)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_updated_at ON posts (updated_at)")
+    # Occupied (date, hour, page) slots, read by slot_allocator when placing newly generated posts
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_slots ON posts (post_date, post_hour, page_name)")
+    # updated_at (unix seconds) is stamped by triggers so every writer (GUI, web app, scripts) is covered
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_posts_updated_at_insert AFTER INSERT ON posts
+        BEGIN
+            UPDATE posts SET updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_posts_updated_at_update AFTER UPDATE ON posts
+        WHEN NEW.updated_at IS OLD.updated_at
+        BEGIN
+            UPDATE posts SET updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = NEW.id;
+        END
+    ''')
 
 
     # --- Rollback: Remove the unwanted columns if they exist ---
@@ -144,6 +172,195 @@ def create_tables():
     ''')
     # --- END NEW TABLE ---
 
+    # --- api_calls: one row per text/image provider call (tokens, latency, cost) ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            call_type TEXT NOT NULL,
+            provider TEXT,
+            model TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            wall_time_ms REAL,
+            retries INTEGER DEFAULT 0,
+            outcome TEXT NOT NULL,
+            estimated_cost REAL DEFAULT 0.0,
+            error_message TEXT,
+            post_id INTEGER,
+            FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE SET NULL
+        )
+    ''')
+    add_column_if_not_exists(cursor, 'api_calls', 'retries', 'INTEGER', 0)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_calls_post_id ON api_calls (post_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_calls_provider_model ON api_calls (provider, model, call_type)")
+    # Posts each call produced; a batch call producing N posts is linked to all of them with share 1/N
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_call_posts (
+            call_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            share REAL NOT NULL DEFAULT 1.0,
+            PRIMARY KEY (call_id, post_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_call_posts_post_id ON api_call_posts (post_id)")
+    cursor.execute('''
+        INSERT OR IGNORE INTO api_call_posts (call_id, post_id, share)
+        SELECT id, post_id, 1.0 FROM api_calls
+        WHERE post_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM api_call_posts WHERE call_id = api_calls.id)
+    ''')
+
+    # --- Near-duplicate index (see duplicate_detector.py): MinHash signatures + LSH band buckets ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_minhash (
+            post_id INTEGER NOT NULL,
+            language TEXT NOT NULL,
+            signature BLOB NOT NULL,
+            PRIMARY KEY (post_id, language)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_lsh_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            language TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_post_lsh_buckets_band_bucket ON post_lsh_buckets (band, bucket)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_post_lsh_buckets_post_id ON post_lsh_buckets (post_id)")
+
+    # --- Prompt-level image reuse cache (see image_prompt_cache.py): up to K stored images per prompt key ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_prompt_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cache_key TEXT NOT NULL,
+            provider TEXT,
+            model TEXT,
+            image_size TEXT,
+            prompt TEXT,
+            image_key TEXT NOT NULL,
+            file_bytes INTEGER DEFAULT 0,
+            created_at TEXT,
+            last_used_at REAL,
+            use_count INTEGER DEFAULT 0,
+            UNIQUE (cache_key, image_key)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_prompt_cache_key ON image_prompt_cache (cache_key, last_used_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_prompt_cache_last_used ON image_prompt_cache (last_used_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_prompt_cache_image_key ON image_prompt_cache (image_key)")
+
+    # --- Images rendered for a post that is not saved yet (see image_gc.py); one row per pending use ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_pending_refs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_key TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_pending_refs_image_key ON image_pending_refs (image_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_pending_refs_created_at ON image_pending_refs (created_at)")
+
+    # --- Perceptual-hash index (see image_phash_index.py): 64-bit pHash + multi-index 16-bit chunks ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_phash (
+            image_key TEXT PRIMARY KEY,
+            phash INTEGER NOT NULL,
+            dhash INTEGER,
+            created_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_phash_chunks (
+            chunk INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            image_key TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_phash_chunks_chunk_value ON image_phash_chunks (chunk, value)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_phash_chunks_image_key ON image_phash_chunks (image_key)")
+
+    # --- Publish outbox (see publish_outbox.py): durable per-post publishing state machine ---
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS publish_outbox (
+            post_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'queued',
+            media_fbid TEXT,
+            facebook_post_id TEXT,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at REAL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at REAL,
+            FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
+        )
+    ''')
+    # Native Facebook scheduling: what was handed to Facebook, to detect edits that need a reschedule
+    add_column_if_not_exists(cursor, 'publish_outbox', 'scheduled_publish_time', 'REAL')
+    add_column_if_not_exists(cursor, 'publish_outbox', 'scheduled_image_key', 'TEXT')
+    # Media pre-uploaded ahead of the slot: when, and for which image (a changed image needs a new upload)
+    add_column_if_not_exists(cursor, 'publish_outbox', 'media_uploaded_at', 'REAL')
+    add_column_if_not_exists(cursor, 'publish_outbox', 'media_image_key', 'TEXT')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_publish_outbox_state ON publish_outbox (state, next_attempt_at)")
+
+    # Sharded publishing (publish_workers.py): which worker process owns which page, until when
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS publish_leases (
+            shard_key TEXT PRIMARY KEY,
+            worker_id TEXT,
+            lease_expires_at REAL NOT NULL DEFAULT 0,
+            acquired_at REAL,
+            heartbeat_at REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_publish_leases_worker_id ON publish_leases (worker_id)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS publish_workers (
+            worker_id TEXT PRIMARY KEY,
+            host TEXT,
+            pid INTEGER,
+            started_at REAL,
+            heartbeat_at REAL
+        )
+    ''')
+
+    # Aggregate per provider/model, used by the ML dashboard cost & latency panel
+    # (re-created so databases with the old definitions pick up the current columns)
+    cursor.execute("DROP VIEW IF EXISTS api_call_stats")
+    cursor.execute("DROP VIEW IF EXISTS api_cost_per_post")
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS api_call_stats AS
+        SELECT
+            call_type, provider, model,
+            COUNT(*) AS calls,
+            SUM(CASE WHEN outcome = 'success' THEN 1 ELSE 0 END) AS successes,
+            SUM(CASE WHEN outcome != 'success' THEN 1 ELSE 0 END) AS failures,
+            AVG(wall_time_ms) AS avg_wall_time_ms,
+            MAX(wall_time_ms) AS max_wall_time_ms,
+            SUM(COALESCE(prompt_tokens, 0)) AS prompt_tokens,
+            SUM(COALESCE(completion_tokens, 0)) AS completion_tokens,
+            SUM(COALESCE(retries, 0)) AS retries,
+            AVG(COALESCE(retries, 0)) AS avg_retries,
+            SUM(COALESCE(estimated_cost, 0.0)) AS estimated_cost,
+            MAX(created_at) AS last_call_at
+        FROM api_calls
+        GROUP BY call_type, provider, model
+    ''')
+
+    # Per-post totals, for cost per published post; shared batch calls count for their share only
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS api_cost_per_post AS
+        SELECT
+            api_call_posts.post_id,
+            COUNT(*) AS calls,
+            SUM(api_calls.wall_time_ms * api_call_posts.share) AS total_wall_time_ms,
+            SUM(COALESCE(api_calls.estimated_cost, 0.0) * api_call_posts.share) AS estimated_cost
+        FROM api_call_posts
+        JOIN api_calls ON api_calls.id = api_call_posts.call_id
+        GROUP BY api_call_posts.post_id
+    ''')
+
     conn.commit()
     conn.close()
     print(f"Database {DATABASE_FILE} initialized or already exists, with schema updates.")
@@ -155,7 +372,7 @@ def save_generated_post(
     image_prompt_en, image_prompt_ar, generated_image_filename, topic, language,
     text_gen_provider, text_gen_model, gemini_temperature, facebook_page_id,
     facebook_access_token, predicted_engagement_score=None, is_approved=False,
-    text_gen_prompt_en=None, text_gen_prompt_ar=None
+    text_gen_prompt_en=None, text_gen_prompt_ar=None, duplicate_of_post_id=None
 ):
     conn = connect_db()
     cursor = conn.cursor()
@@ -167,9 +384,9 @@ def save_generated_post(
                 text_gen_provider, text_gen_model, gemini_temperature,
                 facebook_page_id, facebook_access_token, predicted_engagement_score,
                 is_approved, posted,
-                text_gen_prompt_en, text_gen_prompt_ar
+                text_gen_prompt_en, text_gen_prompt_ar, duplicate_of_post_id
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             page_name, post_date, post_hour, content_en, content_ar,
             image_prompt_en, image_prompt_ar, generated_image_filename, topic, language,
@@ -177,11 +394,12 @@ def save_generated_post(
             facebook_page_id, facebook_access_token, predicted_engagement_score,
             1 if is_approved else 0,
             'No',
-            text_gen_prompt_en, text_gen_prompt_ar
+            text_gen_prompt_en, text_gen_prompt_ar, duplicate_of_post_id
         ))
         post_id = cursor.lastrowid
 
         cursor.execute('INSERT INTO post_metrics (post_id) VALUES (?)', (post_id,))
+        _clear_pending_image_reference(cursor, generated_image_filename)
 
         conn.commit()
         return post_id
@@ -192,13 +410,26 @@ def save_generated_post(
     finally:
         conn.close()
 
-# --- update_post_facebook_id (remains same) ---
+def normalize_facebook_post_id(actual_post_id, fb_page_id):
+    """Graph sometimes returns a bare post ID; stored IDs are always '<page id>_<post id>'."""
+    if fb_page_id and actual_post_id and '_' not in actual_post_id:
+        return f"{fb_page_id}_{actual_post_id}"
+    return actual_post_id
+
+# --- update_post_facebook_id ---
 def update_post_facebook_id(db_post_id, actual_post_id, fb_page_id=None, fb_access_token=None):
+    """
+    Records a published post's Facebook ID and marks it posted. Without an ID nothing is marked:
+    failed attempts are tracked by the publish outbox, so the post can still be retried.
+    """
+    if not actual_post_id:
+        print(f"WARNING: No Facebook Post ID for DB ID {db_post_id}; post left unposted.")
+        return False
     conn = connect_db()
     cursor = conn.cursor()
     try:
-        if fb_page_id and actual_post_id and '_' not in actual_post_id:
-            corrected_actual_post_id = f"{fb_page_id}_{actual_post_id}"
+        corrected_actual_post_id = normalize_facebook_post_id(actual_post_id, fb_page_id)
+        if corrected_actual_post_id != actual_post_id:
             print(f"Corrected actual_post_id for DB ID {db_post_id}: {actual_post_id} -> {corrected_actual_post_id}")
             actual_post_id = corrected_actual_post_id
 
@@ -209,7 +440,7 @@ def update_post_facebook_id(db_post_id, actual_post_id, fb_page_id=None, fb_acce
         else:
             cursor.execute('''
                 UPDATE posts SET actual_post_id = ?, posted = 'Yes' WHERE id = ?
-            ''', (actual_post_id, db_id)) # Corrected 'db_id' to 'post_id' assuming it should refer to the parameter
+            ''', (actual_post_id, db_post_id))
         conn.commit()
         return True
     except sqlite3.Error as e:
@@ -309,6 +540,55 @@ def get_unposted_posts_for_scheduling_columns():
     ]
 
 
+def get_scheduled_posts_between(start_date, start_hour, end_date, end_hour):
+    """
+    Approved, unposted posts with (start_date, start_hour) < (post_date, post_hour) <= (end_date, end_hour).
+    A range scan on idx_posts_schedule, so only the requested window is read.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT id, page_name, post_date, post_hour, facebook_page_id
+            FROM posts
+            WHERE posted = 'No' AND is_approved = 1
+              AND (post_date, post_hour) > (?, ?) AND (post_date, post_hour) <= (?, ?)
+            ORDER BY post_date, post_hour
+        ''', (start_date, start_hour, end_date, end_hour))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def get_latest_page_access_token(facebook_page_id):
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT facebook_access_token FROM posts
+            WHERE facebook_page_id = ? AND facebook_access_token IS NOT NULL
+            ORDER BY id DESC LIMIT 1
+        ''', (facebook_page_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def get_posts_changed_since(updated_at):
+    """Scheduling fields of posts modified after the given unix timestamp (see the updated_at triggers)."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT id, page_name, post_date, post_hour, posted, is_approved, updated_at, facebook_page_id
+            FROM posts
+            WHERE updated_at > ?
+            ORDER BY updated_at
+        ''', (updated_at,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
 # NEW FUNCTION: get_post_details_by_db_id
 def get_post_details_by_db_id(db_id):
     """
@@ -360,7 +640,7 @@ def get_all_unposted_posts_for_review(approval_filter="All"):
                image_prompt_en, image_prompt_ar, generated_image_filename,
                topic, language, is_approved, predicted_engagement_score,
                facebook_page_id, facebook_access_token, text_gen_provider, text_gen_model, gemini_temperature,
-               text_gen_prompt_en, text_gen_prompt_ar
+               text_gen_prompt_en, text_gen_prompt_ar, duplicate_of_post_id
         FROM posts
         WHERE posted = 'No'
     '''
@@ -434,6 +714,7 @@ def update_post_content_and_image(
         update_params.append(post_id)
 
         cursor.execute(update_sql, tuple(update_params))
+        _clear_pending_image_reference(cursor, generated_image_filename)
         conn.commit()
         return True
     except sqlite3.Error as e:
@@ -443,6 +724,84 @@ def update_post_content_and_image(
     finally:
         conn.close()
 
+def clear_post_image(post_id):
+    """Detaches the image from a post (update_post_content_and_image() skips None values)."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            UPDATE posts SET generated_image_filename = NULL WHERE id = ?
+        ''', (post_id,))
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"SQLite error clearing post image: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def count_posts_using_image(image_filename):
+    """Number of posts whose generated_image_filename is the given image key."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM posts WHERE generated_image_filename = ?", (image_filename,))
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+def count_image_references(image_filename):
+    """
+    Posts, image prompt cache entries and pending references (renders not attached to a saved post yet)
+    that use the given image key; the file must be kept while > 0.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT (SELECT COUNT(*) FROM posts WHERE generated_image_filename = ?)
+                 + (SELECT COUNT(*) FROM image_prompt_cache WHERE image_key = ?)
+                 + (SELECT COUNT(*) FROM image_pending_refs WHERE image_key = ?)
+        ''', (image_filename, image_filename, image_filename))
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+def add_pending_image_reference(image_key):
+    """Protects a freshly rendered image from garbage collection until a post using it is saved."""
+    if not image_key:
+        return
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO image_pending_refs (image_key, created_at) VALUES (?, ?)", (image_key, time.time()))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"SQLite error recording pending image reference: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def _clear_pending_image_reference(cursor, image_key):
+    """Drops one pending reference of image_key, now that a saved post holds the image (same transaction)."""
+    if image_key:
+        cursor.execute('''
+            DELETE FROM image_pending_refs
+            WHERE id = (SELECT id FROM image_pending_refs WHERE image_key = ? ORDER BY created_at LIMIT 1)
+        ''', (image_key,))
+
+def purge_pending_image_references(older_than):
+    """Deletes pending references created before the unix time older_than (abandoned runs). Returns the count."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM image_pending_refs WHERE created_at < ?", (older_than,))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
 def update_post_approval_status(post_id, is_approved):
     conn = connect_db()
     cursor = conn.cursor()
@@ -459,6 +818,35 @@ def update_post_approval_status(post_id, is_approved):
     finally:
         conn.close()
 
+def update_post_duplicate_of(post_id, duplicate_of_post_id):
+    """Sets (or with None, clears) the near-duplicate flag of a post."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            UPDATE posts SET duplicate_of_post_id = ? WHERE id = ?
+        ''', (duplicate_of_post_id, post_id))
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"SQLite error updating duplicate flag of post {post_id}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def get_posts_flagged_as_duplicate_of(post_id):
+    """Returns (id, content_en, content_ar) of the posts whose duplicate_of_post_id points at the given post."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT id, content_en, content_ar FROM posts WHERE duplicate_of_post_id = ? ORDER BY id
+        ''', (post_id,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
 def get_all_posts_for_ml():
     conn = connect_db()
     cursor = conn.cursor()
@@ -489,6 +877,10 @@ def delete_post_by_id(post_id):
 
         # Delete from posts table (this will also trigger CASCADE delete on post_metrics due to FK)
         cursor.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+        cursor.execute("DELETE FROM post_minhash WHERE post_id = ?", (post_id,))
+        cursor.execute("DELETE FROM post_lsh_buckets WHERE post_id = ?", (post_id,))
+        # A post already scheduled on Facebook keeps its entry until the scheduled post is cancelled there
+        cursor.execute("DELETE FROM publish_outbox WHERE post_id = ? AND state != 'scheduled'", (post_id,))
         conn.commit()
         print(f"Post ID {post_id} successfully deleted from database.")
         return True, image_filename
@@ -587,5 +979,91 @@ def delete_feedback(feedback_id):
     finally:
         conn.close()
 
+# --- API call accounting (api_calls table) ---
+
+def save_api_call(call_type, provider, model, prompt_tokens, completion_tokens, wall_time_ms,
+                  retries, outcome, estimated_cost, error_message=None, post_id=None):
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            INSERT INTO api_calls (
+                call_type, provider, model, prompt_tokens, completion_tokens, wall_time_ms,
+                retries, outcome, estimated_cost, error_message, post_id
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (call_type, provider, model, prompt_tokens, completion_tokens, wall_time_ms,
+              retries, outcome, estimated_cost, error_message, post_id))
+        call_id = cursor.lastrowid
+        if post_id is not None:
+            cursor.execute("INSERT INTO api_call_posts (call_id, post_id) VALUES (?, ?)", (call_id, post_id))
+        conn.commit()
+        return call_id
+    except sqlite3.Error as e:
+        print(f"SQLite error recording API call: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+def link_api_calls_to_post(call_ids, post_id):
+    """
+    Links calls to a post. A call already linked to other posts (a batch call shared by several posts) keeps
+    its first post in api_calls.post_id, and its cost is split evenly between all of them in api_call_posts.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    try:
+        call_ids = list(dict.fromkeys(call_ids))
+        cursor.executemany("UPDATE api_calls SET post_id = ? WHERE id = ? AND post_id IS NULL", [(post_id, call_id) for call_id in call_ids])
+        cursor.executemany("INSERT OR IGNORE INTO api_call_posts (call_id, post_id) VALUES (?, ?)", [(call_id, post_id) for call_id in call_ids])
+        cursor.executemany('''
+            UPDATE api_call_posts SET share = 1.0 / (SELECT COUNT(*) FROM api_call_posts AS linked WHERE linked.call_id = ?)
+            WHERE call_id = ?
+        ''', [(call_id, call_id) for call_id in call_ids])
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"SQLite error linking API calls to post {post_id}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def get_api_call_stats():
+    """Returns the api_call_stats view as a list of dicts, most expensive provider/model first."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT call_type, provider, model, calls, successes, failures, avg_wall_time_ms, max_wall_time_ms,
+               prompt_tokens, completion_tokens, retries, avg_retries, estimated_cost, last_call_at
+        FROM api_call_stats
+        ORDER BY estimated_cost DESC, calls DESC
+    ''')
+    columns = [description[0] for description in cursor.description]
+    stats = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    conn.close()
+    return stats
+
+def get_api_cost_summary():
+    """Returns overall totals plus the average estimated cost per post that has linked calls."""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*), SUM(COALESCE(estimated_cost, 0.0)), AVG(wall_time_ms)
+        FROM api_calls
+    ''')
+    total_calls, total_cost, avg_wall_time_ms = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*), AVG(estimated_cost) FROM api_cost_per_post")
+    posts_with_calls, avg_cost_per_post = cursor.fetchone()
+    conn.close()
+    return {
+        'total_calls': total_calls or 0,
+        'total_cost': total_cost or 0.0,
+        'avg_wall_time_ms': avg_wall_time_ms or 0.0,
+        'posts_with_calls': posts_with_calls or 0,
+        'avg_cost_per_post': avg_cost_per_post or 0.0
+    }
+
 # Ensure tables are created when this module is imported or run directly
 create_tables()
\ No newline at end of file
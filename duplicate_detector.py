@@ -0,0 +1,257 @@
+# duplicate_detector.py
+#
+# Near-duplicate detection for generated posts using MinHash signatures and LSH banding,
+# stored in SQLite (tables post_minhash and post_lsh_buckets, created by database_manager).
+#
+# A candidate draft is hashed into NUM_BANDS bucket keys; an indexed lookup on (band, bucket)
+# returns only the few historical posts that share a band, and their stored signatures are compared
+# to estimate Jaccard similarity. Nothing but the candidates' signatures is ever loaded.
+
+import sys
+import re
+import random
+import hashlib
+import struct
+import unicodedata
+
+import database_manager
+
+# --- Debugging setup ---
+DEBUG_DUPLICATE_MODE = True
+
+def debug_duplicate_print(message):
+    if DEBUG_DUPLICATE_MODE:
+        print(f"[DEBUG - Duplicates]: {message}")
+
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+SHINGLE_SIZE = 3 # words per shingle
+DEFAULT_SIMILARITY_THRESHOLD = 0.7 # estimated Jaccard similarity at or above which two posts are near-duplicates
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Fixed seed: signatures are persisted, so the permutations must be identical in every process
+_rng = random.Random(20250713)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+_ARABIC_DIACRITICS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+_URL_PATTERN = re.compile(r'https?://\S+|www\.\S+')
+_NON_WORD = re.compile(r'[^\w\s#]+')
+
+def _stable_hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def normalize_text(text):
+    """Lowercases, strips URLs, punctuation, Arabic diacritics/tatweel and unifies alef/yeh/teh marbuta forms."""
+    text = unicodedata.normalize('NFKC', text or "").lower()
+    text = _URL_PATTERN.sub(' ', text)
+    text = _ARABIC_DIACRITICS.sub('', text)
+    text = re.sub('[\u0622\u0623\u0625]', '\u0627', text).replace('\u0649', '\u064A').replace('\u0629', '\u0647')
+    text = _NON_WORD.sub(' ', text)
+    return text.split()
+
+def shingles(text):
+    """Word n-gram shingles of the normalized text. Very short texts fall back to their individual words."""
+    words = normalize_text(text)
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash_signature(text):
+    """Returns the MinHash signature (list of NUM_PERMUTATIONS ints) of the text, or None if it has no words."""
+    shingle_hashes = [_stable_hash64(s) for s in shingles(text)]
+    if not shingle_hashes:
+        return None
+    return [
+        min((a * h + b) % _MERSENNE_PRIME for h in shingle_hashes)
+        for a, b in _PERMUTATIONS
+    ]
+
+def _band_buckets(signature):
+    """Hashes each band of the signature to a signed 64-bit bucket key (SQLite INTEGER range)."""
+    buckets = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f'>{ROWS_PER_BAND}Q', *rows), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))
+    return buckets
+
+def _pack_signature(signature):
+    return struct.pack(f'>{NUM_PERMUTATIONS}Q', *signature)
+
+def _unpack_signature(blob):
+    return struct.unpack(f'>{NUM_PERMUTATIONS}Q', blob)
+
+def estimate_similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity: the fraction of MinHash positions that agree."""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERMUTATIONS
+
+def _is_indexable(text):
+    return bool(text) and not text.startswith("Generation failed") and not text.startswith("ERROR")
+
+def index_post(post_id, content_en=None, content_ar=None, conn=None):
+    """
+    Adds (or replaces) a post's EN/AR signatures in the index. Pass an open connection to batch several
+    posts into one transaction; otherwise a connection is opened and committed here.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = database_manager.connect_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM post_minhash WHERE post_id = ?", (post_id,))
+        cursor.execute("DELETE FROM post_lsh_buckets WHERE post_id = ?", (post_id,))
+        for language, content in (("en", content_en), ("ar", content_ar)):
+            if not _is_indexable(content):
+                continue
+            signature = minhash_signature(content)
+            if signature is None:
+                continue
+            cursor.execute("INSERT INTO post_minhash (post_id, language, signature) VALUES (?, ?, ?)",
+                           (post_id, language, _pack_signature(signature)))
+            cursor.executemany("INSERT INTO post_lsh_buckets (band, bucket, post_id, language) VALUES (?, ?, ?, ?)",
+                               [(band, bucket, post_id, language) for band, bucket in enumerate(_band_buckets(signature))])
+        if own_conn:
+            conn.commit()
+        return True
+    except Exception as e:
+        print(f"ERROR: Could not index post {post_id} for duplicate detection: {e}")
+        if own_conn:
+            conn.rollback()
+        return False
+    finally:
+        if own_conn:
+            conn.close()
+
+def find_near_duplicates(text, language, threshold=DEFAULT_SIMILARITY_THRESHOLD, exclude_post_id=None, conn=None):
+    """
+    Finds indexed posts whose text in the same language is a near-duplicate of `text`.
+
+    Returns:
+        list: (post_id, estimated_similarity) tuples at or above threshold, most similar first.
+    """
+    if not _is_indexable(text):
+        return []
+    signature = minhash_signature(text)
+    if signature is None:
+        return []
+
+    own_conn = conn is None
+    if own_conn:
+        conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        band_clauses = " OR ".join(["(band = ? AND bucket = ?)"] * NUM_BANDS)
+        params = [value for band, bucket in enumerate(_band_buckets(signature)) for value in (band, bucket)]
+        cursor.execute(f'''
+            SELECT DISTINCT m.post_id, m.signature
+            FROM post_lsh_buckets b
+            JOIN post_minhash m ON m.post_id = b.post_id AND m.language = b.language
+            WHERE b.language = ? AND ({band_clauses})
+        ''', [language] + params)
+
+        matches = []
+        for post_id, blob in cursor.fetchall():
+            if post_id == exclude_post_id:
+                continue
+            similarity = estimate_similarity(signature, _unpack_signature(blob))
+            if similarity >= threshold:
+                matches.append((post_id, similarity))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+    finally:
+        if own_conn:
+            conn.close()
+
+def find_duplicate_of_post(content_en, content_ar, threshold=DEFAULT_SIMILARITY_THRESHOLD, exclude_post_id=None):
+    """
+    Checks a draft's EN and AR text against the index.
+
+    Returns:
+        tuple: (post_id, similarity, language) of the closest near-duplicate, or None if the draft is original.
+    """
+    best = None
+    for language, content in (("en", content_en), ("ar", content_ar)):
+        matches = find_near_duplicates(content, language, threshold, exclude_post_id)
+        if matches and (best is None or matches[0][1] > best[1]):
+            best = (matches[0][0], matches[0][1], language)
+    return best
+
+def _find_earlier_duplicate(post_id, content_en, content_ar, threshold):
+    """Like find_duplicate_of_post, but only posts older than `post_id` count, as they did when it was generated."""
+    best = None
+    for language, content in (("en", content_en), ("ar", content_ar)):
+        matches = [match for match in find_near_duplicates(content, language, threshold) if match[0] < post_id]
+        if matches and (best is None or matches[0][1] > best[1]):
+            best = (matches[0][0], matches[0][1], language)
+    return best[0] if best else None
+
+def _recheck_posts_flagged_as_duplicate_of(post_id, threshold):
+    for flagged_id, content_en, content_ar in database_manager.get_posts_flagged_as_duplicate_of(post_id):
+        duplicate_of_post_id = _find_earlier_duplicate(flagged_id, content_en, content_ar, threshold)
+        if duplicate_of_post_id != post_id:
+            debug_duplicate_print(f"Post {flagged_id} duplicate flag: {post_id} -> {duplicate_of_post_id}")
+            database_manager.update_post_duplicate_of(flagged_id, duplicate_of_post_id)
+
+def update_edited_post(post_id, content_en, content_ar, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Call after a post's text is edited: re-indexes it and recomputes its duplicate_of_post_id, and that of
+    the posts flagged as duplicates of it (the edit may have made them original).
+    """
+    index_post(post_id, content_en, content_ar)
+    database_manager.update_post_duplicate_of(post_id, _find_earlier_duplicate(post_id, content_en, content_ar, threshold))
+    _recheck_posts_flagged_as_duplicate_of(post_id, threshold)
+
+def update_deleted_post(post_id, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Call after a post is deleted (database_manager.delete_post_by_id() already drops its index rows):
+    posts flagged as duplicates of it are pointed at their next closest earlier post, or cleared.
+    """
+    _recheck_posts_flagged_as_duplicate_of(post_id, threshold)
+
+def backfill_index(batch_size=500):
+    """
+    Indexes every post that is not in the index yet. Rows are streamed in batches so memory use stays
+    flat regardless of how many posts the database holds.
+    """
+    read_conn = database_manager.connect_db()
+    write_conn = database_manager.connect_db()
+    indexed = 0
+    try:
+        read_cursor = read_conn.cursor()
+        read_cursor.execute('''
+            SELECT id, content_en, content_ar FROM posts
+            WHERE id NOT IN (SELECT DISTINCT post_id FROM post_minhash)
+            ORDER BY id
+        ''')
+        while True:
+            rows = read_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for post_id, content_en, content_ar in rows:
+                if index_post(post_id, content_en, content_ar, conn=write_conn):
+                    indexed += 1
+            write_conn.commit()
+            debug_duplicate_print(f"Indexed {indexed} posts so far...")
+    finally:
+        read_conn.close()
+        write_conn.close()
+    print(f"Duplicate index backfill complete. {indexed} posts indexed.")
+    return indexed
+
+if __name__ == '__main__':
+    # Usage: python duplicate_detector.py backfill
+    #        python duplicate_detector.py check <post_id>
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+        backfill_index()
+    elif len(sys.argv) > 2 and sys.argv[1] == 'check':
+        post = database_manager.get_post_details_by_db_id(int(sys.argv[2]))
+        if not post:
+            print(f"Post {sys.argv[2]} not found.")
+            sys.exit(1)
+        duplicate = find_duplicate_of_post(post['content_en'], post['content_ar'], exclude_post_id=post['id'])
+        print(f"Closest near-duplicate: {duplicate}" if duplicate else "No near-duplicates found.")
+    else:
+        print("Usage: python duplicate_detector.py backfill | check <post_id>")
+        sys.exit(1)
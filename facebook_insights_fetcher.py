@@ -1,19 +1,17 @@
-import requests
 import sys
 
+import graph_client
+
 def fetch_post_engagement_metrics(post_id, access_token):
     """
     Fetches reactions, comments, and shares from the post object.
     """
-    url = f"https://graph.facebook.com/v19.0/{post_id}"
     params = {
         'fields': 'reactions.summary(true),comments.summary(true),shares',
         'access_token': access_token
     }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = graph_client.get_client().get(post_id, params=params, timeout=10)
 
         return {
             'likes': data.get('reactions', {}).get('summary', {}).get('total_count', 0),
@@ -29,16 +27,13 @@ def fetch_post_insight_metrics(post_id, access_token):
     """
     Fetches post reach (impressions) from the /insights endpoint.
     """
-    url = f"https://graph.facebook.com/v19.0/{post_id}/insights"
     params = {
         'metric': 'post_impressions_unique',
         'period': 'lifetime',
         'access_token': access_token
     }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = graph_client.get_client().get(f"{post_id}/insights", params=params, timeout=10)
 
         for item in data.get('data', []):
             if item['name'] == 'post_impressions_unique':
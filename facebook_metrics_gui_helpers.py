@@ -3,20 +3,19 @@
 import requests
 import json
 
+import graph_client
+
 def fetch_post_engagement_metrics(post_id, access_token):
     """
     Fetches reactions, comments, and shares from the post object.
     Returns a dictionary of metrics, or None on API error.
     """
-    url = f"https://graph.facebook.com/v19.0/{post_id}"
     params = {
         'fields': 'reactions.summary(true),comments.summary(true),shares',
         'access_token': access_token
     }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status() # This will raise an HTTPError for 4xx/5xx responses
-        data = response.json()
+        data = graph_client.get_client().get(post_id, params=params, timeout=10) # Raises GraphAPIError for 4xx/5xx responses
 
         return {
             'likes': data.get('reactions', {}).get('summary', {}).get('total_count', 0),
@@ -24,21 +23,15 @@ def fetch_post_engagement_metrics(post_id, access_token):
             'shares': data.get('shares', {}).get('count', 0),
         }
 
-    except requests.exceptions.HTTPError as e:
-        error_details = "N/A"
-        if e.response is not None:
-            try:
-                error_details = e.response.json()
-            except json.JSONDecodeError:
-                error_details = e.response.text # Fallback to raw text if not JSON
-        print(f"[ERROR] fetch_post_engagement_metrics HTTP Error for {post_id}: {e.response.status_code} - {error_details}")
+    except graph_client.GraphAPIError as e:
+        print(f"[ERROR] fetch_post_engagement_metrics HTTP Error for {post_id}: {e.status_code} - {e}")
         # Return None to explicitly indicate API call failure
         return None
     except requests.exceptions.RequestException as e:
         print(f"[ERROR] fetch_post_engagement_metrics Request Error for {post_id}: {e}")
         return None
     except json.JSONDecodeError as e:
-        print(f"[ERROR] fetch_post_engagement_metrics JSON Decode Error for {post_id}: {e}. Response was: {response.text}")
+        print(f"[ERROR] fetch_post_engagement_metrics JSON Decode Error for {post_id}: {e}")
         return None
     except Exception as e:
         print(f"[ERROR] fetch_post_engagement_metrics Unexpected Error for {post_id}: {e}")
@@ -50,36 +43,27 @@ def fetch_post_insight_metrics(post_id, access_token):
     Fetches post reach (post_impressions_unique) from the /insights endpoint.
     Returns a dictionary of metrics, or None on API error.
     """
-    url = f"https://graph.facebook.com/v19.0/{post_id}/insights"
     params = {
         'metric': 'post_impressions_unique',
         'period': 'lifetime',
         'access_token': access_token
     }
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status() # This will raise an HTTPError for 4xx/5xx responses
-        data = response.json()
+        data = graph_client.get_client().get(f"{post_id}/insights", params=params, timeout=10) # Raises GraphAPIError for 4xx/5xx responses
 
         for item in data.get('data', []):
             if item['name'] == 'post_impressions_unique':
                 return {'reach': item['values'][0]['value']}
         return {'reach': 0} # Return 0 if metric not found in response
 
-    except requests.exceptions.HTTPError as e:
-        error_details = "N/A"
-        if e.response is not None:
-            try:
-                error_details = e.response.json()
-            except json.JSONDecodeError:
-                error_details = e.response.text # Fallback to raw text if not JSON
-        print(f"[ERROR] fetch_post_insight_metrics HTTP Error for {post_id}: {e.response.status_code} - {error_details}")
+    except graph_client.GraphAPIError as e:
+        print(f"[ERROR] fetch_post_insight_metrics HTTP Error for {post_id}: {e.status_code} - {e}")
         return None
     except requests.exceptions.RequestException as e:
         print(f"[ERROR] fetch_post_insight_metrics Request Error for {post_id}: {e}")
         return None
     except json.JSONDecodeError as e:
-        print(f"[ERROR] fetch_post_insight_metrics JSON Decode Error for {post_id}: {e}. Response was: {response.text}")
+        print(f"[ERROR] fetch_post_insight_metrics JSON Decode Error for {post_id}: {e}")
         return None
     except Exception as e:
         print(f"[ERROR] fetch_post_insight_metrics Unexpected Error for {post_id}: {e}")
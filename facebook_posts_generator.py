@@ -13,7 +13,13 @@ import database_manager
 
 # Import your new modularized generator libraries
 import text_generator
-import image_generator
+import image_generation_service
+import image_prompt_cache
+import image_phash_index
+import api_usage_tracker
+import duplicate_detector
+import ollama_client
+import slot_allocator
 
 # Set up logging or print directly for subprocess output
 def log_output(message):
@@ -49,6 +55,50 @@ def calculate_schedule_times(start_date_str, start_time_str, num_posts, posts_pe
     return schedule
 
 
+def generate_single_post_text(args, prompt_en, prompt_ar, text_model, contact_info_en, contact_info_ar, temperature):
+    """Generates one post's text, using a single bilingual call for 'Both' posts unless disabled."""
+    if args.post_language == "Both" and not args.separate_language_calls:
+        return text_generator.generate_text_bilingual(
+            prompt_en=prompt_en,
+            prompt_ar=prompt_ar,
+            provider=args.text_gen_provider,
+            model=text_model,
+            temperature=temperature,
+            contact_info_en=contact_info_en,
+            contact_info_ar=contact_info_ar
+        )
+    return text_generator.generate_text(
+        prompt_en=prompt_en,
+        prompt_ar=prompt_ar,
+        target_language=args.post_language,
+        provider=args.text_gen_provider,
+        model=text_model,
+        temperature=temperature,
+        contact_info_en=contact_info_en,
+        contact_info_ar=contact_info_ar
+    )
+
+
+def build_image_prompts(selected_topic_obj, default_prompts, topic_name, post_language):
+    """Returns (image_prompt_en, image_prompt_ar, image_prompt_to_use) for a post about the topic."""
+    final_image_prompt_en = selected_topic_obj.get("english_image_prompt", "")
+    final_image_prompt_ar = selected_topic_obj.get("arabic_image_prompt", "")
+
+    if not final_image_prompt_en:
+        final_image_prompt_en = default_prompts.get("default_image_prompt_en", f"A relevant image for a post about {topic_name}.")
+    if not final_image_prompt_ar:
+        final_image_prompt_ar = default_prompts.get("default_image_prompt_ar", f"صورة ذات صلة بمنشور حول {topic_name}.")
+
+    # Choose image prompt based on language
+    image_prompt_to_use = ""
+    if post_language == "English" or post_language == "Both":
+        image_prompt_to_use = final_image_prompt_en
+    if post_language == "Arabic" and not image_prompt_to_use:
+        image_prompt_to_use = final_image_prompt_ar
+    if not image_prompt_to_use:
+        image_prompt_to_use = "A generic automotive part or vehicle related image."
+    return final_image_prompt_en, final_image_prompt_ar, image_prompt_to_use
+
 def main():
     parser = argparse.ArgumentParser(description="Generate Facebook Posts with AI and save to database.")
     parser.add_argument("--action", type=str, required=True, help="Action to perform: 'generate', 'generate_image_only', or 'train_ml'.")
@@ -57,6 +107,7 @@ def main():
     parser.add_argument("--text_gen_provider", type=str, default="Gemini", help="Text generation AI provider (Gemini, OpenAI, or DeepSeek).")
     parser.add_argument("--gemini_text_model", type=str, default="gemini-1.5-flash", help="Gemini model to use for text generation.")
     parser.add_argument("--openai_text_model", type=str, default="gpt-3.5-turbo", help="OpenAI text model to use for text generation.")
+    parser.add_argument("--local_text_model", type=str, default=None, help="Ollama model to use with a local provider (DeepSeek, Mistral). Defaults to the provider's usual model.")
     parser.add_argument("--openai_image_model", type=str, default="dall-e-3", help="OpenAI image model to use for image generation.")
     parser.add_argument("--temperature", type=float, default=0.7, help="Temperature for text generation (0.0 to 1.0).")
     parser.add_argument("--start_date", type=str, default=datetime.now().strftime("%Y-%m-%d"), help="Start date for post scheduling (YYYY-MM-DD). (Used with 'generate' action)")
@@ -65,12 +116,22 @@ def main():
     parser.add_argument("--interval_hours", type=float, default=24.0, help="Interval in hours between posts if posts_per_day is 1. (Used with 'generate' action)")
     parser.add_argument("--post_language", type=str, default="Both", help="Language for posts: 'English', 'Arabic', or 'Both'. (Used with 'generate' action)")
     parser.add_argument("--page_data_path", type=str, required=False, help="Path to a temporary JSON file containing the selected Facebook page data. (Used with 'generate' action)")
+    parser.add_argument("--separate_language_calls", action="store_true", help="For 'Both' posts, generate EN and AR with separate LLM calls instead of one bilingual call. (Used with 'generate' action)")
+    parser.add_argument("--duplicate_threshold", type=float, default=duplicate_detector.DEFAULT_SIMILARITY_THRESHOLD, help="Estimated similarity (0-1) at which a draft counts as a near-duplicate of an existing post. (Used with 'generate' action)")
+    parser.add_argument("--max_duplicate_retries", type=int, default=2, help="How many times to regenerate a near-duplicate draft before saving it flagged. (Used with 'generate' action)")
+    parser.add_argument("--image_duplicate_distance", type=int, default=image_phash_index.DEFAULT_MAX_DISTANCE, help="Perceptual-hash Hamming distance at or below which an image counts as a near-duplicate of another page's image. 0 disables the check. (Used with 'generate' action)")
+    parser.add_argument("--max_image_duplicate_retries", type=int, default=1, help="How many times to re-render an image that duplicates another page's image before accepting it. (Used with 'generate' action)")
+    parser.add_argument("--ignore_occupied_slots", action="store_true", help="Use the computed schedule as is, even where posts already occupy those hours. (Used with 'generate' action)")
+    parser.add_argument("--min_page_gap_hours", type=int, default=slot_allocator.SLOT_MIN_PAGE_GAP_HOURS, help="Minimum hours between two posts of the same page when placing new posts. (Used with 'generate' action)")
+    parser.add_argument("--max_posts_per_hour", type=int, default=slot_allocator.SLOT_MAX_POSTS_PER_HOUR, help="Maximum posts across all pages in one hour when placing new posts. (Used with 'generate' action)")
+    parser.add_argument("--text_batch_size", type=int, default=5, help="Max posts per topic requested in a single LLM call when a topic has several slots. 1 disables batching. (Used with 'generate' action)")
 
     # NEW ARGUMENTS FOR SINGLE IMAGE GENERATION / REVIEW
     parser.add_argument("--image_prompt", type=str, required=False, help="Specific image prompt to use for single image generation. (Used with 'generate_image_only' action)")
     parser.add_argument("--post_id", type=int, required=False, help="ID of the post in the database to update the image for. (Used with 'generate_image_only' action)")
     parser.add_argument("--topic_name", type=str, required=False, help="The topic name associated with the post. (Optional, for logging/context)")
     parser.add_argument("--image_gen_provider", type=str, default="OpenAI (DALL-E)", help="Image generation AI provider (OpenAI (DALL-E) or Google (Imagen)).")
+    parser.add_argument("--image_cache_policy", type=str, default=image_prompt_cache.IMAGE_CACHE_POLICY, choices=image_prompt_cache.CACHE_POLICIES, help="Reuse of previously generated images for the same prompt: off, always_new, fill_then_reuse or round_robin.")
 
 
     args = parser.parse_args()
@@ -123,22 +184,69 @@ def main():
 
         log_output(f"Generating {args.num_posts} posts for page '{page_name}'.")
         log_output(f"Posts per day: {args.posts_per_day}, Start date: {args.start_date}, Start time: {args.start_time}")
-        log_output(f"Text Gen Provider: {args.text_gen_provider}, Text Model: {args.gemini_text_model if args.text_gen_provider == 'Gemini' else args.openai_text_model}")
+        if args.text_gen_provider in text_generator.LOCAL_LLM_PROVIDERS:
+            text_model = args.local_text_model or text_generator.LOCAL_LLM_DEFAULT_MODELS[args.text_gen_provider]
+        else:
+            text_model = args.gemini_text_model if args.text_gen_provider == "Gemini" else args.openai_text_model
+        log_output(f"Text Gen Provider: {args.text_gen_provider}, Text Model: {text_model}")
         log_output(f"Image Model: {args.openai_image_model}")
 
+        if args.text_gen_provider in text_generator.LOCAL_LLM_PROVIDERS:
+            # Start loading the local model now so the first post does not pay the cold load
+            ollama_client.get_client().warm_model_async(text_model)
+
         scheduled_times = calculate_schedule_times(
             args.start_date, args.start_time, args.num_posts, args.posts_per_day, args.interval_hours
         )
+        # The cadence above knows nothing about posts already queued (earlier runs, sibling pages), so each
+        # post is moved to the nearest free slot at or after its intended time
+        allocator = None if args.ignore_occupied_slots else slot_allocator.SlotAllocator(
+            min_page_gap_hours=args.min_page_gap_hours, max_posts_per_hour=args.max_posts_per_hour)
+
+        # How many slots each topic gets in this run, so topics with several slots can be batched
+        remaining_slots_per_topic = {}
+        for i in range(args.num_posts):
+            remaining_slots_per_topic[i % len(topics)] = remaining_slots_per_topic.get(i % len(topics), 0) + 1
+        pending_texts_per_topic = {} # topic index -> list of pre-generated (content_en, content_ar, prompt_en, prompt_ar)
+
+        # Image prompts do not depend on the generated text, so images are rendered on the shared image pool
+        # (which caps concurrency per provider/model) while text is generated. Only as many renders as the pool
+        # has workers are queued ahead of the text loop, so a failed or aborted run wastes little image spend.
+        image_service = image_generation_service.get_service()
+        image_prompts = []
+        for i in range(args.num_posts):
+            topic_obj = topics[i % len(topics)]
+            image_prompts.append(build_image_prompts(topic_obj, default_prompts, topic_obj['name'], args.post_language))
+        image_futures = [None] * args.num_posts
+
+        def submit_image(post_index):
+            # DEBUG: Print specific image prompts before image generation
+            log_output(f"DEBUG_GENERATOR: Final Image Prompt for post {post_index+1}: {image_prompts[post_index][2][:100]}...")
+            image_futures[post_index] = image_service.submit_one(
+                prompt=image_prompts[post_index][2],
+                output_dir=args.output_dir, # Pass the base output dir; image_generator handles subdirectory
+                provider=args.image_gen_provider,
+                model=args.openai_image_model, # Assuming openai_image_model covers all image models for CLI
+                cache_policy=args.image_cache_policy
+            )
 
         for i in range(args.num_posts):
             if not topics: # Safety check if topics list somehow becomes empty
                 log_output("ERROR: Topics list is empty. Cannot generate more posts.")
                 break
 
-            selected_topic_obj = topics[i % len(topics)] # Cycle through topics
+            # Keep this post's image and the next few in flight while this post's text is generated
+            for ahead in range(i, min(i + image_service.max_workers, args.num_posts)):
+                if image_futures[ahead] is None:
+                    submit_image(ahead)
+
+            topic_index = i % len(topics)
+            selected_topic_obj = topics[topic_index] # Cycle through topics
             topic_name = selected_topic_obj['name']
 
             scheduled_datetime = scheduled_times[i] if i < len(scheduled_times) else (datetime.now() + timedelta(days=i))
+            if allocator is not None:
+                scheduled_datetime = allocator.place(page_name, scheduled_datetime)
             post_date = scheduled_datetime.strftime("%Y-%m-%d")
             post_hour = scheduled_datetime.hour
 
@@ -158,47 +266,92 @@ def main():
             log_output(f"DEBUG_GENERATOR: Final AR Text Prompt: {final_text_prompt_ar[:100]}...")
             # END DEBUG
 
-            # Call the modular text_generator
-            content_en, content_ar, actual_text_prompt_sent_en, actual_text_prompt_sent_ar = text_generator.generate_text(
-                prompt_en=final_text_prompt_en,
-                prompt_ar=final_text_prompt_ar,
-                target_language=args.post_language,
-                provider=args.text_gen_provider,
-                model=args.gemini_text_model if args.text_gen_provider == "Gemini" else args.openai_text_model,
-                temperature=args.temperature,
-                contact_info_en=page_contact_info_en,
-                contact_info_ar=page_contact_info_ar
-            )
-
-            # Determine final image prompts
-            final_image_prompt_en = selected_topic_obj.get("english_image_prompt", "")
-            final_image_prompt_ar = selected_topic_obj.get("arabic_image_prompt", "")
-
-            if not final_image_prompt_en:
-                final_image_prompt_en = default_prompts.get("default_image_prompt_en", f"A relevant image for a post about {topic_name}.")
-            if not final_image_prompt_ar:
-                final_image_prompt_ar = default_prompts.get("default_image_prompt_ar", f"صورة ذات صلة بمنشور حول {topic_name}.")
-
-            # Choose image prompt based on language
-            image_prompt_to_use = ""
-            if args.post_language == "English" or args.post_language == "Both":
-                image_prompt_to_use = final_image_prompt_en
-            if args.post_language == "Arabic" and not image_prompt_to_use:
-                image_prompt_to_use = final_image_prompt_ar
-            if not image_prompt_to_use:
-                image_prompt_to_use = "A generic automotive part or vehicle related image."
-
-            # DEBUG: Print specific image prompts before image generation
-            log_output(f"DEBUG_GENERATOR: Final Image Prompt for generation: {image_prompt_to_use[:100]}...")
-            # END DEBUG
-
-            # Call the modular image_generator
-            generated_image_filename = image_generator.generate_image(
-                prompt=image_prompt_to_use,
-                output_dir=args.output_dir, # Pass the base output dir; image_generator handles subdirectory
-                provider=args.image_gen_provider,
-                model=args.openai_image_model # Assuming openai_image_model covers all image models for CLI
-            )
+            # Call the modular text_generator. Topics with several slots in this run get their posts
+            # in one batched call per language; the extra posts are kept for the topic's later slots.
+            pending_texts = pending_texts_per_topic.setdefault(topic_index, [])
+            if not pending_texts:
+                batch_size = min(remaining_slots_per_topic[topic_index], max(args.text_batch_size, 1), text_generator.MAX_BATCH_SIZE)
+                if batch_size > 1:
+                    log_output(f"Generating {batch_size} posts for topic '{topic_name}' in one batch.")
+                    # The batch's calls are linked to every post it produces, so each carries its share of the cost
+                    batch_call_ids = []
+                    with api_usage_tracker.collect_pending_calls_into(batch_call_ids):
+                        batch_texts = text_generator.generate_text_batch(
+                            prompt_en=final_text_prompt_en,
+                            prompt_ar=final_text_prompt_ar,
+                            target_language=args.post_language,
+                            provider=args.text_gen_provider,
+                            model=text_model,
+                            n=batch_size,
+                            temperature=args.temperature,
+                            contact_info_en=page_contact_info_en,
+                            contact_info_ar=page_contact_info_ar,
+                            bilingual=not args.separate_language_calls
+                        )
+                    pending_texts.extend((text, batch_call_ids) for text in batch_texts)
+                else:
+                    pending_texts.append((generate_single_post_text(
+                        args, final_text_prompt_en, final_text_prompt_ar, text_model,
+                        page_contact_info_en, page_contact_info_ar, args.temperature
+                    ), [])) # Recorded on this thread already
+            (content_en, content_ar, actual_text_prompt_sent_en, actual_text_prompt_sent_ar), shared_call_ids = pending_texts.pop(0)
+            api_usage_tracker.adopt_pending_calls(shared_call_ids)
+            remaining_slots_per_topic[topic_index] -= 1
+
+            # Topics cycle, so check the draft against every earlier post (including this run's) and
+            # regenerate near-duplicates; if it still collides, save it flagged for review.
+            duplicate_of_post_id = None
+            duplicate = duplicate_detector.find_duplicate_of_post(content_en, content_ar, args.duplicate_threshold)
+            regeneration_attempts = 0
+            while duplicate and regeneration_attempts < args.max_duplicate_retries:
+                regeneration_attempts += 1
+                log_output(f"Draft for topic '{topic_name}' is a near-duplicate of post {duplicate[0]} "
+                           f"({duplicate[2].upper()}, similarity {duplicate[1]:.2f}). "
+                           f"Regenerating ({regeneration_attempts}/{args.max_duplicate_retries})...")
+                with api_usage_tracker.recording_retry(regeneration_attempts):
+                    content_en, content_ar, actual_text_prompt_sent_en, actual_text_prompt_sent_ar = generate_single_post_text(
+                        args, final_text_prompt_en, final_text_prompt_ar, text_model,
+                        page_contact_info_en, page_contact_info_ar,
+                        min(args.temperature + 0.1 * regeneration_attempts, 1.0) # Nudge towards a different draft
+                    )
+                duplicate = duplicate_detector.find_duplicate_of_post(content_en, content_ar, args.duplicate_threshold)
+            if duplicate:
+                duplicate_of_post_id = duplicate[0]
+                log_output(f"WARNING: Post for topic '{topic_name}' is still a near-duplicate of post {duplicate[0]} "
+                           f"(similarity {duplicate[1]:.2f}). Saving it flagged for review.")
+
+            # Wait for this post's image, which has been generating in the background since a few posts ago
+            final_image_prompt_en, final_image_prompt_ar, image_prompt_to_use = image_prompts[i]
+            generated_image_filename = image_futures[i].result()
+            api_usage_tracker.adopt_pending_calls(image_futures[i].api_call_ids)
+
+            # Image prompts are shared across topics and pages; re-render if this image is visually
+            # near-identical to one already used on another page.
+            image_regeneration_attempts = 0
+            while generated_image_filename and args.image_duplicate_distance > 0:
+                similar_posts = [match for match in image_phash_index.find_posts_with_similar_image(
+                                     args.output_dir, generated_image_filename, args.image_duplicate_distance)
+                                 if match[1] != page_name]
+                if not similar_posts:
+                    break
+                if image_regeneration_attempts >= args.max_image_duplicate_retries:
+                    log_output(f"WARNING: Image for post {i+1} still resembles the image of post {similar_posts[0][0]} "
+                               f"on page '{similar_posts[0][1]}' (distance {similar_posts[0][3]}). Keeping it.")
+                    break
+                image_regeneration_attempts += 1
+                log_output(f"Image for post {i+1} resembles the image of post {similar_posts[0][0]} on page "
+                           f"'{similar_posts[0][1]}' (distance {similar_posts[0][3]}). Re-rendering "
+                           f"({image_regeneration_attempts}/{args.max_image_duplicate_retries})...")
+                retry_future = image_service.submit_one(
+                    prompt=image_prompt_to_use,
+                    output_dir=args.output_dir,
+                    provider=args.image_gen_provider,
+                    model=args.openai_image_model,
+                    cache_policy="always_new", # A cached variant could be the very image being rejected
+                    attempt=image_regeneration_attempts
+                )
+                generated_image_filename = retry_future.result()
+                api_usage_tracker.adopt_pending_calls(retry_future.api_call_ids)
 
             post_id = database_manager.save_generated_post(
                 page_name=page_name,
@@ -212,17 +365,21 @@ def main():
                 topic=topic_name,
                 language=args.post_language,
                 text_gen_provider=args.text_gen_provider,
-                text_gen_model=args.gemini_text_model if args.text_gen_provider == "Gemini" else args.openai_text_model,
+                text_gen_model=text_model,
                 gemini_temperature=args.temperature,
                 facebook_page_id=page_id,
                 facebook_access_token=access_token,
                 is_approved=False,
                 text_gen_prompt_en=actual_text_prompt_sent_en,
-                text_gen_prompt_ar=actual_text_prompt_sent_ar
+                text_gen_prompt_ar=actual_text_prompt_sent_ar,
+                duplicate_of_post_id=duplicate_of_post_id
             )
             if post_id:
                 log_output(f"Post saved to DB with ID: {post_id}")
+                duplicate_detector.index_post(post_id, content_en, content_ar)
+                api_usage_tracker.link_pending_calls_to_post(post_id)
             else:
+                api_usage_tracker.discard_pending_calls()
                 log_output(f"ERROR: Failed to save post for topic '{topic_name}' to database.")
 
             time.sleep(0.5)
@@ -240,12 +397,14 @@ def main():
             log_output("ERROR: Post ID is required to update the database after single image generation.")
             sys.exit(1)
 
-        generated_filename = image_generator.generate_image(
+        generated_filename = image_generation_service.get_service().submit_one(
             args.image_prompt,
             output_dir=args.output_dir,
             provider=args.image_gen_provider,
-            model=args.openai_image_model
-        )
+            model=args.openai_image_model,
+            post_id=args.post_id,
+            cache_policy=args.image_cache_policy
+        ).result()
 
         if generated_filename:
             conn = database_manager.connect_db()
@@ -6,10 +6,20 @@ import requests
 import json
 import time
 import re
-from datetime import datetime
+import urllib.parse
+import contextlib
+import heapq
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from concurrent.futures import ThreadPoolExecutor
 
 import database_manager # Import your database manager
+import publish_outbox
+import image_store
+import image_variants
 import facebook_metrics_gui_helpers # For Facebook API calls
+import graph_client
 
 # --- Debugging setup ---
 DEBUG_SCHEDULER_MODE = True
@@ -18,129 +28,972 @@ def debug_scheduler_print(message):
     if DEBUG_SCHEDULER_MODE:
         print(f"[DEBUG - Scheduler]: {message}")
 
-def post_to_facebook(post_data, base_output_dir): # Renamed output_dir to base_output_dir for clarity
+# Pages are published in parallel; posts to the same page are serialized and spaced by this interval
+MAX_CONCURRENT_PAGES = int(os.getenv('PUBLISH_MAX_CONCURRENT_PAGES', 8))
+PAGE_MIN_INTERVAL_SECONDS = float(os.getenv('PUBLISH_PAGE_MIN_INTERVAL_SECONDS', 2))
+
+# Publishing daemon (python facebook_scheduler.py --daemon <output_directory>)
+DAEMON_MAX_LATENESS_MINUTES = float(os.getenv('PUBLISH_MAX_LATENESS_MINUTES', 30)) # Older slots are skipped, not published late
+DAEMON_LOAD_HORIZON_HOURS = int(os.getenv('PUBLISH_LOAD_HORIZON_HOURS', 24)) # How far ahead posts are kept in memory
+DAEMON_POLL_SECONDS = float(os.getenv('PUBLISH_POLL_SECONDS', 30)) # Longest sleep before checking the DB for edits
+CHANGE_POLL_OVERLAP_SECONDS = 5 # Re-read a little before the last change seen, for transactions that committed late
+
+# Graph API batch requests: several posts (photo upload + feed post each) go out in one HTTP call
+PUBLISH_USE_BATCH = os.getenv('PUBLISH_USE_BATCH', '1') not in ('0', 'false', 'False')
+GRAPH_BATCH_MAX_OPERATIONS = 50 # Graph API limit per batch call
+# Batches are built per page; Facebook runs a batch's items back to back, so this bounds the burst one page gets
+PAGE_BATCH_MAX_POSTS = int(os.getenv('PUBLISH_PAGE_BATCH_MAX_POSTS', 5))
+GRAPH_BATCH_TIMEOUT_SECONDS = 120
+
+# Native Facebook scheduling (published=false + scheduled_publish_time): Facebook accepts 10 minutes to 30 days ahead
+NATIVE_SCHEDULE_MIN_LEAD_SECONDS = 600
+NATIVE_SCHEDULE_MAX_LEAD_DAYS = 30
+NATIVE_SCHEDULE_DEFAULT_DAYS = int(os.getenv('NATIVE_SCHEDULE_DAYS', 7))
+# Pages without a "timezone" (IANA name, e.g. "Africa/Cairo") in config/gui_config.json use this; '' = local time
+PAGE_DEFAULT_TIMEZONE = os.getenv('PAGE_DEFAULT_TIMEZONE', '')
+# Media pre-upload stage: photos of approved posts due within this many hours are uploaded ahead of time
+PREUPLOAD_HOURS_AHEAD = float(os.getenv('PUBLISH_PREUPLOAD_HOURS_AHEAD', 6))
+PREUPLOAD_MAX_WORKERS = int(os.getenv('PUBLISH_PREUPLOAD_MAX_WORKERS', 4))
+PREUPLOAD_INTERVAL_MINUTES = float(os.getenv('PUBLISH_PREUPLOAD_INTERVAL_MINUTES', 15))
+GRAPH_INVALID_PARAMETER_CODE = 100 # Returned for an attached media_fbid Facebook no longer accepts
+GUI_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'gui_config.json')
+
+def build_post_message(post_data):
+    """Text to publish for a post, based on its language ('' if there is no content for it)."""
+    content_en = post_data.get('content_en')
+    content_ar = post_data.get('content_ar')
+    if post_data.get('language') == "English" and content_en:
+        return content_en
+    elif post_data.get('language') == "Arabic" and content_ar:
+        return content_ar
+    elif post_data.get('language') == "Both":
+        if content_en and content_ar:
+            return f"{content_en}\n\n{content_ar}" # Combine both languages
+        return content_en or content_ar or ""
+    return ""
+
+def get_post_upload_path(post_data, base_output_dir):
+    """Path of the image file to upload with a post, or None if it has no (existing) image."""
+    generated_image_filename = post_data.get('generated_image_filename')
+    if not generated_image_filename or generated_image_filename.startswith("ERROR_"):
+        return None
+    # Keys may be sharded ("ab/cd/<hash>.png") or legacy flat names; image_store resolves both
+    image_path = image_store.get_image_path(base_output_dir, generated_image_filename)
+    if not os.path.exists(image_path):
+        print(f"WARNING: Image file not found for Post ID {post_data.get('id')}: {image_path}. Posting without image.")
+        return None
+    # Upload the recompressed variant (built at generation time, or now if missing/stale) instead of the PNG
+    return image_variants.get_upload_image_path(base_output_dir, generated_image_filename)
+
+def upload_unpublished_photo(facebook_page_id, access_token, upload_path):
+    """Uploads a photo with published=false so it can be attached to a feed post later. Returns its media_fbid."""
+    with open(upload_path, 'rb') as img_file:
+        # Using published='false' means it uploads as unpublished, then we attach it to a new feed post.
+        # This is standard when combining text and images.
+        photo_response = graph_client.get_client().post(f"{facebook_page_id}/photos", data={'access_token': access_token, 'published': 'false'},
+                                                        files={'source': img_file}, timeout=60)
+    return photo_response.get('id')
+
+def find_published_post(post_data, since_timestamp):
+    """
+    Looks for a post with this post's message on its page, published (or natively scheduled) after since_timestamp.
+    Returns (Facebook ID, scheduled publish time or None), or None if there is none; raises if the page cannot be
+    queried. Used to settle publishes whose outcome is unknown (timeout or crash after the feed call was sent).
+    """
+    message_to_post = build_post_message(post_data).strip()
+    for edge, fields in (("published_posts", "id,message"), ("scheduled_posts", "id,message,scheduled_publish_time")):
+        params = {'fields': fields, 'limit': 100, 'access_token': post_data['facebook_access_token']}
+        if edge == "published_posts":
+            params['since'] = int(since_timestamp)
+        response = graph_client.get_client().get(f"{post_data['facebook_page_id']}/{edge}", params=params)
+        for page_post in response.get('data', []):
+            if (page_post.get('message') or '').strip() == message_to_post:
+                return page_post.get('id'), page_post.get('scheduled_publish_time')
+    return None
+
+def _settle_unknown_outcome(post_data, started_at, error):
+    """A feed call failed in a way that may still have created the post: check the page before allowing a retry."""
+    db_id = post_data['id']
+    try:
+        found = find_published_post(post_data, started_at - 60)
+    except Exception as e:
+        print(f"WARNING: Outcome of Post ID {db_id} is unknown ({error}) and the page could not be checked ({e}). "
+              f"It stays in '{publish_outbox.PUBLISHING}' until the next recovery scan.")
+        return False, None
+    if found:
+        facebook_post_id, scheduled_publish_time = found
+        if scheduled_publish_time:
+            facebook_post_id = publish_outbox.mark_scheduled(db_id, facebook_post_id, scheduled_publish_time,
+                                                             post_data.get('generated_image_filename'), post_data['facebook_page_id'])
+        else:
+            facebook_post_id = publish_outbox.mark_published(db_id, facebook_post_id, post_data['facebook_page_id'],
+                                                             post_data['facebook_access_token'])
+        print(f"Post ID {db_id} was {'scheduled' if scheduled_publish_time else 'published'} despite the error (FB ID: {facebook_post_id}).")
+        return True, facebook_post_id
+    publish_outbox.mark_failed(db_id, error, retryable=True)
+    return False, None
+
+def _claim_for_publishing(post_data, retry_permanent=False):
+    """
+    Claims a post in the outbox. Returns (entry, None) when this caller should publish it, or
+    (None, (success, facebook_post_id)) when it must not: already published, in flight, or backing off.
+    """
+    db_id = post_data.get('id')
+    entry = publish_outbox.claim(db_id, retry_permanent=retry_permanent)
+    if entry:
+        return entry, None
+    current = publish_outbox.get_entry(db_id)
+    if current and current['state'] == publish_outbox.PUBLISHED:
+        print(f"Post ID {db_id} is already published (FB ID: {current['facebook_post_id']}). Skipping.")
+        return None, (True, current['facebook_post_id'])
+    print(f"Post ID {db_id} is not publishable right now (outbox state '{current['state'] if current else None}'). Skipping.")
+    return None, (False, None)
+
+def post_to_facebook(post_data, base_output_dir, retry_permanent=False, scheduled_publish_time=None): # Renamed output_dir to base_output_dir for clarity
     """
     Posts content to Facebook using the Graph API.
     post_data is expected to be a dictionary with all post details.
+    Progress is recorded in the publish outbox, so the post is never published twice and a stored photo
+    upload (media_fbid) is reused by retries.
+    With scheduled_publish_time (unix seconds), the post is handed to Facebook's scheduler instead of going live now.
     """
     db_id = post_data.get('id')
     page_name = post_data.get('page_name')
-    content_en = post_data.get('content_en')
-    content_ar = post_data.get('content_ar')
-    generated_image_filename = post_data.get('generated_image_filename')
     facebook_page_id = post_data.get('facebook_page_id')
     access_token = post_data.get('facebook_access_token')
 
     debug_scheduler_print(f"Attempting to post DB ID {db_id} to page '{page_name}'.")
 
+    entry, outcome = _claim_for_publishing(post_data, retry_permanent)
+    if outcome:
+        return outcome
+
     if not facebook_page_id or not access_token:
         print(f"ERROR: Failed to schedule Post ID {db_id}: Missing Facebook Page ID or Access Token for page '{page_name}'.")
+        publish_outbox.mark_failed(db_id, "Missing Facebook Page ID or Access Token", retryable=False)
         return False, None
 
-    # Determine which content to post based on language
-    message_to_post = ""
-    if post_data.get('language') == "English" and content_en:
-        message_to_post = content_en
-    elif post_data.get('language') == "Arabic" and content_ar:
-        message_to_post = content_ar
-    elif post_data.get('language') == "Both":
-        if content_en and content_ar:
-            message_to_post = f"{content_en}\n\n{content_ar}" # Combine both languages
-        elif content_en:
-            message_to_post = content_en
-        elif content_ar:
-            message_to_post = content_ar
-    
+    message_to_post = build_post_message(post_data)
     if not message_to_post:
         print(f"ERROR: Failed to schedule Post ID {db_id}: No content generated for selected language(s).")
+        publish_outbox.mark_failed(db_id, "No content for the selected language(s)", retryable=False)
         return False, None
 
-
-    post_url = f"https://graph.facebook.com/v19.0/{facebook_page_id}/feed"
     payload = {
         'message': message_to_post,
         'access_token': access_token
     }
-    
-    attached_image_id = None
-
-    if generated_image_filename and not generated_image_filename.startswith("ERROR_"):
-        # --- CRITICAL FIX: Form the correct image path with the 'generated_images' subfolder ---
-        image_path = os.path.join(base_output_dir, "generated_images", generated_image_filename)
-        # --- END CRITICAL FIX ---
-        if os.path.exists(image_path):
-            debug_scheduler_print(f"Attaching image: {image_path}")
-            # First, upload the photo
-            photo_upload_url = f"https://graph.facebook.com/v19.0/{facebook_page_id}/photos"
-            try:
-                with open(image_path, 'rb') as img_file:
-                    # Using published='false' means it uploads as unpublished, then we attach it to a new feed post.
-                    # This is standard when combining text and images.
-                    photo_response = requests.post(photo_upload_url, data={'access_token': access_token, 'published': 'false'}, files={'source': img_file})
-                photo_response.raise_for_status()
-                photo_data = photo_response.json()
-                attached_image_id = photo_data.get('id')
-                debug_scheduler_print(f"Image uploaded successfully, ID: {attached_image_id}")
-
-                # Then, attach the photo to the post
-                payload['attached_media'] = json.dumps([{'media_fbid': attached_image_id}])
-                debug_scheduler_print("Attached image to post payload.")
-
-            except requests.exceptions.HTTPError as e:
-                error_details = e.response.json() if e.response and e.response.text else str(e)
-                print(f"ERROR: Failed to upload image for Post ID {db_id} (HTTP Error): {e.response.status_code} - {error_details}")
-            except Exception as e:
-                print(f"ERROR: Failed to upload image for Post ID {db_id} (General Error): {e}")
-        else:
-            print(f"WARNING: Image file not found for Post ID {db_id}: {image_path}. Posting without image.")
+    if scheduled_publish_time:
+        payload.update({'published': 'false', 'scheduled_publish_time': int(scheduled_publish_time)})
 
-    try:
-        response = requests.post(post_url, data=payload, timeout=30)
-        response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-        post_response_data = response.json()
-        facebook_post_id = post_response_data.get('id')
+    image_key = post_data.get('generated_image_filename')
+    reused_media = publish_outbox.is_media_usable(entry, image_key)
+    attached_image_id = entry['media_fbid'] if reused_media else None
+    upload_path = None if reused_media else get_post_upload_path(post_data, base_output_dir)
+    if reused_media:
+        # Uploaded ahead of time (pre-upload stage) or by an earlier attempt: publishing is a single /feed call
+        debug_scheduler_print(f"Reusing image uploaded earlier, ID: {attached_image_id}")
+    elif upload_path:
+        debug_scheduler_print(f"Attaching image: {upload_path}")
+        # First, upload the photo
+        try:
+            attached_image_id = upload_unpublished_photo(facebook_page_id, access_token, upload_path)
+            publish_outbox.store_media(db_id, attached_image_id, image_key)
+            debug_scheduler_print(f"Image uploaded successfully, ID: {attached_image_id}")
+        except graph_client.GraphAPIError as e:
+            print(f"ERROR: Failed to upload image for Post ID {db_id} (HTTP Error): {e.status_code} - {e}")
+        except Exception as e:
+            print(f"ERROR: Failed to upload image for Post ID {db_id} (General Error): {e}")
+
+    publish_outbox.transition(db_id, (publish_outbox.UPLOADING_MEDIA,), publish_outbox.MEDIA_UPLOADED)
+    if attached_image_id:
+        # Then, attach the photo to the post
+        payload['attached_media'] = json.dumps([{'media_fbid': attached_image_id}])
+        debug_scheduler_print("Attached image to post payload.")
 
-        # Update database with actual Facebook post ID
-        database_manager.update_post_facebook_id(db_id, facebook_post_id, facebook_page_id, access_token)
+    if not publish_outbox.transition(db_id, (publish_outbox.MEDIA_UPLOADED,), publish_outbox.PUBLISHING):
+        print(f"ERROR: Post ID {db_id} changed state unexpectedly in the publish outbox. Not publishing.")
+        return False, None
+
+    started_at = time.time()
+    try:
+        post_response_data = graph_client.get_client().post(f"{facebook_page_id}/feed", data=payload) # Raises GraphAPIError for 4xx/5xx
+        if scheduled_publish_time:
+            facebook_post_id = publish_outbox.mark_scheduled(db_id, post_response_data.get('id'), scheduled_publish_time,
+                                                             post_data.get('generated_image_filename'), facebook_page_id)
+            print(f"Scheduled Post ID {db_id} on Facebook for {datetime.fromtimestamp(scheduled_publish_time):%Y-%m-%d %H:%M} "
+                  f"(FB ID: {facebook_post_id}) on page '{page_name}'.")
+            return True, facebook_post_id
+        facebook_post_id = publish_outbox.mark_published(db_id, post_response_data.get('id'), facebook_page_id, access_token)
         print(f"Successfully scheduled Post ID {db_id} (FB ID: {facebook_post_id}) to page '{page_name}'.")
         return True, facebook_post_id
 
-    except requests.exceptions.HTTPError as e:
-        error_details = e.response.json() if e.response and e.response.text else str(e)
-        print(f"ERROR: Failed to schedule Post ID {db_id} (HTTP Error): {e.response.status_code} - {error_details}")
-        database_manager.update_post_facebook_id(db_id, None, facebook_page_id, access_token) # Mark as attempted even on HTTP error
+    except graph_client.GraphAPIError as e:
+        print(f"ERROR: Failed to schedule Post ID {db_id} (HTTP Error): {e.status_code} - {e}")
+        if reused_media and e.code == GRAPH_INVALID_PARAMETER_CODE:
+            # The stored upload has expired on Facebook's side: upload the image again and retry once
+            print(f"Pre-uploaded image {attached_image_id} for Post ID {db_id} was rejected; uploading it again.")
+            publish_outbox.store_media(db_id, None, None)
+            publish_outbox.transition(db_id, (publish_outbox.PUBLISHING,), publish_outbox.QUEUED)
+            return post_to_facebook(post_data, base_output_dir, retry_permanent, scheduled_publish_time)
+        publish_outbox.mark_failed(db_id, str(e), publish_outbox.is_retryable_error(e.status_code, e.code, e.is_transient))
         return False, None
+    except requests.exceptions.ConnectionError as e:
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            # Never reached Facebook, so retrying cannot duplicate the post
+            print(f"ERROR: Failed to schedule Post ID {db_id} (Connection Timeout): {e}")
+            publish_outbox.mark_failed(db_id, str(e), retryable=True)
+            return False, None
+        print(f"ERROR: Failed to schedule Post ID {db_id} (Network/Connection Error): {e}")
+        return _settle_unknown_outcome(post_data, started_at, str(e))
     except requests.exceptions.RequestException as e:
         print(f"ERROR: Failed to schedule Post ID {db_id} (Network/Connection Error): {e}")
-        database_manager.update_post_facebook_id(db_id, None, facebook_page_id, access_token)
-        return False, None
+        return _settle_unknown_outcome(post_data, started_at, str(e))
     except Exception as e:
         print(f"ERROR: Failed to schedule Post ID {db_id} (Unexpected Error): {e}")
-        database_manager.update_post_facebook_id(db_id, None, facebook_page_id, access_token)
-        return False, None
+        return _settle_unknown_outcome(post_data, started_at, str(e))
 
-def main(db_ids_arg, output_dir_arg):
-    debug_scheduler_print(f"Scheduler started for DB IDs: {db_ids_arg}, Output Dir: {output_dir_arg}")
-    
-    db_ids = [int(id_str) for id_str in db_ids_arg.split(',')]
-    
+def _send_graph_batch(operations, access_token, files=None):
+    """
+    Sends one Graph API batch request and returns its per-operation results (list aligned with operations;
+    None for operations that did not run). Raises requests exceptions if the call itself fails.
+    """
+    return graph_client.get_client().batch(operations, access_token, files=files, timeout=GRAPH_BATCH_TIMEOUT_SECONDS)
+
+def _build_batch_operations(post_data, base_output_dir, media_fbid=None, scheduled_publish_time=None):
+    """
+    Batch operations for one post: an optional unpublished photo upload followed by the feed post, which
+    references the photo through a JSONPath dependency so both run in the same batch call. A media_fbid
+    stored by an earlier attempt is attached directly instead of uploading again.
+    Returns (operations, attached file name or None, upload path or None).
+    """
+    db_id = post_data.get('id')
+    facebook_page_id = post_data.get('facebook_page_id')
+    access_token = post_data.get('facebook_access_token')
+
+    operations = []
+    feed_fields = {'message': build_post_message(post_data), 'access_token': access_token}
+    if scheduled_publish_time:
+        feed_fields.update({'published': 'false', 'scheduled_publish_time': int(scheduled_publish_time)})
+    if media_fbid:
+        feed_fields['attached_media'] = json.dumps([{'media_fbid': media_fbid}])
+    feed_body = urllib.parse.urlencode(feed_fields)
+    upload_path = None if media_fbid else get_post_upload_path(post_data, base_output_dir)
+    file_name = None
+    if upload_path:
+        file_name = f"file_{db_id}"
+        operations.append({
+            'method': 'POST',
+            'name': f"photo_{db_id}",
+            'relative_url': f"{facebook_page_id}/photos",
+            'body': urllib.parse.urlencode({'published': 'false', 'access_token': access_token}),
+            'attached_files': file_name,
+            'omit_response_on_success': False, # Keep the photo ID in the results
+        })
+        # The placeholder must stay unescaped for Graph to substitute it
+        feed_body += ("&attached_media=" + urllib.parse.quote('[{"media_fbid":"', safe='')
+                      + f"{{result=photo_{db_id}:$.id}}" + urllib.parse.quote('"}]', safe=''))
+    operations.append({'method': 'POST', 'relative_url': f"{facebook_page_id}/feed", 'body': feed_body})
+    return operations, file_name, upload_path
+
+def _parse_batch_item(item):
+    """Returns (success, parsed body dict or None, Graph error code or None, error message) for one batch response entry."""
+    if item is None:
+        return False, None, None, "not executed (batch timed out or a dependency failed)"
+    try:
+        body = json.loads(item.get('body') or 'null')
+    except ValueError:
+        body = None
+    if item.get('code') == 200 and isinstance(body, dict) and (body.get('id') or body.get('success')):
+        return True, body, None, None
+    error = body.get('error') if isinstance(body, dict) and isinstance(body.get('error'), dict) else {}
+    return False, body, error.get('code'), f"HTTP {item.get('code')}: {error.get('message') or item.get('body')}"
+
+def _result(post_data, success, facebook_post_id, error=None):
+    return {'db_id': post_data['id'], 'page_name': post_data.get('page_name'), 'success': success,
+            'facebook_post_id': facebook_post_id, 'error': None if success else (error or "see log above")}
+
+def _publish_individually(post_data, base_output_dir, scheduled_publish_time=None):
+    """Hands a claimed post back to the queue and publishes it on its own with post_to_facebook."""
+    publish_outbox.transition(post_data['id'], publish_outbox.IN_FLIGHT_STATES, publish_outbox.QUEUED)
+    success, fb_post_id = post_to_facebook(post_data, base_output_dir, scheduled_publish_time=scheduled_publish_time)
+    return _result(post_data, success, fb_post_id)
+
+def publish_posts_in_batches(posts, base_output_dir, report, retry_permanent=False, scheduled_times=None,
+                             rate_limiter=None, page_key=None, max_posts_per_batch=PAGE_BATCH_MAX_POSTS):
+    """
+    Publishes posts through Graph API batch requests (up to GRAPH_BATCH_MAX_OPERATIONS operations and
+    max_posts_per_batch posts per call). Each post's photo and feed operations always land in the same batch.
+    Per-item results are mapped back to the posts' DB IDs and reported through report(result_dict). Posts
+    whose photo upload failed are retried on their own with post_to_facebook, which publishes without the
+    image as before. Posts with an entry in scheduled_times ({db_id: unix seconds}) are scheduled natively instead.
+
+    publish_posts() calls this once per page. With a rate_limiter, each batch waits for one of the page's
+    slots per post it carries before it is sent, so batching keeps to the page's publish rate.
+    """
+    scheduled_times = scheduled_times or {}
+    reused_media_ids = set() # Posts attaching a photo uploaded earlier instead of uploading in this batch
+    chunks = []
+    current_chunk = [] # (post_data, operations, file name, upload path)
+    current_size = 0
+    for post_data in posts:
+        if not post_data.get('facebook_page_id') or not post_data.get('facebook_access_token') or not build_post_message(post_data):
+            # Same checks and error messages as the single-post path
+            report(_result(post_data, *post_to_facebook(post_data, base_output_dir, retry_permanent, scheduled_times.get(post_data['id'])),
+                           "missing page credentials or content"))
+            continue
+        entry, outcome = _claim_for_publishing(post_data, retry_permanent)
+        if outcome:
+            report(_result(post_data, *outcome, "already in flight or waiting for a retry"))
+            continue
+        media_fbid = entry['media_fbid'] if publish_outbox.is_media_usable(entry, post_data.get('generated_image_filename')) else None
+        if media_fbid:
+            reused_media_ids.add(post_data['id'])
+        operations, file_name, upload_path = _build_batch_operations(post_data, base_output_dir, media_fbid,
+                                                                     scheduled_times.get(post_data['id']))
+        if current_size + len(operations) > GRAPH_BATCH_MAX_OPERATIONS or len(current_chunk) >= max(1, max_posts_per_batch):
+            chunks.append(current_chunk)
+            current_chunk, current_size = [], 0
+        current_chunk.append((post_data, operations, file_name, upload_path))
+        current_size += len(operations)
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    for chunk in chunks:
+        batch = [operation for _, operations, _, _ in chunk for operation in operations]
+        if rate_limiter is not None:
+            for _ in chunk:
+                rate_limiter.wait(page_key)
+        for post_data, _, _, _ in chunk:
+            publish_outbox.transition(post_data['id'], (publish_outbox.UPLOADING_MEDIA,), publish_outbox.PUBLISHING)
+        debug_scheduler_print(f"Sending batch of {len(batch)} operations for {len(chunk)} post(s).")
+        batch_results, batch_error, never_sent = None, None, None
+        with contextlib.ExitStack() as stack:
+            try:
+                files = {file_name: stack.enter_context(open(upload_path, 'rb'))
+                         for _, _, file_name, upload_path in chunk if file_name}
+            except OSError as e:
+                never_sent = e
+            started_at = time.time()
+            if never_sent is None:
+                try:
+                    batch_results = _send_graph_batch(batch, chunk[0][0]['facebook_access_token'], files)
+                except requests.exceptions.ConnectTimeout as e:
+                    never_sent = e # Never reached Facebook
+                except graph_client.GraphAPIError as e:
+                    if e.status_code is not None and e.status_code < 500:
+                        never_sent = e # The batch as a whole was rejected, none of its operations ran
+                    else:
+                        batch_error = str(e)
+                except Exception as e:
+                    batch_error = str(e) # Read timeout, connection reset, ...: the batch may have run
+        if never_sent is not None:
+            # Nothing in the batch was published; fall back to one post at a time
+            print(f"ERROR: Graph API batch request failed ({never_sent}). Publishing its {len(chunk)} post(s) individually.")
+            for post_data, _, _, _ in chunk:
+                report(_publish_individually(post_data, base_output_dir, scheduled_times.get(post_data['id'])))
+            continue
+
+        if batch_results is None:
+            # The batch may or may not have run (e.g. read timeout): settle each post against its page
+            print(f"ERROR: Graph API batch request outcome unknown ({batch_error}). Checking each post's page.")
+            for post_data, _, _, _ in chunk:
+                report(_result(post_data, *_settle_unknown_outcome(post_data, started_at, batch_error)))
+            continue
+
+        index = 0
+        for post_data, operations, file_name, upload_path in chunk:
+            db_id = post_data['id']
+            items = batch_results[index:index + len(operations)]
+            index += len(operations)
+
+            if file_name:
+                photo_ok, photo_body, _, photo_error = _parse_batch_item(items[0])
+                if not photo_ok:
+                    # The feed item depends on the photo, so it did not run either
+                    print(f"ERROR: Failed to upload image for Post ID {db_id} in batch: {photo_error}. Retrying on its own.")
+                    report(_publish_individually(post_data, base_output_dir, scheduled_times.get(db_id)))
+                    continue
+                publish_outbox.store_media(db_id, photo_body['id'], post_data.get('generated_image_filename'))
+                debug_scheduler_print(f"Image uploaded in batch for Post ID {db_id}, ID: {photo_body['id']}")
+
+            if items[-1] is None:
+                report(_publish_individually(post_data, base_output_dir, scheduled_times.get(db_id))) # Not executed, safe to send again
+                continue
+            feed_ok, feed_body, graph_error_code, feed_error = _parse_batch_item(items[-1])
+            if feed_ok and scheduled_times.get(db_id):
+                facebook_post_id = publish_outbox.mark_scheduled(db_id, feed_body['id'], scheduled_times[db_id],
+                                                                 post_data.get('generated_image_filename'), post_data.get('facebook_page_id'))
+                print(f"Scheduled Post ID {db_id} on Facebook for {datetime.fromtimestamp(scheduled_times[db_id]):%Y-%m-%d %H:%M} "
+                      f"(FB ID: {facebook_post_id}) on page '{post_data.get('page_name')}'.")
+            elif feed_ok:
+                facebook_post_id = publish_outbox.mark_published(db_id, feed_body['id'], post_data.get('facebook_page_id'),
+                                                                 post_data.get('facebook_access_token'))
+                print(f"Successfully scheduled Post ID {db_id} (FB ID: {facebook_post_id}) to page '{post_data.get('page_name')}'.")
+            elif db_id in reused_media_ids and graph_error_code == GRAPH_INVALID_PARAMETER_CODE:
+                # The reused upload has expired: drop it and publish on its own, which uploads the image again
+                print(f"Pre-uploaded image for Post ID {db_id} was rejected; uploading it again.")
+                publish_outbox.store_media(db_id, None, None)
+                report(_publish_individually(post_data, base_output_dir, scheduled_times.get(db_id)))
+                continue
+            else:
+                facebook_post_id = None
+                print(f"ERROR: Failed to schedule Post ID {db_id} in batch: {feed_error}")
+                publish_outbox.mark_failed(db_id, feed_error, publish_outbox.is_retryable_error(items[-1].get('code'), graph_error_code))
+            report(_result(post_data, feed_ok, facebook_post_id, feed_error))
+
+def preupload_media(output_dir, hours_ahead=PREUPLOAD_HOURS_AHEAD, max_workers=PREUPLOAD_MAX_WORKERS):
+    """
+    Uploads the images of approved posts due within hours_ahead as unpublished photos, in parallel, and
+    stores their media_fbid in the publish outbox, so publishing them is a single /feed call. Posts whose
+    stored upload is missing, expired or for a replaced image are uploaded (again); others are skipped.
+    Returns the number of images uploaded.
+    """
+    start = datetime.now()
+    pending = []
+    for post_id, page_name, due_time in get_due_posts_between(start - timedelta(hours=1), start + timedelta(hours=hours_ahead)):
+        post = database_manager.get_post_details_by_db_id(post_id)
+        if not post or not post.get('facebook_page_id') or not post.get('facebook_access_token'):
+            continue
+        entry = publish_outbox.enqueue(post_id)
+        if entry['state'] not in publish_outbox.CLAIMABLE_STATES:
+            continue
+        if publish_outbox.is_media_usable(entry, post.get('generated_image_filename')):
+            continue
+        upload_path = get_post_upload_path(post, output_dir)
+        if upload_path:
+            pending.append((post, upload_path))
+    if not pending:
+        return 0
+
+    def upload(post, upload_path):
+        media_fbid = upload_unpublished_photo(post['facebook_page_id'], post['facebook_access_token'], upload_path)
+        if not publish_outbox.store_media(post['id'], media_fbid, post.get('generated_image_filename'), queued_only=True):
+            debug_scheduler_print(f"Post ID {post['id']} was claimed for publishing during the pre-upload; upload {media_fbid} unused.")
+        return media_fbid
+
+    uploaded = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending))), thread_name_prefix="preupload") as executor:
+        futures = {executor.submit(upload, post, upload_path): post for post, upload_path in pending}
+        for future in futures:
+            post = futures[future]
+            try:
+                media_fbid = future.result()
+                uploaded += 1
+                debug_scheduler_print(f"Pre-uploaded image for Post ID {post['id']} ({post['post_date']} {post['post_hour']:02d}:00), ID: {media_fbid}")
+            except Exception as e:
+                print(f"WARNING: Could not pre-upload image for Post ID {post['id']}: {e}. It will be uploaded when published.")
+    print(f"Pre-uploaded {uploaded} of {len(pending)} image(s) for posts due in the next {hours_ahead:g} h.")
+    return uploaded
+
+_preupload_thread = None
+_preupload_lock = threading.Lock()
+
+def start_media_preuploader(output_dir, interval_minutes=PREUPLOAD_INTERVAL_MINUTES):
+    """Runs preupload_media() every interval_minutes on a daemon thread. Idempotent; 0 disables it."""
+    global _preupload_thread
+    if interval_minutes <= 0:
+        return
+    with _preupload_lock:
+        if _preupload_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    preupload_media(output_dir)
+                except Exception as e:
+                    print(f"ERROR: Media pre-upload failed: {e}")
+                time.sleep(interval_minutes * 60)
+
+        _preupload_thread = threading.Thread(target=loop, name="media-preupload", daemon=True)
+        _preupload_thread.start()
+    debug_scheduler_print(f"Media pre-upload runs every {interval_minutes:g} min for posts due within {PREUPLOAD_HOURS_AHEAD:g} h.")
+
+class PageRateLimiter:
+    """
+    Spaces out Graph API publishes to one page: callers block until at least min_interval_seconds have
+    passed since the previous publish to the same page. Different pages never wait on each other.
+    """
+    def __init__(self, min_interval_seconds=PAGE_MIN_INTERVAL_SECONDS):
+        self.min_interval_seconds = min_interval_seconds
+        self._lock = threading.Lock()
+        self._last_publish = {} # page id -> time.monotonic() of the last publish
+
+    def wait(self, page_id):
+        with self._lock:
+            now = time.monotonic()
+            next_allowed = self._last_publish.get(page_id, 0.0) + self.min_interval_seconds
+            scheduled = max(now, next_allowed)
+            self._last_publish[page_id] = scheduled # Reserve the slot before sleeping
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+def publish_posts(db_ids, output_dir, max_concurrent_pages=MAX_CONCURRENT_PAGES, rate_limiter=None, progress_callback=None,
+                  use_batch=PUBLISH_USE_BATCH, retry_permanent=False, scheduled_times=None):
+    """
+    Publishes posts concurrently across pages. Posts for the same page are published one at a time, in the
+    given order, and spaced by the rate limiter; different pages run in parallel.
+    With use_batch, a page with several posts sends them in Graph API batch requests instead (see
+    publish_posts_in_batches); pages still run in parallel and each batch waits for the page's rate limiter.
+
+    Args:
+        progress_callback: Optional callable(result_dict, completed_count, total_count), invoked per post.
+        retry_permanent: Also retry posts whose last attempt failed permanently (explicit user request).
+        scheduled_times: Optional {db_id: unix seconds}; those posts are scheduled natively on Facebook instead.
+
+    Returns:
+        list: One dict per post: {'db_id', 'page_name', 'success', 'facebook_post_id', 'error'}, in completion order.
+    """
+    rate_limiter = rate_limiter or PageRateLimiter()
+    posts_by_page = {}
+    results = []
     for db_id in db_ids:
         post_details_dict = database_manager.get_post_details_by_db_id(db_id)
-
         if post_details_dict:
-            debug_scheduler_print(f"Processing post DB ID {db_id}: {post_details_dict.get('page_name')}")
-            # Ensure post_to_facebook is passed the correct base output directory
-            success, fb_post_id = post_to_facebook(post_details_dict, output_dir_arg)
-            if not success:
-                print(f"Failed to schedule post with DB ID {db_id}.")
-            time.sleep(1) # Small delay between posts
+            page_key = post_details_dict.get('facebook_page_id') or post_details_dict.get('page_name')
+            posts_by_page.setdefault(page_key, []).append(post_details_dict)
         else:
             print(f"WARNING: Post details not found in DB for ID {db_id}. Skipping.")
+            results.append({'db_id': db_id, 'page_name': None, 'success': False, 'facebook_post_id': None,
+                            'error': "Post not found"})
+
+    total = len(db_ids)
+    results_lock = threading.Lock()
+
+    def report(result):
+        action = "scheduled on Facebook" if scheduled_times and result['db_id'] in scheduled_times else "published"
+        status = f"{action} (FB ID {result['facebook_post_id']})" if result['success'] else f"FAILED ({result['error']})"
+        with results_lock: # Also keeps progress lines from interleaving
+            results.append(result)
+            completed = len(results)
+            print(f"PROGRESS: {completed}/{total} Post ID {result['db_id']} on page '{result['page_name']}': {status}", flush=True)
+        if progress_callback:
+            progress_callback(result, completed, total)
+
+    def publish_page_queue(page_key, page_posts):
+        if use_batch and len(page_posts) > 1:
+            publish_posts_in_batches(page_posts, output_dir, report, retry_permanent, scheduled_times,
+                                     rate_limiter=rate_limiter, page_key=page_key)
+            return
+        for post_details_dict in page_posts:
+            rate_limiter.wait(page_key)
+            debug_scheduler_print(f"Processing post DB ID {post_details_dict['id']}: {post_details_dict.get('page_name')}")
+            try:
+                success, fb_post_id = post_to_facebook(post_details_dict, output_dir, retry_permanent,
+                                                       (scheduled_times or {}).get(post_details_dict['id']))
+                error = None if success else "see log above"
+            except Exception as e:
+                success, fb_post_id, error = False, None, str(e)
+            report({'db_id': post_details_dict['id'], 'page_name': post_details_dict.get('page_name'),
+                    'success': success, 'facebook_post_id': fb_post_id, 'error': error})
+
+    if posts_by_page:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrent_pages, len(posts_by_page))),
+                                thread_name_prefix="publisher") as executor:
+            for future in [executor.submit(publish_page_queue, page_key, page_posts)
+                           for page_key, page_posts in posts_by_page.items()]:
+                future.result()
+    return results
+
+_unknown_timezones = set()
+
+def _get_zone(timezone_name):
+    """ZoneInfo for an IANA name, or None for ''/unknown names (host local time; unknown names are warned about once)."""
+    if not timezone_name:
+        return None
+    try:
+        return ZoneInfo(timezone_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        if timezone_name not in _unknown_timezones:
+            _unknown_timezones.add(timezone_name)
+            print(f"WARNING: Unknown timezone '{timezone_name}'; using local time.")
+        return None
+
+def get_post_due_time(post_date, post_hour, timezone_name=None):
+    """
+    Moment a (post_date 'YYYY-MM-DD', post_hour) slot is due, as a naive host-local datetime comparable with
+    datetime.now(). The slot is read in timezone_name (the page's IANA timezone, see get_page_timezone), else
+    PAGE_DEFAULT_TIMEZONE, else host local time. The daemon, publish workers, native scheduling and pre-upload
+    all go through here, so a post is due at the same instant whichever path publishes it.
+    """
+    slot_time = datetime.strptime(post_date, "%Y-%m-%d") + timedelta(hours=int(post_hour))
+    zone = _get_zone(timezone_name or PAGE_DEFAULT_TIMEZONE)
+    if zone is None:
+        return slot_time
+    return datetime.fromtimestamp(slot_time.replace(tzinfo=zone).timestamp())
+
+def _slot(moment):
+    """(post_date, post_hour) of the hour slot containing a datetime."""
+    return moment.strftime("%Y-%m-%d"), moment.hour
+
+def _timezone_scan_margin():
+    """
+    Stored slots are wall-clock times of each page's timezone, so a range scan in host-local slots is widened
+    by the largest offset between a configured timezone and the host (plus an hour for DST changes).
+    """
+    now = datetime.now()
+    local_offset = now.astimezone().utcoffset()
+    margin = timedelta(0)
+    for timezone_name in set(_get_page_timezone_maps()[0].values()) | {PAGE_DEFAULT_TIMEZONE}:
+        zone = _get_zone(timezone_name)
+        if zone is not None:
+            margin = max(margin, abs(datetime.now(zone).utcoffset() - local_offset))
+    return margin + timedelta(hours=1) if margin else margin
+
+def get_due_posts_between(start, end):
+    """
+    (post_id, page_name, due datetime) of approved, unposted posts due after start and up to end (naive
+    host-local datetimes), each post's slot read in its page's timezone (see get_post_due_time).
+    """
+    margin = _timezone_scan_margin()
+    due_posts = []
+    for post_id, page_name, post_date, post_hour, facebook_page_id in database_manager.get_scheduled_posts_between(
+            *_slot(start - margin), *_slot(end + margin)):
+        due_time = get_post_due_time(post_date, post_hour, get_page_timezone(facebook_page_id, page_name))
+        if start < due_time <= end:
+            due_posts.append((post_id, page_name, due_time))
+    due_posts.sort(key=lambda due_post: due_post[2])
+    return due_posts
+
+def get_post_data_due_time(post_data):
+    """get_post_due_time() of a post dict (as returned by database_manager.get_post_details_by_db_id)."""
+    return get_post_due_time(post_data['post_date'], post_data['post_hour'],
+                             get_page_timezone(post_data.get('facebook_page_id'), post_data.get('page_name')))
+
+def is_publishable_now(post_id, now, max_lateness):
+    """True if the post is approved, unposted, and its slot is due but not more than max_lateness ago."""
+    post = database_manager.get_post_details_by_db_id(post_id)
+    if not (post and post['posted'] == 'No' and post['is_approved']):
+        return False
+    due_time = get_post_data_due_time(post)
+    return due_time <= now and now - due_time <= max_lateness
+
+def _load_configured_pages():
+    try:
+        with open(GUI_CONFIG_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f).get("facebook_pages", [])
+    except (OSError, ValueError) as e:
+        debug_scheduler_print(f"Could not read pages from {GUI_CONFIG_PATH}: {e}")
+        return []
+
+_page_timezones_lock = threading.Lock()
+_page_timezones = {'mtime': -1, 'by_page_id': {}, 'by_page_name': {}}
+
+def _get_page_timezone_maps():
+    """({facebook_page_id: timezone}, {page_name: timezone}) from config/gui_config.json, re-read only when it changes."""
+    try:
+        mtime = os.path.getmtime(GUI_CONFIG_PATH)
+    except OSError:
+        mtime = None
+    with _page_timezones_lock:
+        if _page_timezones['mtime'] != mtime:
+            pages = [page for page in _load_configured_pages() if page.get("timezone")]
+            _page_timezones.update(mtime=mtime,
+                                   by_page_id={page.get("facebook_page_id"): page["timezone"] for page in pages},
+                                   by_page_name={page.get("page_name"): page["timezone"] for page in pages})
+        return _page_timezones['by_page_id'], _page_timezones['by_page_name']
+
+def get_page_timezone(facebook_page_id=None, page_name=None):
+    """
+    IANA timezone of a page: its "timezone" entry in config/gui_config.json (matched by page ID, then by
+    name), else PAGE_DEFAULT_TIMEZONE; '' means host local time.
+    """
+    by_page_id, by_page_name = _get_page_timezone_maps()
+    return by_page_id.get(facebook_page_id) or by_page_name.get(page_name) or PAGE_DEFAULT_TIMEZONE
+
+def get_page_access_token(facebook_page_id):
+    """Access token of a page from config/gui_config.json, else from its most recent post in the DB."""
+    for page in _load_configured_pages():
+        if page.get("facebook_page_id") == facebook_page_id and page.get("facebook_access_token"):
+            return page["facebook_access_token"]
+    return database_manager.get_latest_page_access_token(facebook_page_id)
+
+def get_scheduled_publish_timestamp(post_data):
+    """Unix timestamp at which a post is due (see get_post_due_time), as sent in scheduled_publish_time."""
+    return get_post_data_due_time(post_data).timestamp() # Naive datetimes are taken as local time
+
+def schedule_posts_natively(output_dir, db_ids=None, days_ahead=NATIVE_SCHEDULE_DEFAULT_DAYS):
+    """
+    Hands approved, unposted posts to Facebook's own scheduler (published=false + scheduled_publish_time, in
+    the page's timezone), in batch requests. Without db_ids, every approved post due in the next days_ahead
+    days is scheduled. Posts too close (under 10 minutes) or too far ahead for Facebook are left to the daemon.
+    Returns the publish_posts() results.
+    """
+    now = time.time()
+    if db_ids is None:
+        start = datetime.now()
+        end = start + timedelta(days=min(days_ahead, NATIVE_SCHEDULE_MAX_LEAD_DAYS))
+        db_ids = [post_id for post_id, _, _ in get_due_posts_between(start, end)]
+
+    scheduled_times = {}
+    for db_id in db_ids:
+        post = database_manager.get_post_details_by_db_id(db_id)
+        if not post or post['posted'] != 'No' or not post['is_approved']:
+            continue
+        publish_time = get_scheduled_publish_timestamp(post)
+        if not now + NATIVE_SCHEDULE_MIN_LEAD_SECONDS <= publish_time <= now + NATIVE_SCHEDULE_MAX_LEAD_DAYS * 86400:
+            debug_scheduler_print(f"Post ID {db_id} ({post['post_date']} {post['post_hour']:02d}:00) is outside Facebook's scheduling window; skipping.")
+            continue
+        scheduled_times[db_id] = publish_time
+
+    if not scheduled_times:
+        print("No posts to schedule natively.")
+        return []
+    print(f"Scheduling {len(scheduled_times)} post(s) natively on Facebook.")
+    return publish_posts(list(scheduled_times), output_dir, use_batch=True, scheduled_times=scheduled_times)
+
+def _run_batched(operations_by_post, description):
+    """
+    Sends (post_id, operation, access_token) items in Graph batches of GRAPH_BATCH_MAX_OPERATIONS and
+    returns {post_id: (success, parsed body, error message)}; a failed call fails all of its items.
+    """
+    outcomes = {}
+    for start in range(0, len(operations_by_post), GRAPH_BATCH_MAX_OPERATIONS):
+        chunk = operations_by_post[start:start + GRAPH_BATCH_MAX_OPERATIONS]
+        try:
+            results = _send_graph_batch([operation for _, operation, _ in chunk], chunk[0][2])
+        except Exception as e:
+            print(f"ERROR: Graph API batch request to {description} failed: {e}")
+            results = [None] * len(chunk)
+        for (post_id, _, _), item in zip(chunk, results):
+            success, body, _, error = _parse_batch_item(item)
+            outcomes[post_id] = (success, body, error)
+    return outcomes
+
+def sync_native_schedules(output_dir):
+    """
+    Keeps natively scheduled posts in line with the DB, in bulk:
+      - deleted or unapproved drafts are cancelled on Facebook (DELETE /{post id});
+      - edited drafts are rescheduled (new time and message); if the image changed, or the new time is outside
+        Facebook's window, the scheduled post is cancelled and the draft goes back to the queue instead;
+      - posts whose time has passed are marked posted once Facebook reports them published.
+    Returns a dict of counts.
+    """
+    now = time.time()
+    stats = {'cancelled': 0, 'rescheduled': 0, 'published': 0, 'errors': 0}
+    cancels, updates, checks = [], [], []
+    update_times = {}
+    requeue_after_cancel = set()
+
+    for entry in publish_outbox.get_scheduled_entries_to_sync(now):
+        post_id = entry['post_id']
+        facebook_post_id = entry['facebook_post_id']
+        post = database_manager.get_post_details_by_db_id(post_id) if entry['post_exists'] else None
+        if post is not None and post['posted'] != 'No':
+            continue # Marked posted elsewhere; nothing to keep in sync
+        # Stored IDs are '<page id>_<post id>'; a deleted draft's token went with it, so look up the page's
+        access_token = post['facebook_access_token'] if post else get_page_access_token(facebook_post_id.split('_')[0])
+        if not access_token:
+            print(f"ERROR: No access token to update the scheduled post {facebook_post_id} of Post ID {post_id}.")
+            stats['errors'] += 1
+            continue
+        if post is None or not post['is_approved']:
+            cancels.append((post_id, {'method': 'DELETE', 'relative_url': f"{facebook_post_id}?access_token={access_token}"}, access_token))
+            continue
+
+        edited = entry['post_updated_at'] and entry['post_updated_at'] > (entry['updated_at'] or 0)
+        if edited:
+            publish_time = get_scheduled_publish_timestamp(post)
+            in_window = now + NATIVE_SCHEDULE_MIN_LEAD_SECONDS <= publish_time <= now + NATIVE_SCHEDULE_MAX_LEAD_DAYS * 86400
+            if post.get('generated_image_filename') != entry['scheduled_image_key'] or not in_window:
+                requeue_after_cancel.add(post_id)
+                cancels.append((post_id, {'method': 'DELETE', 'relative_url': f"{facebook_post_id}?access_token={access_token}"}, access_token))
+            else:
+                update_times[post_id] = publish_time
+                body = urllib.parse.urlencode({'message': build_post_message(post), 'scheduled_publish_time': int(publish_time),
+                                               'access_token': access_token})
+                updates.append((post_id, {'method': 'POST', 'relative_url': facebook_post_id, 'body': body}, access_token))
+        elif entry['scheduled_publish_time'] and entry['scheduled_publish_time'] <= now:
+            checks.append((post_id, {'method': 'GET', 'relative_url': f"{facebook_post_id}?fields=id,is_published&access_token={access_token}"}, access_token))
+
+    for post_id, (success, body, error) in _run_batched(cancels, "cancel scheduled posts").items():
+        if not success:
+            print(f"ERROR: Could not cancel scheduled post for Post ID {post_id}: {error}")
+            stats['errors'] += 1
+            continue
+        if post_id in requeue_after_cancel or database_manager.get_post_details_by_db_id(post_id):
+            # Scheduled again (with the new image/time) by the next schedule_posts_natively run, or published by the
+            # daemon once (re-)approved. The photo went with the cancelled post, so it is uploaded again then.
+            publish_outbox.transition(post_id, (publish_outbox.SCHEDULED,), publish_outbox.QUEUED, facebook_post_id=None,
+                                      media_fbid=None, media_uploaded_at=None, media_image_key=None,
+                                      scheduled_publish_time=None, scheduled_image_key=None)
+        else:
+            publish_outbox.remove_entry(post_id)
+        stats['cancelled'] += 1
+
+    for post_id, (success, body, error) in _run_batched(updates, "reschedule posts").items():
+        if success:
+            publish_outbox.transition(post_id, (publish_outbox.SCHEDULED,), publish_outbox.SCHEDULED,
+                                      scheduled_publish_time=update_times[post_id])
+            stats['rescheduled'] += 1
+        else:
+            print(f"ERROR: Could not reschedule Post ID {post_id}: {error}")
+            stats['errors'] += 1
+
+    for post_id, (success, body, error) in _run_batched(checks, "check scheduled posts").items():
+        if success and body.get('is_published'):
+            post = database_manager.get_post_details_by_db_id(post_id)
+            publish_outbox.mark_published(post_id, body.get('id'), post.get('facebook_page_id'), post.get('facebook_access_token'))
+            stats['published'] += 1
+        elif not success:
+            stats['errors'] += 1
+
+    if any(stats.values()):
+        print(f"Native schedule sync: {stats}")
+    return stats
+
+class PublishingDaemon:
+    """
+    Publishes approved posts at their post_date/post_hour.
+
+    Due posts are kept in a min-heap keyed by due time. Only the window from (now - max lateness) to
+    (now + load horizon) is held in memory; the window is extended with range scans on idx_posts_schedule
+    as time passes, and edits (approval, reschedule, deletion, manual posting) are picked up by polling the
+    rows whose updated_at changed. Heap entries are never removed in place: a popped entry whose due time
+    no longer matches self._due_times is stale and skipped.
+    """
+    def __init__(self, output_dir, max_lateness_minutes=DAEMON_MAX_LATENESS_MINUTES,
+                 load_horizon_hours=DAEMON_LOAD_HORIZON_HOURS, poll_seconds=DAEMON_POLL_SECONDS):
+        self.output_dir = output_dir
+        self.max_lateness = timedelta(minutes=max_lateness_minutes)
+        self.load_horizon = timedelta(hours=load_horizon_hours)
+        self.poll_seconds = poll_seconds
+        self._heap = [] # (due datetime, post id)
+        self._due_times = {} # post id -> due datetime of its live heap entry
+        self._loaded_until = None # Due time up to which posts have been loaded
+        self._last_change_seen = time.time()
+        self._stop_event = threading.Event()
+
+    def _schedule(self, post_id, due_time):
+        if self._due_times.get(post_id) != due_time:
+            self._due_times[post_id] = due_time
+            heapq.heappush(self._heap, (due_time, post_id))
+
+    def _load_window(self, now):
+        horizon = now + self.load_horizon
+        start = self._loaded_until
+        if start is None:
+            start = now - self.max_lateness - timedelta(hours=1)
+        if start >= horizon:
+            return
+        due_posts = get_due_posts_between(start, horizon)
+        for post_id, page_name, due_time in due_posts:
+            self._schedule(post_id, due_time)
+        self._loaded_until = horizon
+        debug_scheduler_print(f"Loaded {len(due_posts)} post(s) due up to {horizon:%Y-%m-%d %H:%M}.")
+
+    def _apply_changes(self, now):
+        changes = database_manager.get_posts_changed_since(self._last_change_seen - CHANGE_POLL_OVERLAP_SECONDS)
+        for post_id, page_name, post_date, post_hour, posted, is_approved, updated_at, facebook_page_id in changes:
+            self._last_change_seen = max(self._last_change_seen, updated_at)
+            due_time = get_post_due_time(post_date, post_hour, get_page_timezone(facebook_page_id, page_name))
+            if (posted == 'No' and is_approved and self._loaded_until and due_time <= self._loaded_until
+                    and now - due_time <= self.max_lateness):
+                self._schedule(post_id, due_time)
+            else:
+                self._due_times.pop(post_id, None) # Posted, unapproved, or moved out of the window
+        # Deleted posts leave no row behind; their entries are dropped when re-checked at publish time
+
+    def refresh(self, now=None):
+        now = now or datetime.now()
+        self._load_window(now)
+        self._apply_changes(now)
+
+    def _pop_due(self, now):
+        """Removes and returns the ids of live entries due at or before now, skipping ones past the lateness window."""
+        due_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due_time, post_id = heapq.heappop(self._heap)
+            if self._due_times.get(post_id) != due_time:
+                continue # Stale entry (rescheduled or removed)
+            del self._due_times[post_id]
+            if now - due_time > self.max_lateness:
+                print(f"WARNING: Post ID {post_id} was due at {due_time:%Y-%m-%d %H:%M}, more than "
+                      f"{self.max_lateness.total_seconds() / 60:g} min ago. Skipping it; publish it manually if still wanted.")
+                continue
+            due_ids.append(post_id)
+        return due_ids
+
+    def _next_due_time(self):
+        while self._heap and self._due_times.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def run_once(self, now=None):
+        """One scheduling step: refresh from the DB and publish whatever is due. Returns the publish results."""
+        now = now or datetime.now()
+        self.refresh(now)
+        sync_native_schedules(self.output_dir) # Natively scheduled posts: edits, deletions, going live
+        due_ids = self._pop_due(now)
+        # Failed attempts whose backoff has elapsed get another try while their slot is still within the window
+        due_ids += [post_id for post_id in publish_outbox.get_retry_due_post_ids() if post_id not in due_ids]
+        due_ids = [post_id for post_id in due_ids if is_publishable_now(post_id, now, self.max_lateness)]
+        if not due_ids:
+            return []
+        print(f"Publishing {len(due_ids)} due post(s): {due_ids}")
+        return publish_posts(due_ids, self.output_dir)
+
+    def seconds_until_next_wakeup(self, now=None):
+        now = now or datetime.now()
+        next_due = self._next_due_time()
+        if next_due is None:
+            return self.poll_seconds
+        return max(0.0, min((next_due - now).total_seconds(), self.poll_seconds))
+
+    def run(self):
+        print(f"Publishing daemon started (max lateness {self.max_lateness.total_seconds() / 60:g} min, "
+              f"horizon {self.load_horizon.total_seconds() / 3600:g} h).")
+        publish_outbox.recover(find_published_post)
+        start_media_preuploader(self.output_dir)
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"ERROR: Publishing daemon step failed: {e}")
+            self._stop_event.wait(self.seconds_until_next_wakeup())
+        print("Publishing daemon stopped.")
+
+    def stop(self):
+        self._stop_event.set()
+
+def main(db_ids_arg, output_dir_arg):
+    debug_scheduler_print(f"Scheduler started for DB IDs: {db_ids_arg}, Output Dir: {output_dir_arg}")
+    
+    db_ids = [int(id_str) for id_str in db_ids_arg.split(',')]
+    publish_outbox.recover(find_published_post)
+    results = publish_posts(db_ids, output_dir_arg, retry_permanent=True) # Explicitly requested by the user
+
+    succeeded = sum(1 for result in results if result['success'])
+    print(f"Publishing finished: {succeeded} of {len(db_ids)} posts published.")
+    for result in results:
+        if not result['success']:
+            print(f"Failed to schedule post with DB ID {result['db_id']}.")
 
 
 if __name__ == "__main__":
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "--native":
+        schedule_posts_natively(sys.argv[2], days_ahead=int(sys.argv[3]) if len(sys.argv) == 4 else NATIVE_SCHEDULE_DEFAULT_DAYS)
+        sys.exit(0)
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "--preupload":
+        preupload_media(sys.argv[2], hours_ahead=float(sys.argv[3]) if len(sys.argv) == 4 else PREUPLOAD_HOURS_AHEAD)
+        sys.exit(0)
+    if len(sys.argv) == 3 and sys.argv[1] == "--sync-native":
+        sync_native_schedules(sys.argv[2])
+        sys.exit(0)
+    if len(sys.argv) == 3 and sys.argv[1] == "--daemon":
+        daemon = PublishingDaemon(sys.argv[2])
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            daemon.stop()
+        sys.exit(0)
     if len(sys.argv) < 3:
         print("Usage: python facebook_scheduler.py <comma_separated_db_ids> <output_directory>")
+        print("       python facebook_scheduler.py --daemon <output_directory>")
+        print("       python facebook_scheduler.py --native <output_directory> [days_ahead]")
+        print("       python facebook_scheduler.py --sync-native <output_directory>")
+        print("       python facebook_scheduler.py --preupload <output_directory> [hours_ahead]")
         sys.exit(1)
     
     db_ids_arg = sys.argv[1]
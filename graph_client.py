@@ -0,0 +1,219 @@
+# graph_client.py
+#
+# Shared client for the Facebook Graph API. Every Graph call (publishing, native scheduling, metrics and
+# insights) goes through one pooled keep-alive session, so thousands of daily calls reuse a handful of TLS
+# connections instead of opening one each. The base URL and API version come from the environment
+# (GRAPH_BASE_URL, GRAPH_API_VERSION), every request gets a default timeout, failed responses are parsed
+# into GraphAPIError, and the rate-limit headers Facebook returns (X-App-Usage, X-Business-Use-Case-Usage,
+# X-Page-Usage) are captured so callers can see how close the app is to throttling.
+#
+# Set GRAPH_BASE_URL (or call configure()) to run against the local stand-in in graph_standin_server.py.
+
+import os
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Debugging setup ---
+DEBUG_GRAPH_MODE = True
+
+def debug_graph_print(message):
+    if DEBUG_GRAPH_MODE:
+        print(f"[DEBUG - Graph API]: {message}")
+
+GRAPH_BASE_URL = os.getenv('GRAPH_BASE_URL', "https://graph.facebook.com")
+GRAPH_API_VERSION = os.getenv('GRAPH_API_VERSION', "v19.0")
+GRAPH_TIMEOUT_SECONDS = float(os.getenv('GRAPH_TIMEOUT_SECONDS', 30))
+# Publishing and metrics threads share the pool; more concurrent calls than this wait for a free connection
+GRAPH_POOL_SIZE = int(os.getenv('GRAPH_POOL_SIZE', 16))
+# Log a warning when any usage header reports at least this percentage of a quota
+GRAPH_USAGE_WARN_PERCENT = float(os.getenv('GRAPH_USAGE_WARN_PERCENT', 80))
+
+USAGE_HEADERS = {
+    'X-App-Usage': 'app',
+    'X-Business-Use-Case-Usage': 'business_use_case',
+    'X-Page-Usage': 'page',
+}
+
+
+class GraphAPIError(requests.exceptions.HTTPError):
+    """
+    A failed Graph API response. Subclasses HTTPError (with .response set), so existing handlers keep working;
+    the parsed Graph error is available as .status_code, .code, .subcode, .error_type, .is_transient.
+    """
+    def __init__(self, response, error=None):
+        error = error if error is not None else parse_error(response)
+        self.status_code = response.status_code if response is not None else None
+        self.code = error.get('code')
+        self.subcode = error.get('error_subcode')
+        self.error_type = error.get('type', 'Error')
+        self.is_transient = bool(error.get('is_transient'))
+        self.fbtrace_id = error.get('fbtrace_id')
+        self.graph_message = error.get('message')
+        super().__init__(f"{self.error_type} (#{self.code}): {self.graph_message}", response=response)
+
+
+def parse_error(response):
+    """The 'error' object of a Graph response as a dict ({'message': raw text} if the body is not Graph JSON)."""
+    try:
+        body = response.json()
+    except ValueError:
+        return {'message': response.text[:300]}
+    error = body.get('error') if isinstance(body, dict) else None
+    return error if isinstance(error, dict) else {'message': response.text[:300]}
+
+def _max_usage_percent(value):
+    """Highest percentage in a usage header value (flat dict, or lists of dicts keyed by business/page ID)."""
+    if isinstance(value, dict):
+        numbers = [v for v in value.values() if isinstance(v, (int, float))]
+        nested = [_max_usage_percent(v) for v in value.values() if isinstance(v, (dict, list))]
+        return max(numbers + nested, default=0)
+    if isinstance(value, list):
+        return max((_max_usage_percent(v) for v in value), default=0)
+    return 0
+
+
+class GraphClient:
+    def __init__(self, base_url=GRAPH_BASE_URL, api_version=GRAPH_API_VERSION, timeout=GRAPH_TIMEOUT_SECONDS,
+                 pool_size=GRAPH_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.api_version = api_version.strip('/')
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        # No automatic retries: a resent POST could publish twice; callers decide through the publish outbox
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._usage = {} # 'app' / 'business_use_case' / 'page' -> parsed header value
+        self._usage_updated_at = None
+        self._calls = 0
+        self._errors = 0
+
+    def url(self, path=""):
+        """Absolute URL of a Graph path such as '{page_id}/feed' ('' is the batch endpoint)."""
+        return f"{self.base_url}/{self.api_version}/{path.lstrip('/')}"
+
+    # --- Requests ---
+
+    def request(self, method, path, params=None, data=None, files=None, timeout=None):
+        """
+        Sends one Graph request and returns the decoded JSON body.
+        Raises GraphAPIError for 4xx/5xx responses and requests exceptions for network failures.
+        """
+        try:
+            response = self.session.request(method, self.url(path), params=params, data=data, files=files,
+                                            timeout=timeout or self.timeout)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._calls += 1
+                self._errors += 1
+            raise
+        self._record_usage(response)
+        if response.status_code >= 400:
+            with self._lock:
+                self._errors += 1
+            raise GraphAPIError(response)
+        return response.json()
+
+    def get(self, path, params=None, timeout=None):
+        return self.request("GET", path, params=params, timeout=timeout)
+
+    def post(self, path, data=None, files=None, timeout=None):
+        return self.request("POST", path, data=data, files=files, timeout=timeout)
+
+    def delete(self, path, params=None, timeout=None):
+        return self.request("DELETE", path, params=params, timeout=timeout)
+
+    def batch(self, operations, access_token, files=None, timeout=None):
+        """
+        Sends a batch request (operations as dicts with method/relative_url/body) and returns the list of
+        per-operation results, aligned with operations (None for operations that did not run).
+        """
+        return self.post("", data={'access_token': access_token, 'batch': json.dumps(operations)},
+                         files=files or None, timeout=timeout)
+
+    # --- Rate-limit headers ---
+
+    def _record_usage(self, response):
+        usage = {}
+        for header, key in USAGE_HEADERS.items():
+            raw = response.headers.get(header)
+            if not raw:
+                continue
+            try:
+                usage[key] = json.loads(raw)
+            except ValueError:
+                debug_graph_print(f"Ignoring unparsable {header} header: {raw[:200]}")
+        with self._lock:
+            self._calls += 1
+            if usage:
+                self._usage.update(usage)
+                self._usage_updated_at = time.time()
+        for key, value in usage.items():
+            percent = _max_usage_percent(value)
+            if percent >= GRAPH_USAGE_WARN_PERCENT:
+                print(f"WARNING: Graph API {key} usage at {percent:g}% of quota: {json.dumps(value)}")
+
+    def get_usage(self):
+        """Latest rate-limit header values (parsed JSON) and call counters."""
+        with self._lock:
+            return {'usage': dict(self._usage), 'updated_at': self._usage_updated_at,
+                    'calls': self._calls, 'errors': self._errors}
+
+    def get_max_usage_percent(self):
+        """Highest quota percentage reported by the latest usage headers (0 if none seen yet)."""
+        with self._lock:
+            return _max_usage_percent(list(self._usage.values()))
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide GraphClient, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GraphClient()
+            debug_graph_print(f"Graph client using {_client.url()} (timeout {_client.timeout:g}s, pool {GRAPH_POOL_SIZE}).")
+        return _client
+
+def configure(base_url=None, api_version=None, timeout=None):
+    """
+    Points every later get_client() call at another Graph endpoint, e.g. the local stand-in server
+    (graph_standin_server.py) for load tests. Arguments left as None keep the environment defaults.
+    """
+    global _client
+    with _client_lock:
+        previous = _client
+        _client = GraphClient(base_url=base_url or GRAPH_BASE_URL, api_version=api_version or GRAPH_API_VERSION,
+                              timeout=timeout or GRAPH_TIMEOUT_SECONDS)
+    if previous is not None:
+        previous.close()
+    debug_graph_print(f"Graph client reconfigured to {_client.url()}.")
+    return _client
+
+if __name__ == '__main__':
+    # Usage: python graph_client.py <object_id> <access_token> [fields]
+    import sys
+    if len(sys.argv) < 3:
+        print("Usage: python graph_client.py <object_id> <access_token> [fields]")
+        sys.exit(1)
+    params = {'access_token': sys.argv[2]}
+    if len(sys.argv) > 3:
+        params['fields'] = sys.argv[3]
+    client = get_client()
+    try:
+        print(json.dumps(client.get(sys.argv[1], params=params), indent=2))
+    except GraphAPIError as e:
+        print(f"ERROR: HTTP {e.status_code} - {e}")
+    print(f"Usage: {json.dumps(client.get_usage())}")
@@ -0,0 +1,596 @@
+# graph_standin_server.py
+#
+# Local stand-in for the part of the Facebook Graph API this project uses, so publishing, native scheduling
+# and the metrics fetchers can be benchmarked and regression-tested at thousands of posts without live pages
+# or tokens. All state (photos, posts, engagement) is kept in memory and lost on restart.
+#
+# Implemented: POST /{page}/photos, POST /{page}/feed, GET /{page}/published_posts, /scheduled_posts and /feed,
+# GET / POST / DELETE /{object}, GET /{post}/insights, GET /?ids=a,b multi-reads and POST / batch requests
+# (name, depends_on, attached_files, omit_response_on_success and {result=name:$.path} references).
+# Latency, random transient errors, per-token throttling and expiry of unpublished photo uploads can be
+# injected (command line, STANDIN_* environment variables, or POST /_standin/config while running), and the
+# X-App-Usage / X-Business-Use-Case-Usage headers are returned like the real API.
+#
+# Usage: python graph_standin_server.py --port 8765 --latency_ms 80 --error_rate 0.01 --calls_per_minute 600
+#        then run the scheduler or fetchers with GRAPH_BASE_URL=http://127.0.0.1:8765
+#        python graph_standin_server.py --bench_metrics 2000   (self-contained metrics fetch benchmark)
+#        python graph_standin_server.py --check_batch_timeout   (regression check, uses a temporary database)
+
+import os
+import sys
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import itertools
+import threading
+import urllib.parse
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+# --- Debugging setup ---
+DEBUG_STANDIN_MODE = True
+
+def debug_standin_print(message):
+    if DEBUG_STANDIN_MODE:
+        print(f"[DEBUG - Graph Stand-in]: {message}")
+
+STANDIN_LATENCY_MS = float(os.getenv('STANDIN_LATENCY_MS', 0))
+STANDIN_LATENCY_JITTER_MS = float(os.getenv('STANDIN_LATENCY_JITTER_MS', 0))
+STANDIN_ERROR_RATE = float(os.getenv('STANDIN_ERROR_RATE', 0)) # Share of operations failing with a transient error
+STANDIN_CALLS_PER_MINUTE = int(os.getenv('STANDIN_CALLS_PER_MINUTE', 0)) # Per access token; 0 = no throttling
+STANDIN_PHOTO_TTL_SECONDS = float(os.getenv('STANDIN_PHOTO_TTL_SECONDS', 0)) # Unpublished uploads expire; 0 = never
+
+BATCH_MAX_OPERATIONS = 50
+SCHEDULE_MIN_LEAD_SECONDS = 600
+SCHEDULE_MAX_LEAD_SECONDS = 30 * 86400
+DEFAULT_PAGE_LIMIT = 25
+INSIGHT_METRICS = ("post_impressions_unique", "post_impressions", "post_engaged_users", "post_clicks")
+
+_RESULT_REFERENCE = re.compile(r'\{result=([^:}]+):\$\.([^}]*)\}')
+
+
+class GraphError(Exception):
+    """An error response in Graph API format."""
+    def __init__(self, status, code, message, error_type="OAuthException", is_transient=False, subcode=None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+        self.error_type = error_type
+        self.is_transient = is_transient
+        self.subcode = subcode
+
+    def to_body(self):
+        error = {'message': self.message, 'type': self.error_type, 'code': self.code,
+                 'is_transient': self.is_transient, 'fbtrace_id': f"standin{random.getrandbits(32):08x}"}
+        if self.subcode:
+            error['error_subcode'] = self.subcode
+        return {'error': error}
+
+def _unsupported(method, object_id):
+    return GraphError(400, 100, f"Unsupported {method.lower()} request. Object with ID '{object_id}' does not exist, "
+                                f"cannot be loaded due to missing permissions, or does not support this operation.",
+                      error_type="GraphMethodException", subcode=33)
+
+def _split_fields(fields):
+    """'reactions.summary(true),comments.summary(true),shares' -> ['reactions', 'comments', 'shares']."""
+    names, depth, current = [], 0, ""
+    for char in fields or "":
+        if char == ',' and depth == 0:
+            names.append(current)
+            current = ""
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    names.append(current)
+    return [re.split(r'[.{(]', name.strip(), 1)[0] for name in names if name.strip()]
+
+def _iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+0000')
+
+def _resolve_path(body, path):
+    """Evaluates a batch JSONPath such as 'id' or 'data.*.id' against an earlier operation's result."""
+    values = [body]
+    for part in path.split('.') if path else []:
+        next_values = []
+        for value in values:
+            if part == '*' and isinstance(value, list):
+                next_values.extend(value)
+            elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                next_values.append(value[int(part)])
+            elif isinstance(value, dict) and part in value:
+                next_values.append(value[part])
+        values = next_values
+    return ",".join(value if isinstance(value, str) else json.dumps(value) for value in values)
+
+
+class GraphStandIn:
+    def __init__(self, latency_ms=STANDIN_LATENCY_MS, latency_jitter_ms=STANDIN_LATENCY_JITTER_MS,
+                 error_rate=STANDIN_ERROR_RATE, calls_per_minute=STANDIN_CALLS_PER_MINUTE,
+                 photo_ttl_seconds=STANDIN_PHOTO_TTL_SECONDS, seed=None):
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.settings = {}
+        self.configure(latency_ms=latency_ms, latency_jitter_ms=latency_jitter_ms, error_rate=error_rate,
+                       calls_per_minute=calls_per_minute, photo_ttl_seconds=photo_ttl_seconds)
+        self.reset()
+
+    def configure(self, **settings):
+        """Changes latency_ms, latency_jitter_ms, error_rate, calls_per_minute or photo_ttl_seconds."""
+        unknown = set(settings) - {'latency_ms', 'latency_jitter_ms', 'error_rate', 'calls_per_minute', 'photo_ttl_seconds'}
+        if unknown:
+            raise ValueError(f"Unknown stand-in setting(s): {', '.join(sorted(unknown))}")
+        with self._lock:
+            self.settings.update({key: float(value) for key, value in settings.items() if value is not None})
+        return dict(self.settings)
+
+    def reset(self):
+        with self._lock:
+            self._ids = itertools.count(int(time.time() * 1000))
+            self.photos = {} # photo_id -> dict
+            self.posts = {} # "{page_id}_{n}" -> dict
+            self._windows = {} # access token -> deque of call times in the last minute
+            self.stats = {'requests': 0, 'operations': 0, 'errors_injected': 0, 'throttled': 0,
+                          'photos_uploaded': 0, 'posts_created': 0}
+
+    def summary(self):
+        now = time.time()
+        with self._lock:
+            published = sum(1 for post in self.posts.values() if self._is_published(post, now))
+            return {'settings': dict(self.settings), 'stats': dict(self.stats), 'photos': len(self.photos),
+                    'posts': len(self.posts), 'published_posts': published, 'scheduled_posts': len(self.posts) - published}
+
+    # --- Fault injection ---
+
+    def begin_request(self):
+        """Counts an HTTP request and applies the configured latency."""
+        with self._lock:
+            self.stats['requests'] += 1
+        latency_ms = self.settings['latency_ms'] + self._random.uniform(0, self.settings['latency_jitter_ms'])
+        if latency_ms > 0:
+            time.sleep(latency_ms / 1000.0)
+
+    def _admit(self, access_token):
+        """Counts one operation against the token's quota; raises the throttling or injected error if any."""
+        now = time.time()
+        limit = int(self.settings['calls_per_minute'])
+        with self._lock:
+            self.stats['operations'] += 1
+            window = self._windows.setdefault(access_token, deque())
+            while window and window[0] <= now - 60:
+                window.popleft()
+            if limit and len(window) >= limit:
+                self.stats['throttled'] += 1
+                raise GraphError(400, 4, "(#4) Application request limit reached", is_transient=True)
+            window.append(now)
+            if self.settings['error_rate'] and self._random.random() < self.settings['error_rate']:
+                self.stats['errors_injected'] += 1
+                raise GraphError(500, 2, "An unexpected error has occurred. Please retry your request later.", is_transient=True)
+
+    def usage_percent(self, access_token):
+        limit = int(self.settings['calls_per_minute'])
+        if not limit:
+            return 0
+        with self._lock:
+            return min(100, int(100 * len(self._windows.get(access_token, ())) / limit))
+
+    # --- Requests ---
+
+    def handle(self, method, path, params, files=None):
+        """Runs one Graph operation and returns its response body; raises GraphError."""
+        access_token = params.get('access_token')
+        if not access_token:
+            raise GraphError(400, 190, "An active access token must be used to query information about the current user.")
+        self._admit(access_token)
+        parts = [urllib.parse.unquote(part) for part in path.split('/') if part]
+        if not parts:
+            if method == 'GET' and params.get('ids'):
+                return self._multi_read(params['ids'], params.get('fields'))
+            raise _unsupported(method, "")
+        if len(parts) == 1:
+            if method == 'GET':
+                return self._read_object(parts[0], params.get('fields'))
+            if method == 'POST':
+                return self._update_post(parts[0], params)
+            if method == 'DELETE':
+                return self._delete_object(parts[0])
+        elif len(parts) == 2:
+            object_id, edge = parts
+            if method == 'POST' and edge == 'photos':
+                return self._upload_photo(object_id, params, files)
+            if method == 'POST' and edge == 'feed':
+                return self._create_post(object_id, params)
+            if method == 'GET' and edge in ('published_posts', 'feed', 'scheduled_posts'):
+                return self._list_page_posts(object_id, edge == 'scheduled_posts', params)
+            if method == 'GET' and edge == 'insights':
+                return self._insights(object_id, params.get('metric'))
+        raise _unsupported(method, "/".join(parts))
+
+    def handle_batch(self, params, files):
+        """Runs a batch request; returns the per-operation results in Graph batch format."""
+        if not params.get('access_token'):
+            raise GraphError(400, 190, "An active access token must be used to query information about the current user.")
+        try:
+            operations = json.loads(params.get('batch') or '[]')
+        except ValueError:
+            raise GraphError(400, 100, "(#100) The parameter batch must be a valid JSON array")
+        if not isinstance(operations, list) or not operations:
+            raise GraphError(400, 100, "(#100) The parameter batch must be a non-empty JSON array")
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            raise GraphError(400, 1, f"(#1) Batch is limited to {BATCH_MAX_OPERATIONS} requests")
+
+        referenced = {name for operation in operations
+                      for name, _ in _RESULT_REFERENCE.findall(f"{operation.get('relative_url', '')} {operation.get('body', '')}")}
+        named = {} # name -> (succeeded, body)
+        results = []
+        for operation in operations:
+            relative_url = operation.get('relative_url', '')
+            body = operation.get('body') or ''
+            needed = {name for name, _ in _RESULT_REFERENCE.findall(f"{relative_url} {body}")}
+            if operation.get('depends_on'):
+                needed.add(operation['depends_on'])
+            if any(not named.get(name, (False, None))[0] for name in needed):
+                results.append(None) # A dependency failed or was never run
+                if operation.get('name'):
+                    named[operation['name']] = (False, None)
+                continue
+
+            def substitute(match):
+                return _resolve_path(named[match.group(1)][1], match.group(2))
+            relative_url = _RESULT_REFERENCE.sub(substitute, relative_url)
+            body = _RESULT_REFERENCE.sub(substitute, body)
+
+            url = urllib.parse.urlsplit(relative_url)
+            operation_params = {'access_token': params['access_token']}
+            operation_params.update(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+            operation_params.update(urllib.parse.parse_qsl(body, keep_blank_values=True))
+            attached = {name.strip(): files.get(name.strip()) for name in (operation.get('attached_files') or '').split(',') if name.strip()}
+            try:
+                response_body, code = self.handle(operation.get('method', 'GET').upper(), url.path, operation_params,
+                                                  {'source': file for file in attached.values() if file is not None}), 200
+            except GraphError as e:
+                response_body, code = e.to_body(), e.status
+            if operation.get('name'):
+                named[operation['name']] = (code == 200, response_body)
+            if (code == 200 and operation.get('name') in referenced and operation.get('omit_response_on_success', True) is not False):
+                results.append(None) # Graph omits successful responses that only feed later operations
+                continue
+            results.append({'code': code, 'headers': [{'name': 'Content-Type', 'value': 'text/javascript; charset=UTF-8'}],
+                            'body': json.dumps(response_body)})
+        return results
+
+    # --- Objects ---
+
+    def _is_published(self, post, now):
+        return post['published'] or (post['scheduled_publish_time'] is not None and now >= post['scheduled_publish_time'])
+
+    def _engagement(self, post):
+        """Deterministic engagement per post, so repeated fetches (and regression runs) agree."""
+        generator = random.Random(post['id'])
+        reach = generator.randint(50, 5000)
+        return {'reach': reach, 'impressions': int(reach * generator.uniform(1.0, 1.6)),
+                'likes': int(reach * generator.uniform(0.005, 0.06)), 'comments': int(reach * generator.uniform(0, 0.01)),
+                'shares': int(reach * generator.uniform(0, 0.005)), 'clicks': int(reach * generator.uniform(0, 0.03))}
+
+    def _render_post(self, post, fields, now):
+        published = self._is_published(post, now)
+        engagement = self._engagement(post) if published else {'likes': 0, 'comments': 0, 'shares': 0}
+        rendered = {}
+        for field in _split_fields(fields) or ['created_time', 'message', 'id']:
+            if field == 'id':
+                rendered['id'] = post['id']
+            elif field == 'message' and post['message']:
+                rendered['message'] = post['message']
+            elif field == 'created_time':
+                rendered['created_time'] = _iso_time(post['created_time'])
+            elif field == 'is_published':
+                rendered['is_published'] = published
+            elif field == 'scheduled_publish_time' and post['scheduled_publish_time'] and not published:
+                rendered['scheduled_publish_time'] = post['scheduled_publish_time']
+            elif field in ('reactions', 'likes', 'comments'):
+                count = engagement['comments' if field == 'comments' else 'likes']
+                rendered[field] = {'data': [], 'summary': {'total_count': count}}
+            elif field == 'shares' and engagement['shares']:
+                rendered['shares'] = {'count': engagement['shares']} # Graph omits shares when there are none
+        rendered['id'] = post['id']
+        return rendered
+
+    def _read_object(self, object_id, fields):
+        now = time.time()
+        with self._lock:
+            if object_id in self.posts:
+                return self._render_post(self.posts[object_id], fields, now)
+            photo = self.photos.get(object_id)
+            if photo:
+                return {'id': object_id, 'created_time': _iso_time(photo['created_time'])}
+        raise _unsupported('GET', object_id)
+
+    def _multi_read(self, ids, fields):
+        results = {}
+        for object_id in (object_id.strip() for object_id in ids.split(',')):
+            if object_id:
+                results[object_id] = self._read_object(object_id, fields)
+        return results
+
+    def _validate_schedule(self, scheduled_publish_time, now):
+        try:
+            scheduled_publish_time = int(scheduled_publish_time)
+        except (TypeError, ValueError):
+            raise GraphError(400, 100, "(#100) The specified scheduled publish time is invalid.")
+        if not now + SCHEDULE_MIN_LEAD_SECONDS <= scheduled_publish_time <= now + SCHEDULE_MAX_LEAD_SECONDS:
+            raise GraphError(400, 100, "(#100) The specified scheduled publish time is invalid.")
+        return scheduled_publish_time
+
+    def _new_post(self, page_id, message, published, scheduled_publish_time, media, now):
+        post_id = f"{page_id}_{next(self._ids)}"
+        self.posts[post_id] = {'id': post_id, 'page_id': page_id, 'message': message, 'created_time': now,
+                               'published': published, 'scheduled_publish_time': scheduled_publish_time, 'media': media}
+        self.stats['posts_created'] += 1
+        return post_id
+
+    def _upload_photo(self, page_id, params, files):
+        upload = (files or {}).get('source')
+        if upload is None and not params.get('url'):
+            raise GraphError(400, 324, "(#324) Requires upload file")
+        size = len(upload.read()) if upload is not None else 0
+        published = params.get('published', 'true').lower() != 'false'
+        now = time.time()
+        with self._lock:
+            photo_id = str(next(self._ids))
+            self.photos[photo_id] = {'id': photo_id, 'page_id': page_id, 'published': published, 'created_time': now, 'size': size}
+            self.stats['photos_uploaded'] += 1
+            if not published:
+                return {'id': photo_id}
+            return {'id': photo_id, 'post_id': self._new_post(page_id, params.get('caption') or params.get('message'),
+                                                              True, None, [photo_id], now)}
+
+    def _create_post(self, page_id, params):
+        message = params.get('message')
+        try:
+            attached_media = json.loads(params.get('attached_media') or '[]')
+        except ValueError:
+            raise GraphError(400, 100, "(#100) param attached_media must be an array.")
+        if not message and not attached_media:
+            raise GraphError(400, 100, "(#100) Posts where the actor is a page cannot also include a target_id or be empty")
+        now = time.time()
+        published = str(params.get('published', 'true')).lower() != 'false'
+        scheduled_publish_time = None
+        if params.get('scheduled_publish_time'):
+            if published:
+                raise GraphError(400, 100, "(#100) Published posts cannot be scheduled.")
+            scheduled_publish_time = self._validate_schedule(params['scheduled_publish_time'], now)
+        ttl = self.settings['photo_ttl_seconds']
+        with self._lock:
+            media = []
+            for index, item in enumerate(attached_media):
+                media_fbid = str(item.get('media_fbid')) if isinstance(item, dict) else None
+                photo = self.photos.get(media_fbid)
+                if (photo is None or photo['page_id'] != page_id or photo['published'] or photo.get('attached_to')
+                        or (ttl and now - photo['created_time'] > ttl)):
+                    raise GraphError(400, 100, f"(#100) param attached_media[{index}] must be a valid media_fbid.")
+                media.append(media_fbid)
+            post_id = self._new_post(page_id, message, published, scheduled_publish_time, media, now)
+            for media_fbid in media:
+                self.photos[media_fbid]['attached_to'] = post_id
+        return {'id': post_id}
+
+    def _update_post(self, object_id, params):
+        now = time.time()
+        with self._lock:
+            post = self.posts.get(object_id)
+            if post is None:
+                raise _unsupported('POST', object_id)
+            live = self._is_published(post, now)
+            if params.get('scheduled_publish_time'):
+                if live:
+                    raise GraphError(400, 100, "(#100) A published post cannot be rescheduled.")
+                post['scheduled_publish_time'] = self._validate_schedule(params['scheduled_publish_time'], now)
+            if params.get('is_published', '').lower() == 'true' and not live:
+                post['published'] = True
+                post['created_time'] = now
+            if 'message' in params:
+                post['message'] = params['message']
+        return {'success': True}
+
+    def _delete_object(self, object_id):
+        with self._lock:
+            post = self.posts.pop(object_id, None)
+            if post is not None:
+                for media_fbid in post['media']:
+                    self.photos.pop(media_fbid, None)
+                return {'success': True}
+            if self.photos.pop(object_id, None) is not None:
+                return {'success': True}
+        raise _unsupported('DELETE', object_id)
+
+    def _list_page_posts(self, page_id, scheduled, params):
+        now = time.time()
+        since = float(params.get('since') or 0)
+        limit = int(params.get('limit') or DEFAULT_PAGE_LIMIT)
+        with self._lock:
+            matches = []
+            for post in self.posts.values():
+                if post['page_id'] != page_id or self._is_published(post, now) == scheduled:
+                    continue
+                effective_time = post['scheduled_publish_time'] or post['created_time']
+                if scheduled or effective_time >= since:
+                    matches.append((effective_time, post))
+            matches.sort(key=lambda match: match[0], reverse=not scheduled)
+            return {'data': [self._render_post(post, params.get('fields'), now) for _, post in matches[:limit]]}
+
+    def _insights(self, post_id, metrics):
+        now = time.time()
+        with self._lock:
+            post = self.posts.get(post_id)
+            if post is None:
+                raise _unsupported('GET', f"{post_id}/insights")
+            engagement = self._engagement(post) if self._is_published(post, now) else None
+        values = {'post_impressions_unique': 'reach', 'post_impressions': 'impressions', 'post_clicks': 'clicks'}
+        data = []
+        for metric in (metric.strip() for metric in (metrics or ",".join(INSIGHT_METRICS)).split(',')):
+            if metric not in INSIGHT_METRICS:
+                raise GraphError(400, 100, f"(#100) The value must be a valid insights metric: {metric}")
+            if engagement is None:
+                value = 0
+            elif metric == 'post_engaged_users':
+                value = engagement['likes'] + engagement['comments'] + engagement['shares']
+            else:
+                value = engagement[values[metric]]
+            data.append({'name': metric, 'period': 'lifetime', 'values': [{'value': value}],
+                         'id': f"{post_id}/insights/{metric}/lifetime"})
+        return {'data': data}
+
+
+def create_app(standin):
+    app = Flask(__name__)
+
+    @app.route('/_standin/state', methods=['GET'])
+    def standin_state():
+        return jsonify(standin.summary())
+
+    @app.route('/_standin/reset', methods=['POST'])
+    def standin_reset():
+        standin.reset()
+        return jsonify(standin.summary())
+
+    @app.route('/_standin/config', methods=['GET', 'POST'])
+    def standin_config():
+        if request.method == 'POST':
+            try:
+                standin.configure(**(request.get_json(silent=True) or {}))
+            except (TypeError, ValueError) as e:
+                return jsonify({'error': str(e)}), 400
+        return jsonify(standin.settings)
+
+    @app.route('/<version>/', defaults={'path': ''}, methods=['GET', 'POST', 'DELETE'])
+    @app.route('/<version>/<path:path>', methods=['GET', 'POST', 'DELETE'])
+    def graph(version, path):
+        standin.begin_request()
+        params = request.args.to_dict()
+        params.update(request.form.to_dict())
+        try:
+            if request.method == 'POST' and not path.strip('/') and 'batch' in params:
+                body = standin.handle_batch(params, request.files)
+            else:
+                body = standin.handle(request.method, path, params, request.files)
+            status = 200
+        except GraphError as e:
+            body, status = e.to_body(), e.status
+        response = Response(json.dumps(body), status=status, mimetype='application/json')
+        percent = standin.usage_percent(params.get('access_token'))
+        response.headers['X-App-Usage'] = json.dumps({'call_count': percent, 'total_cputime': percent // 2, 'total_time': percent // 2})
+        page_id = path.strip('/').split('/', 1)[0].split('_', 1)[0]
+        if page_id:
+            response.headers['X-Business-Use-Case-Usage'] = json.dumps({page_id: [{
+                'type': 'pages', 'call_count': percent, 'total_cputime': percent // 2, 'total_time': percent // 2,
+                'estimated_time_to_regain_access': 1 if percent >= 100 else 0}]})
+        return response
+
+    return app
+
+def start_in_background(host="127.0.0.1", port=0, standin=None, configure_client=True):
+    """
+    Serves a stand-in on a daemon thread (port 0 picks a free port) and, by default, points graph_client at it.
+    Returns (server, standin, base_url); call server.shutdown() to stop it.
+    """
+    standin = standin or GraphStandIn()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING) # One access log line per call drowns benchmark output
+    server = make_server(host, port, create_app(standin), threaded=True)
+    threading.Thread(target=server.serve_forever, name="graph-standin", daemon=True).start()
+    base_url = f"http://{host}:{server.server_port}"
+    debug_standin_print(f"Graph API stand-in listening on {base_url}.")
+    if configure_client:
+        import graph_client
+        graph_client.configure(base_url=base_url)
+    return server, standin, base_url
+
+def benchmark_metrics(num_posts, workers=16, page_id="1000000001", access_token="standin-token"):
+    """Creates num_posts posts through graph_client, then fetches their combined metrics from workers threads."""
+    import graph_client
+    import facebook_metrics_gui_helpers
+    client = graph_client.get_client()
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        post_ids = list(executor.map(lambda n: client.post(f"{page_id}/feed", data={'message': f"Benchmark post {n}",
+                                                                                 'access_token': access_token})['id'],
+                                     range(num_posts)))
+    created = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        metrics = list(executor.map(lambda post_id: facebook_metrics_gui_helpers.fetch_combined_post_metrics(post_id, access_token),
+                                    post_ids))
+    finished = time.time()
+    failed = sum(1 for result in metrics if result is None)
+    print(f"Created {num_posts} posts in {created - started:.2f}s ({num_posts / max(created - started, 1e-9):.0f}/s).")
+    print(f"Fetched metrics for {num_posts} posts in {finished - created:.2f}s "
+          f"({num_posts / max(finished - created, 1e-9):.0f} posts/s, {failed} failed).")
+    print(f"Client usage: {json.dumps(client.get_usage())}")
+
+def check_batch_read_timeout(num_posts=2, page_id="1000000001", access_token="standin-token"):
+    """
+    Regression check: a batch publish that times out while reading the response must settle its posts by
+    checking the page, not send them again. Runs against a temporary database. Returns True if it passed.
+    """
+    import tempfile
+    import database_manager
+    import facebook_scheduler
+    import publish_outbox
+    standin = GraphStandIn(latency_ms=1500)
+    server, _, _ = start_in_background(standin=standin)
+    original_database, original_timeout = database_manager.DATABASE_FILE, facebook_scheduler.GRAPH_BATCH_TIMEOUT_SECONDS
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            database_manager.DATABASE_FILE = os.path.join(temp_dir, "check_batch_timeout.db")
+            database_manager.create_tables()
+            facebook_scheduler.GRAPH_BATCH_TIMEOUT_SECONDS = 0.5 # The stand-in answers after 1.5 s, but still runs the batch
+            today = datetime.now().strftime("%Y-%m-%d")
+            posts = []
+            for n in range(num_posts):
+                post_id = database_manager.save_generated_post(
+                    "Stand-in Page", today, datetime.now().hour, f"Batch timeout check post {n}", None, None, None, None,
+                    "check", "English", "standin", "standin", 0.7, page_id, access_token, is_approved=True)
+                posts.append(database_manager.get_post_details_by_db_id(post_id))
+            results = []
+            facebook_scheduler.publish_posts_in_batches(posts, temp_dir, results.append)
+            states = [publish_outbox.get_entry(post['id'])['state'] for post in posts]
+        finally:
+            database_manager.DATABASE_FILE, facebook_scheduler.GRAPH_BATCH_TIMEOUT_SECONDS = original_database, original_timeout
+            server.shutdown()
+    created = standin.summary()['stats']['posts_created']
+    passed = created == num_posts and all(result['success'] for result in results) and set(states) == {publish_outbox.PUBLISHED}
+    print(f"Batch read timeout check {'passed' if passed else 'FAILED'}: {created} post(s) created on the stand-in for "
+          f"{num_posts}, outbox states {states}.")
+    return passed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the Facebook Graph API subset used by the scheduler and metrics fetchers.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv('STANDIN_PORT', 8765)))
+    parser.add_argument("--latency_ms", type=float, default=STANDIN_LATENCY_MS, help="Added latency per HTTP request.")
+    parser.add_argument("--latency_jitter_ms", type=float, default=STANDIN_LATENCY_JITTER_MS, help="Random extra latency, up to this much.")
+    parser.add_argument("--error_rate", type=float, default=STANDIN_ERROR_RATE, help="Share of operations failing with a transient error (0-1).")
+    parser.add_argument("--calls_per_minute", type=int, default=STANDIN_CALLS_PER_MINUTE, help="Per-token throttle (0 = none).")
+    parser.add_argument("--photo_ttl_seconds", type=float, default=STANDIN_PHOTO_TTL_SECONDS, help="Expire unpublished photo uploads (0 = never).")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency jitter and error injection.")
+    parser.add_argument("--bench_metrics", type=int, default=0, help="Run a metrics fetch benchmark with this many posts and exit.")
+    parser.add_argument("--check_batch_timeout", action="store_true", help="Check that a timed-out batch publish is not sent twice, and exit.")
+    args = parser.parse_args()
+    standin = GraphStandIn(latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms, error_rate=args.error_rate,
+                           calls_per_minute=args.calls_per_minute, photo_ttl_seconds=args.photo_ttl_seconds, seed=args.seed)
+    if args.check_batch_timeout:
+        sys.exit(0 if check_batch_read_timeout() else 1)
+    if args.bench_metrics:
+        server, _, _ = start_in_background(args.host, 0, standin)
+        benchmark_metrics(args.bench_metrics)
+        print(f"Stand-in state: {json.dumps(standin.summary())}")
+        server.shutdown()
+        sys.exit(0)
+    print(f"Graph API stand-in on http://{args.host}:{args.port} - run the scheduler with GRAPH_BASE_URL=http://{args.host}:{args.port}")
+    make_server(args.host, args.port, create_app(standin), threaded=True).serve_forever()
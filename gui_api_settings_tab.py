@@ -483,6 +483,7 @@ class APISettingsTab(ttk.Frame):
                 "--text_gen_provider", text_gen_provider,
                 "--gemini_text_model", self.selected_gemini_model_var.get(),
                 "--openai_text_model", self.selected_openai_text_model_var.get(),
+                "--local_text_model", self.selected_openai_text_model_var.get(), # DeepSeek/Mistral models share this selector
                 "--openai_image_model", self.selected_openai_image_model_var.get(),
                 "--temperature", str(gemini_temperature),
                 "--start_date", initial_schedule_datetime.strftime("%Y-%m-%d"),
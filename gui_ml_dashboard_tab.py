@@ -210,6 +210,14 @@ class MLDashboardTab(ttk.Frame):
         self.best_languages_text = tk.Text(lang_pref_frame, height=3, wrap="word", state="disabled") # Removed bg
         self.best_languages_text.pack(fill="x", expand=True)
 
+
+        # --- API USAGE (COST & LATENCY) SECTION ---
+        api_usage_frame = ttk.LabelFrame(self.scrollable_frame, text="API Usage (Cost & Latency per Provider/Model)")
+        api_usage_frame.pack(fill="x", padx=10, pady=10)
+
+        self.api_usage_text = tk.Text(api_usage_frame, height=8, wrap="none", state="disabled")
+        self.api_usage_text.pack(fill="x", expand=True)
+
         debug_gui_print("MLDashboardTab _create_widgets finished.")
 
     def update_output_text_content(self, text):
@@ -302,6 +310,13 @@ class MLDashboardTab(ttk.Frame):
             if "No historical data" in msg or "Insufficient data" in msg:
                 overall_status_color = "orange"
 
+            # 7. API Usage (cost & latency from the api_calls table)
+            self.master.after(0, self.update_output_text_content, "\n--- Loading API Usage Statistics ---\n")
+            api_stats = database_manager.get_api_call_stats()
+            api_summary = database_manager.get_api_cost_summary()
+            self.master.after(0, self._display_api_usage_stats, api_stats, api_summary)
+            self.master.after(0, self.update_output_text_content, f"API Usage: {api_summary['total_calls']} calls recorded.\n")
+
         except Exception as e:
             overall_status_message = f"An unexpected error occurred during analysis: {e}"
             overall_status_color = "red"
@@ -439,6 +454,24 @@ class MLDashboardTab(ttk.Frame):
         self.best_languages_text.config(state="disabled")
         debug_gui_print("Language preference insights displayed.")
 
+    def _display_api_usage_stats(self, api_stats, api_summary):
+        self.api_usage_text.config(state="normal")
+        self.api_usage_text.delete(1.0, tk.END)
+        if api_stats:
+            self.api_usage_text.insert(tk.END,
+                f"Total: {api_summary['total_calls']} calls, est. ${api_summary['total_cost']:.4f}, "
+                f"avg {api_summary['avg_wall_time_ms']:.0f} ms/call, "
+                f"avg est. ${api_summary['avg_cost_per_post']:.4f}/post over {api_summary['posts_with_calls']} posts\n\n")
+            for row in api_stats:
+                self.api_usage_text.insert(tk.END,
+                    f"- [{row['call_type']}] {row['provider']} / {row['model']}: {row['calls']} calls "
+                    f"({row['failures']} failed), avg {row['avg_wall_time_ms'] or 0:.0f} ms, max {row['max_wall_time_ms'] or 0:.0f} ms, "
+                    f"tokens {row['prompt_tokens']}/{row['completion_tokens']}, est. ${row['estimated_cost']:.4f}\n")
+        else:
+            self.api_usage_text.insert(tk.END, "No API calls recorded yet.\n")
+        self.api_usage_text.config(state="disabled")
+        debug_gui_print("API usage statistics displayed.")
+
     def on_tab_focus(self):
         # Optionally, you can trigger _run_all_insights_async here if you want
         # insights to load automatically when the tab is focused.
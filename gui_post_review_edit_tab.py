@@ -10,12 +10,17 @@ from datetime import datetime
 import threading
 import shutil
 
+import image_store # Standard library only, so it needs no mock below
+import thumbnail_cache
+
 # Assume these are available or mocked for testing outside main GUI
 try:
     import database_manager
     import text_generator
     import image_generator
+    import image_generation_service
     import ml_predictor
+    import duplicate_detector
     import pandas as pd
 except ImportError:
     class MockDBManager:
@@ -34,11 +39,26 @@ except ImportError:
         def generate_image(self, *args, **kwargs): return None
     image_generator = MockImageGenerator()
 
+    class MockImageGenerationService:
+        def get_service(self): return self
+        def submit_one(self, *args, **kwargs):
+            from concurrent.futures import Future
+            future = Future()
+            future.set_result(None)
+            return future
+    image_generation_service = MockImageGenerationService()
+
     class MockMLPredictor:
         def predict_engagement(self, *args): return 0.5
         def train_model(self): return True, "Mock model trained."
     ml_predictor = MockMLPredictor()
 
+    class MockDuplicateDetector:
+        def index_post(self, *args, **kwargs): return True
+        def update_edited_post(self, *args, **kwargs): return None
+        def update_deleted_post(self, *args, **kwargs): return None
+    duplicate_detector = MockDuplicateDetector()
+
 
 # --- Debugging setup ---
 DEBUG_GUI_MODE = True
@@ -341,14 +361,8 @@ class PostReviewEditTab(ttk.Frame):
             filetypes=[("Image files", "*.png *.jpg *.jpeg *.gif *.bmp"), ("All files", "*.*")]
         )
         if file_path:
-            destination_dir = os.path.join(self.output_dir_var.get(), "generated_images")
-            os.makedirs(destination_dir, exist_ok=True)
-
-            filename = os.path.basename(file_path)
-            destination_path = os.path.join(destination_dir, filename)
-
             try:
-                shutil.copy(file_path, destination_path)
+                filename = image_store.store_image_file(self.output_dir_var.get(), file_path)
 
                 database_manager.update_post_content_and_image(
                     self.selected_post['id'],
@@ -478,27 +492,46 @@ class PostReviewEditTab(ttk.Frame):
             # --- END CRITICAL FIX ---
 
     def _load_image_preview(self, filename):
+        self._preview_filename = filename
         if not filename or filename.startswith("ERROR_"):
             debug_gui_print("No image path or file not found.")
             self.image_preview_label.config(image='', text="No Image Generated or Failed")
             self.image_preview_label.image = None
             return
 
-        image_save_dir = os.path.join(self.output_dir_var.get(), "generated_images")
-        image_path = os.path.join(image_save_dir, filename)
-        if os.path.exists(image_path):
-            try:
-                img = Image.open(image_path)
-                max_size = (200, 200)
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        output_dir = self.output_dir_var.get()
+        # Thumbnails already decoded in this session show instantly; anything else is loaded off the main thread
+        cached_thumbnail = thumbnail_cache.get_cached_thumbnail_image(output_dir, filename)
+        if cached_thumbnail is not None:
+            self._show_image_preview(filename, cached_thumbnail, None)
+            return
+
+        self.image_preview_label.config(image='', text="Loading preview...")
+        self.image_preview_label.image = None
 
-                self.tk_img = ImageTk.PhotoImage(img)
-                self.image_preview_label.config(image=self.tk_img, text="")
-                debug_gui_print(f"Image preview loaded from: {image_path}")
+        def load_thumbnail():
+            image_path = image_store.get_image_path(output_dir, filename)
+            try:
+                thumbnail = thumbnail_cache.get_thumbnail_image(output_dir, filename)
+                error = None if thumbnail is not None or not os.path.exists(image_path) else "decode failed"
             except Exception as e:
-                debug_gui_print(f"Error loading image preview from {image_path}: {e}")
-                self.image_preview_label.config(image='', text=f"Error loading image: {os.path.basename(image_path)}")
-                self.image_preview_label.image = None
+                thumbnail, error = None, str(e)
+            self.master.after(0, self._show_image_preview, filename, thumbnail, error)
+
+        threading.Thread(target=load_thumbnail, daemon=True).start()
+
+    def _show_image_preview(self, filename, thumbnail, error):
+        if filename != getattr(self, '_preview_filename', None):
+            return # Another post was selected while this thumbnail was loading
+        image_path = image_store.get_image_path(self.output_dir_var.get(), filename)
+        if thumbnail is not None:
+            self.tk_img = ImageTk.PhotoImage(thumbnail)
+            self.image_preview_label.config(image=self.tk_img, text="")
+            debug_gui_print(f"Image preview loaded for: {image_path}")
+        elif error:
+            debug_gui_print(f"Error loading image preview from {image_path}: {error}")
+            self.image_preview_label.config(image='', text=f"Error loading image: {os.path.basename(image_path)}")
+            self.image_preview_label.image = None
         else:
             debug_gui_print(f"Image file not found: {image_path}")
             self.image_preview_label.config(image='', text=f"Image file not found: {os.path.basename(image_path)}")
@@ -508,32 +541,17 @@ class PostReviewEditTab(ttk.Frame):
         if self.selected_post:
             filename_to_delete = self.selected_post.get('generated_image_filename')
             if filename_to_delete and not filename_to_delete.startswith("ERROR_"):
-                image_save_dir = os.path.join(self.output_dir_var.get(), "generated_images")
-                filepath = os.path.join(image_save_dir, filename_to_delete)
-                if os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                        debug_gui_print(f"Deleted associated image file: {filepath}")
-                        self.selected_post['generated_image_filename'] = None
-                        self._load_image_preview(None)
-                        database_manager.update_post_content_and_image(self.selected_post['id'],
-                                                                        None, None, None,
-                                                                        image_prompt_en=None,
-                                                                        image_prompt_ar=None)
-                        self.set_status(f"Image for Post ID {self.selected_post['id']} cleared.", "green")
-                        self._populate_posts_list(reset_ui=False)
-                    except Exception as e:
-                        debug_gui_print(f"Error deleting image file {filepath}: {e}")
-                        self.set_status(f"Error deleting image file: {e}", "red")
-                else:
-                    self.set_status("Image file not found on disk.", "orange")
-                    self.selected_post['generated_image_filename'] = None
-                    self._load_image_preview(None)
-                    database_manager.update_post_content_and_image(self.selected_post['id'],
-                                                                    None, None, None,
-                                                                    image_prompt_en=None,
-                                                                    image_prompt_ar=None)
-                    self._populate_posts_list(reset_ui=False)
+                database_manager.clear_post_image(self.selected_post['id'])
+                self.selected_post['generated_image_filename'] = None
+                self._load_image_preview(None)
+                try:
+                    # The file may be shared with other posts that have the identical image; it is only removed if unused
+                    image_store.delete_image_if_unreferenced(self.output_dir_var.get(), filename_to_delete)
+                    self.set_status(f"Image for Post ID {self.selected_post['id']} cleared.", "green")
+                except Exception as e:
+                    debug_gui_print(f"Error deleting image file {filename_to_delete}: {e}")
+                    self.set_status(f"Image cleared, but could not delete image file: {e}", "orange")
+                self._populate_posts_list(reset_ui=False)
             else:
                 self.set_status("No valid image to clear for selected post.", "blue")
         else:
@@ -577,12 +595,14 @@ class PostReviewEditTab(ttk.Frame):
             image_gen_provider = self.image_provider_var_ref.get()
             image_gen_model = self.openai_image_model_var_ref.get()
 
-            generated_filename = image_generator.generate_image(
+            # Runs on the shared image pool (per-model concurrency limits); this thread just waits for the result
+            generated_filename = image_generation_service.get_service().submit_one(
                 effective_prompt,
                 output_dir=self.output_dir_var.get(),
                 provider=image_gen_provider,
-                model=image_gen_model
-            )
+                model=image_gen_model,
+                post_id=self.selected_post['id']
+            ).result()
 
             if generated_filename:
                 database_manager.update_post_content_and_image(self.selected_post['id'],
@@ -680,6 +700,7 @@ class PostReviewEditTab(ttk.Frame):
             facebook_access_token=updated_facebook_access_token
         )
         if success:
+            duplicate_detector.update_edited_post(self.selected_post['id'], updated_content_en, updated_content_ar)
             self.set_status(f"Post ID {self.selected_post['id']} updated successfully.", "green")
             self.selected_post.update({
                 'content_en': updated_content_en,
@@ -707,17 +728,14 @@ class PostReviewEditTab(ttk.Frame):
         if confirm:
             success, image_filename_from_db = database_manager.delete_post_by_id(self.selected_post['id'])
             if success:
+                duplicate_detector.update_deleted_post(self.selected_post['id'])
                 self.set_status(f"Post ID {self.selected_post['id']} deleted successfully.", "green")
                 if image_filename_from_db:
-                    image_save_dir = os.path.join(self.output_dir_var.get(), "generated_images")
-                    image_path = os.path.join(image_save_dir, image_filename_from_db)
-                    if os.path.exists(image_path):
-                        try:
-                            os.remove(image_path)
-                            debug_gui_print(f"Deleted associated image file: {image_path}")
-                        except Exception as e:
-                            debug_gui_print(f"Error deleting image file {image_path}: {e}")
-                            self.set_status(f"Post deleted, but could not delete image file: {e}", "orange")
+                    try:
+                        image_store.delete_image_if_unreferenced(self.output_dir_var.get(), image_filename_from_db)
+                    except Exception as e:
+                        debug_gui_print(f"Error deleting image file {image_filename_from_db}: {e}")
+                        self.set_status(f"Post deleted, but could not delete image file: {e}", "orange")
 
                 self._populate_posts_list()
                 self.populate_unposted_listbox_callback()
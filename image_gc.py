@@ -0,0 +1,245 @@
+# image_gc.py
+#
+# Garbage collection and disk quota for <output_dir>/generated_images.
+#
+# One pass streams the directory tree (os.scandir, nothing listed up front) and checks every file against
+# the set of image keys still in use, built from a single query over posts.generated_image_filename
+# (indexed), the image prompt cache and the pending references of images rendered for posts that are not
+# saved yet (a long bulk run can hold those for hours). Unreferenced originals, their variants and thumbnails, and stale
+# temp files are deleted or moved to generated_images/.quarantine. If a disk quota is set and the images
+# still exceed it, images of already-published posts are evicted, oldest post first.
+#
+# Run it from the command line (python image_gc.py --help) or let start_scheduled_gc() run it periodically.
+
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import threading
+from datetime import datetime
+
+import database_manager
+import image_store
+import image_variants
+import thumbnail_cache
+
+# --- Debugging setup ---
+DEBUG_GC_MODE = True
+
+def debug_gc_print(message):
+    if DEBUG_GC_MODE:
+        print(f"[DEBUG - Image GC]: {message}")
+
+QUARANTINE_SUBDIR = ".quarantine"
+# Files younger than this are never collected (uploads are stored a moment before their post is saved;
+# generated images are protected by pending references instead)
+IMAGE_GC_MIN_AGE_HOURS = float(os.getenv('IMAGE_GC_MIN_AGE_HOURS', 6))
+# Pending references older than this belong to runs that were aborted; their images become collectable
+IMAGE_GC_PENDING_MAX_HOURS = float(os.getenv('IMAGE_GC_PENDING_MAX_HOURS', 7 * 24))
+IMAGE_GC_QUARANTINE_DAYS = float(os.getenv('IMAGE_GC_QUARANTINE_DAYS', 14))
+IMAGE_GC_INTERVAL_HOURS = float(os.getenv('IMAGE_GC_INTERVAL_HOURS', 24)) # 0 disables the scheduled job
+IMAGE_DISK_QUOTA_MB = float(os.getenv('IMAGE_DISK_QUOTA_MB', 0)) # 0 = no quota
+
+_SHA256_STEM = re.compile(r'^[0-9a-f]{64}$')
+_THUMBNAIL_NAME = re.compile(r'^([0-9a-f]{64})_\d+x\d+\.jpg$')
+
+def _scan_files(root, relative_dir=""):
+    """Yields (relative key with '/' separators, os.DirEntry) for every file under root, lazily."""
+    try:
+        entries = os.scandir(os.path.join(root, *relative_dir.split('/')) if relative_dir else root)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            relative_key = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(root, relative_key)
+            elif entry.is_file(follow_symlinks=False):
+                yield relative_key, entry
+
+def get_referenced_image_keys():
+    """Every image key used by a post, held by the image prompt cache or pending for an unsaved post, from one query."""
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT generated_image_filename FROM posts WHERE generated_image_filename IS NOT NULL
+            UNION
+            SELECT image_key FROM image_prompt_cache
+            UNION
+            SELECT image_key FROM image_pending_refs
+        ''')
+        return {row[0] for row in cursor}
+    finally:
+        conn.close()
+
+def _variant_base_stem(key):
+    """'ab/cd/<hash>.upload.jpg' -> 'ab/cd/<hash>'."""
+    stem = os.path.splitext(key)[0]
+    return stem.rsplit('.', 1)[0]
+
+def _dispose(output_dir, relative_key, quarantine, dry_run, stats):
+    path = image_store.get_image_path(output_dir, relative_key)
+    size = os.path.getsize(path)
+    stats['orphans'] += 1
+    stats['orphan_bytes'] += size
+    if dry_run:
+        debug_gc_print(f"[dry run] Would {'quarantine' if quarantine else 'delete'} {relative_key}")
+        return
+    if quarantine:
+        target = os.path.join(image_store.get_images_dir(output_dir), QUARANTINE_SUBDIR,
+                              datetime.now().strftime('%Y%m%d'), *relative_key.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+    else:
+        os.remove(path)
+
+def collect_orphans(output_dir, quarantine=False, dry_run=False, min_age_hours=IMAGE_GC_MIN_AGE_HOURS):
+    """
+    Removes (or quarantines) files in generated_images that no post or cache entry uses.
+
+    Returns:
+        dict: counts/bytes of scanned, orphaned and kept files.
+    """
+    images_dir = image_store.get_images_dir(output_dir)
+    if not dry_run:
+        expired = database_manager.purge_pending_image_references(time.time() - IMAGE_GC_PENDING_MAX_HOURS * 3600)
+        if expired:
+            debug_gc_print(f"Dropped {expired} pending image reference(s) older than {IMAGE_GC_PENDING_MAX_HOURS:g} h.")
+    referenced = get_referenced_image_keys()
+    referenced_stems = {os.path.splitext(key)[0] for key in referenced}
+    referenced_hashes = set()
+    for key in referenced:
+        stem = os.path.splitext(os.path.basename(key))[0]
+        if _SHA256_STEM.match(stem):
+            referenced_hashes.add(stem)
+        elif os.path.exists(image_store.get_image_path(output_dir, key)):
+            referenced_hashes.add(thumbnail_cache.get_image_hash(output_dir, key)) # Legacy name: hash the file
+
+    cutoff = time.time() - min_age_hours * 3600
+    quarantine_cutoff = time.time() - IMAGE_GC_QUARANTINE_DAYS * 86400
+    stats = {'scanned': 0, 'orphans': 0, 'orphan_bytes': 0, 'kept_bytes': 0, 'quarantine_purged': 0}
+
+    for relative_key, entry in _scan_files(images_dir):
+        stats['scanned'] += 1
+        entry_stat = entry.stat()
+        top_dir = relative_key.split('/', 1)[0]
+
+        if top_dir == QUARANTINE_SUBDIR:
+            if entry_stat.st_mtime < quarantine_cutoff and not dry_run:
+                os.remove(entry.path)
+                stats['quarantine_purged'] += 1
+            continue
+        if entry_stat.st_mtime >= cutoff:
+            stats['kept_bytes'] += entry_stat.st_size
+            continue
+
+        if top_dir == image_store.TEMP_SUBDIR:
+            orphan = True # Leftover from an interrupted write
+        elif top_dir == thumbnail_cache.THUMBNAILS_SUBDIR:
+            match = _THUMBNAIL_NAME.match(entry.name)
+            orphan = not match or match.group(1) not in referenced_hashes
+        elif image_variants.is_variant_key(relative_key):
+            orphan = _variant_base_stem(relative_key) not in referenced_stems
+        else:
+            orphan = relative_key not in referenced
+
+        if orphan:
+            if top_dir in (image_store.TEMP_SUBDIR, thumbnail_cache.THUMBNAILS_SUBDIR):
+                if not dry_run:
+                    os.remove(entry.path) # Derived/partial data is never worth quarantining
+                stats['orphans'] += 1
+                stats['orphan_bytes'] += entry_stat.st_size
+            else:
+                _dispose(output_dir, relative_key, quarantine, dry_run, stats)
+        else:
+            stats['kept_bytes'] += entry_stat.st_size
+
+    debug_gc_print(f"Orphan pass: scanned {stats['scanned']} files, {stats['orphans']} orphans "
+                   f"({stats['orphan_bytes'] / (1024 * 1024):.1f} MB), {stats['kept_bytes'] / (1024 * 1024):.1f} MB kept.")
+    return stats
+
+def enforce_disk_quota(output_dir, quota_bytes, current_bytes, dry_run=False):
+    """
+    Evicts images whose posts are all published (and not held by the prompt cache), oldest post date first,
+    until the images fit in quota_bytes. The posts keep their generated_image_filename for history.
+    Returns the number of images evicted.
+    """
+    if quota_bytes <= 0 or current_bytes <= quota_bytes:
+        return 0
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT generated_image_filename, MAX(post_date || ' ' || printf('%02d', post_hour)) AS last_post_time
+            FROM posts
+            WHERE generated_image_filename IS NOT NULL
+              AND generated_image_filename NOT IN (SELECT image_key FROM image_prompt_cache)
+              AND generated_image_filename NOT IN (SELECT image_key FROM image_pending_refs)
+            GROUP BY generated_image_filename
+            HAVING SUM(CASE WHEN posted = 'Yes' THEN 0 ELSE 1 END) = 0
+            ORDER BY last_post_time ASC
+        ''')
+        candidates = cursor.fetchall()
+    finally:
+        conn.close()
+
+    evicted = 0
+    for image_key, last_post_time in candidates:
+        if current_bytes <= quota_bytes:
+            break
+        if not os.path.exists(image_store.get_image_path(output_dir, image_key)):
+            continue # Already evicted in an earlier pass
+        if dry_run:
+            debug_gc_print(f"[dry run] Would evict published image {image_key} (last post {last_post_time})")
+            current_bytes -= os.path.getsize(image_store.get_image_path(output_dir, image_key))
+        else:
+            current_bytes -= image_store.delete_image_files(output_dir, image_key)
+        evicted += 1
+    debug_gc_print(f"Quota pass: evicted {evicted} published image(s); {current_bytes / (1024 * 1024):.1f} MB "
+                   f"in use of {quota_bytes / (1024 * 1024):.1f} MB quota.")
+    return evicted
+
+def run_gc(output_dir, quarantine=False, dry_run=False, quota_mb=IMAGE_DISK_QUOTA_MB, min_age_hours=IMAGE_GC_MIN_AGE_HOURS):
+    stats = collect_orphans(output_dir, quarantine=quarantine, dry_run=dry_run, min_age_hours=min_age_hours)
+    stats['evicted'] = enforce_disk_quota(output_dir, int(quota_mb * 1024 * 1024), stats['kept_bytes'], dry_run=dry_run)
+    return stats
+
+_scheduler_thread = None
+_scheduler_lock = threading.Lock()
+
+def start_scheduled_gc(output_dir, interval_hours=IMAGE_GC_INTERVAL_HOURS):
+    """Runs run_gc() every interval_hours on a daemon thread (first run after one interval). Idempotent."""
+    global _scheduler_thread
+    if interval_hours <= 0:
+        return
+    with _scheduler_lock:
+        if _scheduler_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval_hours * 3600)
+                try:
+                    run_gc(output_dir)
+                except Exception as e:
+                    print(f"ERROR: Scheduled image GC failed: {e}")
+
+        _scheduler_thread = threading.Thread(target=loop, name="image-gc", daemon=True)
+        _scheduler_thread.start()
+    debug_gc_print(f"Scheduled image GC every {interval_hours:g} h for {output_dir}.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Delete or quarantine unreferenced images and enforce the image disk quota.")
+    parser.add_argument("--output_dir", type=str, default=os.getenv('OUTPUT_DIR', "Generated_Posts_Output"), help="Base output directory containing generated_images.")
+    parser.add_argument("--quarantine", action="store_true", help="Move orphans to generated_images/.quarantine instead of deleting them.")
+    parser.add_argument("--dry_run", action="store_true", help="Only report what would be removed.")
+    parser.add_argument("--quota_mb", type=float, default=IMAGE_DISK_QUOTA_MB, help="Disk quota for generated_images in MB (0 = none).")
+    parser.add_argument("--min_age_hours", type=float, default=IMAGE_GC_MIN_AGE_HOURS, help="Never collect files younger than this.")
+    args = parser.parse_args()
+    result = run_gc(args.output_dir, quarantine=args.quarantine, dry_run=args.dry_run,
+                    quota_mb=args.quota_mb, min_age_hours=args.min_age_hours)
+    print(f"Image GC finished: {result}")
+    sys.exit(0)
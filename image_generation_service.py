@@ -0,0 +1,209 @@
+# image_generation_service.py
+#
+# Shared pool for image generation. Requests from the bulk generator, the web review page and the GUI
+# go through one bounded executor, with a separate concurrency cap per (provider, model) so a provider
+# is never sent more parallel requests than it tolerates. Submitting returns a Future, so callers can
+# keep generating text (or serving the UI) while images are produced.
+
+import os
+import threading
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import api_usage_tracker
+import database_manager
+import image_generator
+import image_prompt_cache
+import image_variants
+import thumbnail_cache
+import image_phash_index
+
+# --- Debugging setup ---
+DEBUG_IMAGE_SERVICE_MODE = True
+
+def debug_image_service_print(message):
+    if DEBUG_IMAGE_SERVICE_MODE:
+        print(f"[DEBUG - Image Service]: {message}")
+
+IMAGE_GEN_MAX_WORKERS = int(os.getenv('IMAGE_GEN_MAX_WORKERS', 4))
+# Max concurrent requests per (provider, model); pairs not listed use DEFAULT_MODEL_CONCURRENCY
+MODEL_CONCURRENCY_LIMITS = {
+    ("OpenAI (DALL-E)", "dall-e-3"): 3,
+    ("OpenAI (DALL-E)", "dall-e-2"): 4,
+}
+DEFAULT_MODEL_CONCURRENCY = 2
+
+
+class ImageGenerationService:
+    def __init__(self, max_workers=IMAGE_GEN_MAX_WORKERS, model_limits=None):
+        self.max_workers = max(1, max_workers)
+        self.model_limits = dict(MODEL_CONCURRENCY_LIMITS if model_limits is None else model_limits)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-gen")
+
+        self._lock = threading.Lock()
+        self._semaphores = {} # (provider, model) -> BoundedSemaphore
+        self._cache_key_locks = {} # image prompt cache key -> Lock, held from lookup until the render is recorded
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _semaphore_for(self, provider, model):
+        with self._lock:
+            key = (provider, model)
+            if key not in self._semaphores:
+                limit = self.model_limits.get(key, DEFAULT_MODEL_CONCURRENCY)
+                self._semaphores[key] = threading.BoundedSemaphore(max(1, limit))
+            return self._semaphores[key]
+
+    def submit(self, prompt, output_dir, provider, model, n=1, post_id=None):
+        """
+        Queues generation of n variants of one prompt and returns a Future resolving to the list of saved
+        image keys (possibly fewer than n if some requests failed; empty if all failed).
+
+        Variants are requested n-at-a-time where the model allows it (see image_generator.max_images_per_request);
+        otherwise the request is split into several calls that run in parallel within the model's limit.
+
+        When post_id is None, the API call records are collected on the returned future's `api_call_ids`
+        list; pass them to api_usage_tracker.adopt_pending_calls() before linking them to the saved post.
+        """
+        n = max(1, n)
+        per_request = image_generator.max_images_per_request(model)
+        chunk_sizes = [min(per_request, n - start) for start in range(0, n, per_request)]
+
+        combined = Future()
+        combined.api_call_ids = []
+        results = [None] * len(chunk_sizes)
+        remaining = [len(chunk_sizes)]
+        combine_lock = threading.Lock()
+
+        def on_chunk_done(index, chunk_future):
+            try:
+                results[index] = chunk_future.result()
+            except Exception as e:
+                debug_image_service_print(f"Image request for {provider}/{model} failed: {e}")
+                results[index] = []
+            with combine_lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                combined.set_result([key for chunk in results for key in chunk])
+
+        with self._lock:
+            self._queued += len(chunk_sizes)
+        for index, chunk_size in enumerate(chunk_sizes):
+            chunk_future = self.executor.submit(self._generate, prompt, output_dir, provider, model,
+                                                chunk_size, post_id, combined.api_call_ids)
+            chunk_future.add_done_callback(lambda f, index=index: on_chunk_done(index, f))
+        return combined
+
+    def submit_one(self, prompt, output_dir, provider, model, post_id=None, cache_policy=None, attempt=0):
+        """
+        Like submit() with n=1, but the Future resolves to a single image key or None. Pass `attempt` when
+        re-rendering an image that was rejected, so its API call is recorded as that retry.
+        The image prompt cache (see image_prompt_cache; cache_policy defaults to IMAGE_CACHE_POLICY) is
+        consulted when a worker picks the request up, not at submit time, so requests queued together in a
+        bulk run can reuse images rendered for the ones ahead of them. A hit costs no API call.
+        """
+        cache_policy = cache_policy or image_prompt_cache.IMAGE_CACHE_POLICY
+        single = Future()
+        single.api_call_ids = []
+        with self._lock:
+            self._queued += 1
+        job = self.executor.submit(self._lookup_or_generate, prompt, output_dir, provider, model, post_id,
+                                   cache_policy, single.api_call_ids, attempt)
+
+        def on_done(f):
+            try:
+                single.set_result(f.result())
+            except Exception as e:
+                debug_image_service_print(f"Image request for {provider}/{model} failed: {e}")
+                single.set_result(None)
+
+        job.add_done_callback(on_done)
+        return single
+
+    def _cache_key_lock(self, cache_key):
+        with self._lock:
+            return self._cache_key_locks.setdefault(cache_key, threading.Lock())
+
+    def _lookup_or_generate(self, prompt, output_dir, provider, model, post_id, cache_policy, call_ids, attempt=0):
+        image_size = image_generator.DEFAULT_IMAGE_SIZE
+        # Requests for the same prompt that may reuse each other's images run one at a time, so the second
+        # one finds the first one's render in the cache instead of paying for its own
+        reuses_cache = cache_policy in ("fill_then_reuse", "round_robin")
+        key_lock = (self._cache_key_lock(image_prompt_cache.make_cache_key(prompt, provider, model, image_size))
+                    if reuses_cache else contextlib.nullcontext())
+        with key_lock:
+            if reuses_cache:
+                try:
+                    cached_key = image_prompt_cache.lookup(output_dir, prompt, provider, model, image_size, cache_policy)
+                except Exception as e:
+                    debug_image_service_print(f"WARNING: Image cache lookup failed, generating instead: {e}")
+                    cached_key = None
+                if cached_key:
+                    with self._lock:
+                        self._queued -= 1
+                    database_manager.add_pending_image_reference(cached_key) # The cache may trim it before the post is saved
+                    return cached_key
+
+            image_key = (self._generate(prompt, output_dir, provider, model, 1, post_id, call_ids, attempt) or [None])[0]
+            if image_key and cache_policy != "off":
+                try:
+                    image_prompt_cache.add(output_dir, prompt, provider, model, image_size, image_key, cache_policy)
+                except Exception as e:
+                    debug_image_service_print(f"WARNING: Could not record image in the prompt cache: {e}")
+            return image_key
+
+    def _generate(self, prompt, output_dir, provider, model, n, post_id, call_ids, attempt=0):
+        with self._semaphore_for(provider, model):
+            with self._lock:
+                self._queued -= 1
+                self._in_flight += 1
+            try:
+                with api_usage_tracker.collect_pending_calls_into(call_ids), api_usage_tracker.recording_retry(attempt):
+                    image_keys = image_generator.generate_images(prompt, output_dir, provider, model, n=n, post_id=post_id)
+                # Build the publishing/preview variants, the review thumbnail and the perceptual hash now, while
+                # the image is hot, instead of at publish time, on first selection in a review UI or at the duplicate check
+                for image_key in image_keys:
+                    # Kept safe from image GC until a post using it is saved, however long the run takes
+                    database_manager.add_pending_image_reference(image_key)
+                    image_variants.create_variants(output_dir, image_key)
+                    thumbnail_cache.ensure_thumbnail(output_dir, image_key)
+                    image_phash_index.index_image(output_dir, image_key)
+                with self._lock:
+                    if image_keys:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+                return image_keys
+            except Exception:
+                with self._lock:
+                    self._failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'queued': self._queued,
+                'in_flight': self._in_flight,
+                'max_workers': self.max_workers,
+                'completed': self._completed,
+                'failed': self._failed
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_service():
+    """Returns the process-wide ImageGenerationService, creating it on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ImageGenerationService()
+    return _service
@@ -4,8 +4,14 @@ import os
 import sys
 import requests
 import json # For debugging error responses
+import time
+import hashlib
+import threading
 from openai import OpenAI
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+import api_usage_tracker
+import image_store
 
 # --- Debugging setup ---
 DEBUG_IMG_GEN_MODE = True
@@ -14,80 +20,223 @@ def debug_img_gen_print(message):
     if DEBUG_IMG_GEN_MODE:
         print(f"[DEBUG - Generator - Image]: {message}")
 
-def generate_image(prompt, output_dir, provider, model):
+# --- Image download settings ---
+IMAGE_DOWNLOAD_CONNECT_TIMEOUT_SECONDS = 10
+IMAGE_DOWNLOAD_READ_TIMEOUT_SECONDS = 60 # Max silence between chunks, not total transfer time
+IMAGE_DOWNLOAD_MAX_ATTEMPTS = 4
+IMAGE_DOWNLOAD_BACKOFF_SECONDS = 2 # Doubled after each failed attempt
+IMAGE_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RETRYABLE_HTTP_STATUSES = (429, 500, 502, 503, 504)
+CONTENT_TYPE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+
+# Models that accept response_format; for them the image bytes come back inline (b64_json), saving the
+# second download round trip and avoiding expired signed URLs. Set to "url" to force the download path.
+OPENAI_IMAGE_RESPONSE_FORMAT = os.getenv('OPENAI_IMAGE_RESPONSE_FORMAT', "b64_json")
+RESPONSE_FORMAT_MODELS = ("dall-e-2", "dall-e-3")
+DEFAULT_IMAGE_SIZE = "1024x1024"
+# Variants a single images.generate call may return; models not listed get one per call
+MAX_IMAGES_PER_REQUEST = {"dall-e-2": 10, "dall-e-3": 1}
+
+_download_session = None
+_download_session_lock = threading.Lock()
+
+class IncompleteDownloadError(Exception):
+    """The connection ended before Content-Length bytes arrived; the partial file is kept for resuming."""
+
+def _get_download_session():
+    """Process-wide session so concurrent downloads reuse CDN connections."""
+    global _download_session
+    if _download_session is None:
+        with _download_session_lock:
+            if _download_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _download_session = session
+    return _download_session
+
+def download_image(image_url, output_dir):
+    """
+    Streams an image from a URL into the image store.
+
+    The body is written in chunks to a temp file next to the store, with connect/read timeouts so a hung
+    CDN cannot block a worker indefinitely. Content-Type must be an image and the byte count must match
+    Content-Length. Interrupted transfers are resumed with a Range request (or restarted if the server
+    ignores it) and retried with exponential backoff on connection errors, timeouts and 429/5xx responses.
+
+    Returns:
+        tuple: (image key (see image_store), number of attempts it took).
+
+    Raises:
+        requests.exceptions.RequestException or ValueError if the download ultimately fails.
     """
-    Generates an image using the specified AI provider and model.
+    session = _get_download_session()
+    temp_path = image_store.create_temp_file(output_dir)
+    sha256 = hashlib.sha256()
+    downloaded = 0
+    extension = ".png"
+    try:
+        for attempt in range(1, IMAGE_DOWNLOAD_MAX_ATTEMPTS + 1):
+            headers = {"Range": f"bytes={downloaded}-"} if downloaded else {}
+            try:
+                with session.get(image_url, stream=True, headers=headers,
+                                 timeout=(IMAGE_DOWNLOAD_CONNECT_TIMEOUT_SECONDS, IMAGE_DOWNLOAD_READ_TIMEOUT_SECONDS)) as response:
+                    response.raise_for_status()
+
+                    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+                    if not content_type.startswith("image/"):
+                        raise ValueError(f"Unexpected Content-Type '{content_type}' for image download.")
+                    extension = CONTENT_TYPE_EXTENSIONS.get(content_type, extension)
+
+                    if response.status_code == 206:
+                        debug_img_gen_print(f"Resuming image download at byte {downloaded}.")
+                        file_mode = 'ab'
+                    else:
+                        # Fresh (or restarted, if the server ignored the Range header) transfer
+                        downloaded = 0
+                        sha256 = hashlib.sha256()
+                        file_mode = 'wb'
+                    content_length = response.headers.get("Content-Length")
+                    expected_total = downloaded + int(content_length) if content_length else None
+
+                    with open(temp_path, file_mode) as handler:
+                        for chunk in response.iter_content(chunk_size=IMAGE_DOWNLOAD_CHUNK_SIZE):
+                            if chunk:
+                                handler.write(chunk)
+                                sha256.update(chunk)
+                                downloaded += len(chunk)
+
+                    if expected_total is not None and downloaded != expected_total:
+                        raise IncompleteDownloadError(f"Received {downloaded} of {expected_total} bytes.")
+                    if downloaded == 0:
+                        raise ValueError("Image download returned an empty body.")
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, IncompleteDownloadError,
+                    requests.exceptions.HTTPError) as e:
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if isinstance(e, requests.exceptions.HTTPError) and status not in RETRYABLE_HTTP_STATUSES:
+                    raise # e.g. 403 from an expired signed URL; retrying will not help
+                if attempt == IMAGE_DOWNLOAD_MAX_ATTEMPTS:
+                    raise
+                delay = IMAGE_DOWNLOAD_BACKOFF_SECONDS * (2 ** (attempt - 1))
+                debug_img_gen_print(f"Image download attempt {attempt} failed ({e}). Retrying in {delay}s...")
+                time.sleep(delay)
+
+        return image_store.commit_temp_file(output_dir, temp_path, extension, sha256.hexdigest()), attempt
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def max_images_per_request(model):
+    """How many variants one API call may return (DALL-E 3 only supports n=1)."""
+    return MAX_IMAGES_PER_REQUEST.get(model, 1)
+
+def generate_images(prompt, output_dir, provider, model, n=1, post_id=None):
+    """
+    Generates up to n image variants for one prompt in a single provider call.
 
     Args:
         prompt (str): The text prompt for image generation.
-        output_dir (str): Base directory to save the generated image.
-                          The image will be saved in a 'generated_images' subdirectory.
+        output_dir (str): Base directory to save the generated images.
+                          Images are saved in its 'generated_images' subdirectory (see image_store).
         provider (str): 'OpenAI (DALL-E)' or 'Google (Imagen)'.
         model (str): The specific model name (e.g., 'dall-e-3').
+        n (int): Number of variants; capped at max_images_per_request(model).
+        post_id (int): Optional DB ID of the post the images are for, used to link the API call record.
 
     Returns:
-        str: The filename (e.g., "image_timestamp.png") of the saved image file,
-             or None if generation failed.
+        list: Image keys relative to 'generated_images' (e.g., "ab/cd/abcd....png") of the variants that
+              were saved. Empty if generation failed.
     """
-    debug_img_gen_print(f"Generating image with {provider} model {model}...")
-
-    # Images should be saved in a 'generated_images' subdirectory
-    image_save_dir = os.path.join(output_dir, "generated_images")
-    os.makedirs(image_save_dir, exist_ok=True)
-
-    filename = f"image_{int(datetime.now().timestamp())}.png"
-    filepath = os.path.join(image_save_dir, filename) # Use image_save_dir for filepath
+    n = max(1, min(n, max_images_per_request(model)))
+    debug_img_gen_print(f"Generating {n} image(s) with {provider} model {model}...")
 
     if provider == "OpenAI (DALL-E)":
         openai_api_key = os.getenv('OPENAI_API_KEY')
         if not openai_api_key:
             debug_img_gen_print("ERROR: OPENAI_API_KEY environment variable not set for DALL-E.")
-            return None
+            return []
         
+        image_size = DEFAULT_IMAGE_SIZE
+        started_at = time.perf_counter()
         try:
             client = OpenAI(api_key=openai_api_key)
-            
+
+            request_kwargs = {}
+            if OPENAI_IMAGE_RESPONSE_FORMAT == "b64_json" and model in RESPONSE_FORMAT_MODELS:
+                request_kwargs["response_format"] = "b64_json"
             response = client.images.generate(
                 model=model,
                 prompt=prompt,
-                size="1024x1024",
+                size=image_size,
                 quality="standard",
-                n=1,
+                n=n,
+                **request_kwargs
             )
-            
-            image_url = response.data[0].url
-            debug_img_gen_print(f"DALL-E image URL: {image_url}")
-
-            # Download the image
-            img_data_response = requests.get(image_url)
-            img_data_response.raise_for_status() # Raise an exception for bad status codes
-            
-            with open(filepath, 'wb') as handler:
-                handler.write(img_data_response.content)
-            debug_img_gen_print(f"DALL-E image saved to {filepath}")
-            return filename # Return filename only, as expected by caller
-
-        except requests.exceptions.RequestException as e:
-            error_details = "N/A"
-            if hasattr(e, 'response') and e.response is not None:
-                try:
-                    error_details = e.response.json()
-                except json.JSONDecodeError:
-                    error_details = e.response.text
-            debug_img_gen_print(f"Error during DALL-E image generation (Request Error): {e}. Details: {error_details}")
-            return None
         except Exception as e:
+            api_usage_tracker.record_api_call("image", provider, model, started_at, "error", error_message=e, post_id=post_id)
             debug_img_gen_print(f"Error during DALL-E image generation (General Error): {e}")
-            return None
+            return []
+        finished_at = time.perf_counter()
+
+        image_keys = []
+        download_retries = 0
+        for image_data in response.data:
+            try:
+                if getattr(image_data, "b64_json", None):
+                    # Inline bytes: decode straight into the store, no second request
+                    image_key = image_store.store_image_base64(output_dir, image_data.b64_json, ".png")
+                else:
+                    # URL fallback (response_format="url", or a model that only returns URLs)
+                    image_url = image_data.url
+                    debug_img_gen_print(f"DALL-E image URL: {image_url}")
+                    image_key, attempts = download_image(image_url, output_dir)
+                    download_retries += attempts - 1
+                debug_img_gen_print(f"DALL-E image saved to {image_store.get_image_path(output_dir, image_key)}")
+                image_keys.append(image_key)
+
+            except requests.exceptions.RequestException as e:
+                error_details = "N/A"
+                if hasattr(e, 'response') and e.response is not None:
+                    try:
+                        error_details = e.response.json()
+                    except json.JSONDecodeError:
+                        error_details = e.response.text
+                debug_img_gen_print(f"Error during DALL-E image generation (Request Error): {e}. Details: {error_details}")
+            except Exception as e:
+                debug_img_gen_print(f"Error during DALL-E image generation (General Error): {e}")
+        # Recorded once the downloads are done so their retries count; wall time stays the provider's
+        api_usage_tracker.record_api_call(
+            "image", provider, model, started_at, "success",
+            retries=download_retries,
+            estimated_cost=api_usage_tracker.estimate_image_cost(model, image_size, n),
+            post_id=post_id,
+            finished_at=finished_at
+        )
+        return image_keys
 
     elif provider == "Google (Imagen)":
         debug_img_gen_print("Google Imagen integration is a placeholder and requires full GCP setup.")
-        # Full Imagen integration would go here. For now, it will always return None.
-        return None 
+        # Full Imagen integration would go here. For now, it will always return no images.
+        return []
 
     else:
         debug_img_gen_print(f"Unknown image generation provider: {provider}")
-        return None
+        return []
+
+def generate_image(prompt, output_dir, provider, model, post_id=None):
+    """
+    Generates a single image using the specified AI provider and model.
+
+    Returns:
+        str: The image key relative to 'generated_images' (e.g., "ab/cd/abcd....png", see image_store),
+             or None if generation failed.
+    """
+    image_keys = generate_images(prompt, output_dir, provider, model, n=1, post_id=post_id)
+    return image_keys[0] if image_keys else None
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,251 @@
+# image_phash_index.py
+#
+# Perceptual-hash index for near-duplicate image detection, stored in SQLite (tables image_phash and
+# image_phash_chunks, created by database_manager).
+#
+# Each image gets a 64-bit pHash (DCT of a 32x32 grayscale thumbnail) plus a 64-bit dHash kept for
+# diagnostics. Lookups use multi-index hashing: the pHash is split into NUM_CHUNKS 16-bit chunks, each
+# stored in an indexed (chunk, value) table. Two hashes within Hamming distance 7 must agree on at least
+# one chunk up to one bit (pigeonhole), so probing every chunk value and its 16 one-bit neighbours finds
+# every match within MAX_GUARANTEED_DISTANCE with a single indexed query, however many images are stored.
+
+import os
+import sys
+from datetime import datetime
+
+try:
+    from PIL import Image
+    import numpy as np
+except ImportError:
+    Image = None
+    np = None
+
+import database_manager
+import image_store
+import image_variants
+
+# --- Debugging setup ---
+DEBUG_PHASH_MODE = True
+
+def debug_phash_print(message):
+    if DEBUG_PHASH_MODE:
+        print(f"[DEBUG - Image pHash]: {message}")
+
+HASH_BITS = 64
+NUM_CHUNKS = 4
+CHUNK_BITS = HASH_BITS // NUM_CHUNKS
+MAX_GUARANTEED_DISTANCE = 2 * NUM_CHUNKS - 1 # Exact recall up to this distance with one-bit chunk probing
+DEFAULT_MAX_DISTANCE = 6 # Hamming distance (of 64) at or below which two images count as near-duplicates
+
+_DCT_SIZE = 32
+_dct_matrix = None
+
+def _get_dct_matrix():
+    global _dct_matrix
+    if _dct_matrix is None:
+        n = _DCT_SIZE
+        k = np.arange(n).reshape(-1, 1)
+        i = np.arange(n).reshape(1, -1)
+        matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+        matrix[0, :] = np.sqrt(1.0 / n)
+        _dct_matrix = matrix
+    return _dct_matrix
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def compute_hashes(image_path):
+    """Returns (phash, dhash) as unsigned 64-bit ints."""
+    with Image.open(image_path) as img:
+        gray = img.convert("L")
+        pixels = np.asarray(gray.resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.LANCZOS), dtype=np.float64)
+        dhash_pixels = np.asarray(gray.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    dct_matrix = _get_dct_matrix()
+    low_frequencies = (dct_matrix @ pixels @ dct_matrix.T)[:8, :8].flatten()
+    median = np.median(low_frequencies[1:]) # The DC term would skew the median
+    phash = _bits_to_int(low_frequencies > median)
+    dhash = _bits_to_int((dhash_pixels[:, 1:] > dhash_pixels[:, :-1]).flatten())
+    return phash, dhash
+
+def _to_signed(value):
+    """SQLite INTEGER is signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+def _chunks(phash):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(phash >> (chunk * CHUNK_BITS)) & mask for chunk in range(NUM_CHUNKS)]
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count("1")
+
+def _hash_source_path(output_dir, image_key):
+    """The preview variant is much faster to decode and hashes the same at 32x32."""
+    return image_variants.ensure_variant(output_dir, image_key, "preview") or image_store.get_image_path(output_dir, image_key)
+
+def index_image(output_dir, image_key, conn=None):
+    """
+    Computes and stores the hashes of a stored image (replacing any previous entry).
+    Returns the pHash, or None if the image is missing or cannot be decoded.
+    """
+    if Image is None or not image_key or image_key.startswith("ERROR_"):
+        return None
+    if not os.path.exists(image_store.get_image_path(output_dir, image_key)):
+        return None
+    try:
+        phash, dhash = compute_hashes(_hash_source_path(output_dir, image_key))
+    except Exception as e:
+        print(f"WARNING: Could not compute perceptual hash for {image_key}: {e}")
+        return None
+
+    own_conn = conn is None
+    if own_conn:
+        conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM image_phash_chunks WHERE image_key = ?", (image_key,))
+        cursor.execute("INSERT OR REPLACE INTO image_phash (image_key, phash, dhash, created_at) VALUES (?, ?, ?, ?)",
+                       (image_key, _to_signed(phash), _to_signed(dhash), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        cursor.executemany("INSERT INTO image_phash_chunks (chunk, value, image_key) VALUES (?, ?, ?)",
+                           [(chunk, value, image_key) for chunk, value in enumerate(_chunks(phash))])
+        if own_conn:
+            conn.commit()
+        return phash
+    finally:
+        if own_conn:
+            conn.close()
+
+def remove_image(image_key):
+    conn = database_manager.connect_db()
+    try:
+        conn.execute("DELETE FROM image_phash WHERE image_key = ?", (image_key,))
+        conn.execute("DELETE FROM image_phash_chunks WHERE image_key = ?", (image_key,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_phash(image_key):
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT phash FROM image_phash WHERE image_key = ?", (image_key,))
+        row = cursor.fetchone()
+        return _to_unsigned(row[0]) if row else None
+    finally:
+        conn.close()
+
+def find_similar_images(phash, max_distance=DEFAULT_MAX_DISTANCE, exclude_image_key=None, conn=None):
+    """
+    Finds indexed images whose pHash is within max_distance of phash.
+
+    Returns:
+        list: (image_key, distance) tuples, closest first.
+    """
+    if max_distance > MAX_GUARANTEED_DISTANCE:
+        debug_phash_print(f"WARNING: max_distance {max_distance} exceeds {MAX_GUARANTEED_DISTANCE}; some matches may be missed.")
+    clauses = []
+    params = []
+    for chunk, value in enumerate(_chunks(phash)):
+        probes = [value] + [value ^ (1 << bit) for bit in range(CHUNK_BITS)]
+        clauses.append(f"(c.chunk = ? AND c.value IN ({','.join('?' * len(probes))}))")
+        params.extend([chunk] + probes)
+
+    own_conn = conn is None
+    if own_conn:
+        conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT DISTINCT p.image_key, p.phash
+            FROM image_phash_chunks c
+            JOIN image_phash p ON p.image_key = c.image_key
+            WHERE {" OR ".join(clauses)}
+        ''', params)
+        matches = []
+        for image_key, stored_phash in cursor.fetchall():
+            if image_key == exclude_image_key:
+                continue
+            distance = hamming_distance(phash, _to_unsigned(stored_phash))
+            if distance <= max_distance:
+                matches.append((image_key, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches
+    finally:
+        if own_conn:
+            conn.close()
+
+def find_posts_with_similar_image(output_dir, image_key, max_distance=DEFAULT_MAX_DISTANCE, exclude_post_id=None):
+    """
+    Checks a (new) image against the images of existing posts. The image is indexed first if needed.
+
+    Returns:
+        list: (post_id, page_name, image_key, distance) for posts whose image is a near-duplicate, closest first.
+              An identical file (e.g. a reused cached image) matches at distance 0.
+    """
+    phash = get_phash(image_key)
+    if phash is None:
+        phash = index_image(output_dir, image_key)
+    if phash is None:
+        return []
+    conn = database_manager.connect_db()
+    try:
+        similar = find_similar_images(phash, max_distance, conn=conn)
+        results = []
+        cursor = conn.cursor()
+        for similar_key, distance in similar:
+            cursor.execute("SELECT id, page_name FROM posts WHERE generated_image_filename = ?", (similar_key,))
+            for post_id, page_name in cursor.fetchall():
+                if post_id != exclude_post_id:
+                    results.append((post_id, page_name, similar_key, distance))
+        return results
+    finally:
+        conn.close()
+
+def backfill_index(output_dir, batch_size=500):
+    """
+    Hashes every post image that is not indexed yet. Keys are streamed in batches so memory use stays flat.
+    """
+    read_conn = database_manager.connect_db()
+    write_conn = database_manager.connect_db()
+    indexed = 0
+    try:
+        read_cursor = read_conn.cursor()
+        read_cursor.execute('''
+            SELECT DISTINCT generated_image_filename FROM posts
+            WHERE generated_image_filename IS NOT NULL
+              AND generated_image_filename NOT IN (SELECT image_key FROM image_phash)
+        ''')
+        while True:
+            rows = read_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for (image_key,) in rows:
+                if index_image(output_dir, image_key, conn=write_conn) is not None:
+                    indexed += 1
+            write_conn.commit()
+            debug_phash_print(f"Hashed {indexed} images so far...")
+    finally:
+        read_conn.close()
+        write_conn.close()
+    print(f"Perceptual hash backfill complete. {indexed} images indexed.")
+    return indexed
+
+if __name__ == '__main__':
+    # Usage: python image_phash_index.py backfill [output_dir]
+    #        python image_phash_index.py check <image_key> [output_dir]
+    default_output_dir = os.getenv('OUTPUT_DIR', "Generated_Posts_Output")
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+        backfill_index(sys.argv[2] if len(sys.argv) > 2 else default_output_dir)
+    elif len(sys.argv) > 2 and sys.argv[1] == 'check':
+        output_dir = sys.argv[3] if len(sys.argv) > 3 else default_output_dir
+        matches = find_posts_with_similar_image(output_dir, sys.argv[2])
+        print("\n".join(f"Post {post_id} ({page_name}): {key} distance {distance}" for post_id, page_name, key, distance in matches)
+              if matches else "No near-duplicate images found.")
+    else:
+        print("Usage: python image_phash_index.py backfill [output_dir] | check <image_key> [output_dir]")
+        sys.exit(1)
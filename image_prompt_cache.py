@@ -0,0 +1,176 @@
+# image_prompt_cache.py
+#
+# Optional reuse cache for generated images, keyed by (normalized prompt, provider, model, size).
+# Up to IMAGE_CACHE_VARIANTS_PER_KEY images are remembered per key (table image_prompt_cache, created by
+# database_manager). Whether a request reuses one of them or pays for a new render depends on the policy:
+#
+#   off              - cache not consulted and nothing recorded
+#   always_new       - always render; new images are still recorded for later reuse
+#   fill_then_reuse  - render until the key has K variants, then reuse them
+#   round_robin      - reuse as soon as one variant exists
+#
+# Reuse always picks the least recently used variant, so the variants of a key rotate. The cached images
+# are bounded by IMAGE_CACHE_MAX_BYTES; the least recently used entries are evicted first.
+
+import os
+import re
+import sys
+import time
+import hashlib
+import unicodedata
+from datetime import datetime
+
+import database_manager
+import image_store
+
+# --- Debugging setup ---
+DEBUG_IMAGE_CACHE_MODE = True
+
+def debug_image_cache_print(message):
+    if DEBUG_IMAGE_CACHE_MODE:
+        print(f"[DEBUG - Image Cache]: {message}")
+
+CACHE_POLICIES = ("off", "always_new", "fill_then_reuse", "round_robin")
+IMAGE_CACHE_POLICY = os.getenv('IMAGE_CACHE_POLICY', "off")
+IMAGE_CACHE_VARIANTS_PER_KEY = int(os.getenv('IMAGE_CACHE_VARIANTS_PER_KEY', 3))
+IMAGE_CACHE_MAX_BYTES = int(float(os.getenv('IMAGE_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_prompt(prompt):
+    """Case, whitespace and trailing punctuation differences do not make a prompt new."""
+    text = unicodedata.normalize('NFKC', prompt or "").lower()
+    return _WHITESPACE.sub(' ', text).strip().rstrip('.!?,;: ')
+
+def make_cache_key(prompt, provider, model, image_size):
+    raw = "\x1f".join((provider or "", model or "", image_size or "", normalize_prompt(prompt)))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def lookup(output_dir, prompt, provider, model, image_size, policy=None, variants_per_key=None):
+    """
+    Returns a cached image key to reuse for this request, or None if a new image should be rendered.
+    Entries whose file has disappeared are dropped on the way.
+    """
+    policy = policy or IMAGE_CACHE_POLICY
+    variants_per_key = variants_per_key or IMAGE_CACHE_VARIANTS_PER_KEY
+    if policy not in ("fill_then_reuse", "round_robin"):
+        return None
+
+    cache_key = make_cache_key(prompt, provider, model, image_size)
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, image_key FROM image_prompt_cache WHERE cache_key = ? ORDER BY last_used_at ASC",
+                       (cache_key,))
+        entries = []
+        for entry_id, image_key in cursor.fetchall():
+            if os.path.exists(image_store.get_image_path(output_dir, image_key)):
+                entries.append((entry_id, image_key))
+            else:
+                cursor.execute("DELETE FROM image_prompt_cache WHERE id = ?", (entry_id,))
+        conn.commit()
+
+        if not entries or (policy == "fill_then_reuse" and len(entries) < variants_per_key):
+            return None
+
+        entry_id, image_key = entries[0] # Least recently used variant: successive hits rotate through the K variants
+        cursor.execute("UPDATE image_prompt_cache SET last_used_at = ?, use_count = use_count + 1 WHERE id = ?",
+                       (time.time(), entry_id))
+        conn.commit()
+        debug_image_cache_print(f"Reusing cached image {image_key} ({len(entries)} variant(s) cached for this prompt).")
+        return image_key
+    finally:
+        conn.close()
+
+def add(output_dir, prompt, provider, model, image_size, image_key, policy=None, variants_per_key=None):
+    """
+    Records a newly rendered image under its prompt key, trims the key to K variants (least recently used
+    first) and enforces the disk bound.
+    """
+    policy = policy or IMAGE_CACHE_POLICY
+    variants_per_key = variants_per_key or IMAGE_CACHE_VARIANTS_PER_KEY
+    if policy == "off" or not image_key:
+        return
+
+    cache_key = make_cache_key(prompt, provider, model, image_size)
+    image_path = image_store.get_image_path(output_dir, image_key)
+    file_bytes = os.path.getsize(image_path) if os.path.exists(image_path) else 0
+    conn = database_manager.connect_db()
+    removed_image_keys = []
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO image_prompt_cache
+                (cache_key, provider, model, image_size, prompt, image_key, file_bytes, created_at, last_used_at, use_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+        ''', (cache_key, provider, model, image_size, prompt, image_key, file_bytes,
+              datetime.now().strftime('%Y-%m-%d %H:%M:%S'), time.time()))
+        cursor.execute('''
+            SELECT id, image_key FROM image_prompt_cache WHERE cache_key = ?
+            ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        ''', (cache_key, variants_per_key))
+        for entry_id, old_image_key in cursor.fetchall():
+            cursor.execute("DELETE FROM image_prompt_cache WHERE id = ?", (entry_id,))
+            removed_image_keys.append(old_image_key)
+        conn.commit()
+    finally:
+        conn.close()
+
+    for old_image_key in removed_image_keys:
+        image_store.delete_image_if_unreferenced(output_dir, old_image_key)
+    enforce_disk_limit(output_dir)
+
+def enforce_disk_limit(output_dir, max_bytes=None):
+    """Evicts least recently used cache entries until the cached images fit in max_bytes. Returns entries evicted."""
+    max_bytes = IMAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    conn = database_manager.connect_db()
+    evicted_image_keys = []
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(SUM(file_bytes), 0) FROM image_prompt_cache")
+        total_bytes = cursor.fetchone()[0]
+        if total_bytes <= max_bytes:
+            return 0
+        cursor.execute("SELECT id, image_key, file_bytes FROM image_prompt_cache ORDER BY last_used_at ASC")
+        to_delete = []
+        for entry_id, image_key, file_bytes in cursor:
+            if total_bytes <= max_bytes:
+                break
+            to_delete.append(entry_id)
+            evicted_image_keys.append(image_key)
+            total_bytes -= file_bytes or 0
+        cursor.executemany("DELETE FROM image_prompt_cache WHERE id = ?", [(entry_id,) for entry_id in to_delete])
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Files still used by posts are kept; only the cache's claim on them is dropped
+    for image_key in evicted_image_keys:
+        image_store.delete_image_if_unreferenced(output_dir, image_key)
+    debug_image_cache_print(f"Evicted {len(evicted_image_keys)} cached image(s) to stay under {max_bytes // (1024 * 1024)} MB.")
+    return len(evicted_image_keys)
+
+def get_cache_stats():
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(DISTINCT cache_key), COUNT(*), COALESCE(SUM(file_bytes), 0), COALESCE(SUM(use_count - 1), 0)
+            FROM image_prompt_cache
+        ''')
+        keys, images, total_bytes, reuses = cursor.fetchone()
+        return {'keys': keys, 'images': images, 'bytes': total_bytes, 'reuses': reuses}
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    # Usage: python image_prompt_cache.py stats
+    #        python image_prompt_cache.py evict <output_dir> [max_mb]
+    if len(sys.argv) > 1 and sys.argv[1] == 'stats':
+        print(get_cache_stats())
+    elif len(sys.argv) > 2 and sys.argv[1] == 'evict':
+        max_mb = float(sys.argv[3]) if len(sys.argv) > 3 else None
+        enforce_disk_limit(sys.argv[2], int(max_mb * 1024 * 1024) if max_mb is not None else None)
+    else:
+        print("Usage: python image_prompt_cache.py stats | evict <output_dir> [max_mb]")
+        sys.exit(1)
@@ -0,0 +1,191 @@
+# image_store.py
+#
+# Content-addressed storage for post images under <output_dir>/generated_images.
+#
+# Each image is stored once, at a key derived from the SHA-256 of its bytes and sharded into
+# two levels of subdirectories: "ab/cd/abcd...ef.png". The key (always with forward slashes)
+# is what posts.generated_image_filename holds; joining it onto generated_images/ gives the file,
+# so existing path joins and the /static URL keep working. Older flat names ("image_123.png")
+# resolve the same way.
+#
+# Files are written to a temp file in the same filesystem and atomically renamed into place, so
+# concurrent writers never see or produce partial files, and identical images are stored once.
+
+import os
+import re
+import base64
+import hashlib
+import tempfile
+
+# --- Debugging setup ---
+DEBUG_IMAGE_STORE_MODE = True
+
+def debug_image_store_print(message):
+    if DEBUG_IMAGE_STORE_MODE:
+        print(f"[DEBUG - Image Store]: {message}")
+
+IMAGES_SUBDIR = "generated_images"
+TEMP_SUBDIR = ".tmp"
+CHUNK_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+
+_SHARDED_KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$')
+
+def get_images_dir(output_dir):
+    return os.path.join(output_dir, IMAGES_SUBDIR)
+
+def get_image_path(output_dir, key):
+    """Absolute-or-relative filesystem path of a stored image key (sharded or legacy flat name)."""
+    return os.path.join(get_images_dir(output_dir), *key.split('/'))
+
+def is_valid_key(key):
+    """
+    True for a sharded key ("ab/cd/<sha256>.png") or a legacy flat image file name. Anything with
+    backslashes, drive colons, parent/hidden components or extra directories is rejected, so a key taken
+    from a request cannot point outside generated_images (on Windows '\\' and 'C:' work as path syntax too).
+    """
+    if not key or any(character in key for character in ('\\', ':', '\x00')):
+        return False
+    if _SHARDED_KEY_PATTERN.match(key):
+        return True
+    return '/' not in key and not key.startswith('.') and os.path.splitext(key)[1].lower() in IMAGE_EXTENSIONS
+
+def is_inside_images_dir(output_dir, path):
+    """True if path (after resolving links and '..') lies under generated_images."""
+    images_dir = os.path.realpath(get_images_dir(output_dir))
+    resolved = os.path.realpath(path)
+    try:
+        return os.path.commonpath([images_dir, resolved]) == images_dir
+    except ValueError: # Different drives on Windows
+        return False
+
+def key_for_digest(hex_digest, extension=".png"):
+    extension = extension if extension.startswith('.') else f".{extension}"
+    return f"{hex_digest[:2]}/{hex_digest[2:4]}/{hex_digest}{extension.lower()}"
+
+def create_temp_file(output_dir, suffix=".part"):
+    """
+    Creates an empty temp file inside generated_images/.tmp (same filesystem as the final location,
+    so commit_temp_file() can rename atomically). Returns its path.
+    """
+    temp_dir = os.path.join(get_images_dir(output_dir), TEMP_SUBDIR)
+    os.makedirs(temp_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix=suffix)
+    os.close(fd)
+    return temp_path
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def commit_temp_file(output_dir, temp_path, extension=".png", hex_digest=None):
+    """
+    Moves a fully written temp file to its content-addressed location and returns the key.
+    If an identical image is already stored, the temp file is discarded and the existing key returned.
+    Pass hex_digest if the SHA-256 was computed while writing, to avoid re-reading the file.
+    """
+    hex_digest = hex_digest or hash_file(temp_path)
+    key = key_for_digest(hex_digest, extension)
+    final_path = get_image_path(output_dir, key)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+        debug_image_store_print(f"Identical image already stored as {key}; reusing it.")
+        return key
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(temp_path, final_path) # Atomic on the same filesystem
+    debug_image_store_print(f"Stored image as {key}")
+    return key
+
+def store_image_stream(output_dir, stream, extension=".png"):
+    """Copies a readable binary stream into the store, hashing as it goes. Returns the key."""
+    temp_path = create_temp_file(output_dir)
+    sha256 = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                f.write(chunk)
+        return commit_temp_file(output_dir, temp_path, extension, sha256.hexdigest())
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_image_bytes(output_dir, data, extension=".png"):
+    temp_path = create_temp_file(output_dir)
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        return commit_temp_file(output_dir, temp_path, extension, hashlib.sha256(data).hexdigest())
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_image_base64(output_dir, b64_data, extension=".png"):
+    """
+    Decodes a base64 image (e.g. an OpenAI b64_json response) into the store in fixed-size slices,
+    so the decoded bytes are never held in memory alongside the encoded string. Returns the key.
+    """
+    temp_path = create_temp_file(output_dir)
+    sha256 = hashlib.sha256()
+    slice_size = CHUNK_SIZE // 3 * 4 # Multiple of 4 base64 characters decodes cleanly on its own
+    try:
+        with open(temp_path, 'wb') as f:
+            for start in range(0, len(b64_data), slice_size):
+                chunk = base64.b64decode(b64_data[start:start + slice_size], validate=True)
+                sha256.update(chunk)
+                f.write(chunk)
+        return commit_temp_file(output_dir, temp_path, extension, sha256.hexdigest())
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_image_file(output_dir, source_path):
+    """Copies an existing image file (e.g. a user upload) into the store. Returns the key."""
+    extension = os.path.splitext(source_path)[1] or ".png"
+    with open(source_path, 'rb') as source:
+        return store_image_stream(output_dir, source, extension)
+
+def delete_image_files(output_dir, key):
+    """
+    Removes a stored image together with its cached variants and thumbnails, regardless of references.
+    Returns the number of bytes freed.
+    """
+    import image_variants, thumbnail_cache # Imported lazily; both depend on this module
+    image_path = get_image_path(output_dir, key)
+    if not os.path.exists(image_path):
+        return 0
+    freed = os.path.getsize(image_path)
+    for variant in image_variants.VARIANT_SPECS:
+        variant_path = image_variants.get_variant_path(output_dir, key, variant)
+        if os.path.exists(variant_path):
+            freed += os.path.getsize(variant_path)
+    thumbnail_cache.delete_thumbnails(output_dir, key) # Before removing the original: legacy names are hashed from it
+    os.remove(image_path)
+    image_variants.delete_variants(output_dir, key)
+    import image_phash_index
+    image_phash_index.remove_image(key)
+    debug_image_store_print(f"Deleted image file: {image_path}")
+    return freed
+
+def delete_image_if_unreferenced(output_dir, key):
+    """
+    Deletes a stored image unless another post or the image prompt cache still uses it (identical images
+    share one file). Call after the post row has been deleted or its generated_image_filename changed.
+    Returns True if the file was removed.
+    """
+    if not key or key.startswith("ERROR_"):
+        return False
+    import database_manager
+    if database_manager.count_image_references(key) > 0:
+        debug_image_store_print(f"Image {key} is still used by other posts or the prompt cache; keeping it.")
+        return False
+    if not os.path.exists(get_image_path(output_dir, key)):
+        return False
+    delete_image_files(output_dir, key)
+    return True
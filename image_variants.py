@@ -0,0 +1,113 @@
+# image_variants.py
+#
+# Derived versions of stored images (see image_store): an "upload" variant recompressed for publishing
+# and a small "preview" variant. Variants live next to the original as "<stem>.<variant>.<ext>" (e.g.
+# "ab/cd/<hash>.upload.jpg") and are rebuilt whenever the original is newer than the cached file, so a
+# replaced legacy image never publishes a stale variant.
+
+import os
+import io
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import image_store
+
+# --- Debugging setup ---
+DEBUG_VARIANTS_MODE = True
+
+def debug_variants_print(message):
+    if DEBUG_VARIANTS_MODE:
+        print(f"[DEBUG - Image Variants]: {message}")
+
+# max_size is the bounding box (aspect ratio is kept); quality applies to JPEG/WebP
+VARIANT_SPECS = {
+    "upload": {"max_size": (1080, 1080), "format": "JPEG", "quality": 85},
+    "preview": {"max_size": (320, 320), "format": "JPEG", "quality": 75},
+}
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+def get_variant_key(key, variant):
+    spec = VARIANT_SPECS[variant]
+    stem = os.path.splitext(key)[0]
+    return f"{stem}.{variant}{FORMAT_EXTENSIONS[spec['format']]}"
+
+def get_variant_path(output_dir, key, variant):
+    return image_store.get_image_path(output_dir, get_variant_key(key, variant))
+
+def is_variant_key(key):
+    """True for derived files, so directory scans (e.g. orphan cleanup) can tell them from originals."""
+    stem = os.path.splitext(os.path.basename(key))[0]
+    return any(stem.endswith(f".{variant}") for variant in VARIANT_SPECS)
+
+def _is_fresh(variant_path, original_path):
+    return os.path.exists(variant_path) and os.path.getmtime(variant_path) >= os.path.getmtime(original_path)
+
+def _render_variant(original_path, spec):
+    with Image.open(original_path) as img:
+        img.load()
+        if spec["format"] == "JPEG" and img.mode != "RGB":
+            # JPEG has no alpha; flatten transparent images onto white instead of black
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])
+            img = background
+        img.thumbnail(spec["max_size"], Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        save_kwargs = {"quality": spec.get("quality", 85), "optimize": True}
+        if spec["format"] == "JPEG":
+            save_kwargs["progressive"] = True
+        img.save(buffer, format=spec["format"], **save_kwargs)
+        return buffer.getvalue()
+
+def ensure_variant(output_dir, key, variant):
+    """
+    Returns the path of the variant, creating or refreshing it if needed.
+    Returns None if the original is missing or the variant cannot be built (e.g. Pillow not installed).
+    """
+    if not key or key.startswith("ERROR_"):
+        return None
+    original_path = image_store.get_image_path(output_dir, key)
+    if not os.path.exists(original_path):
+        return None
+    variant_path = get_variant_path(output_dir, key, variant)
+    if _is_fresh(variant_path, original_path):
+        return variant_path
+    if Image is None:
+        debug_variants_print("Pillow is not installed; image variants are unavailable.")
+        return None
+    try:
+        data = _render_variant(original_path, VARIANT_SPECS[variant])
+        temp_path = image_store.create_temp_file(output_dir)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, variant_path) # Atomic; readers never see a partial variant
+        debug_variants_print(f"Built {variant} variant for {key} ({os.path.getsize(original_path)} -> {len(data)} bytes).")
+        return variant_path
+    except Exception as e:
+        debug_variants_print(f"WARNING: Could not build {variant} variant for {key}: {e}")
+        return None
+
+def create_variants(output_dir, key):
+    """Builds every variant of a newly stored image. Best effort; returns {variant: path or None}."""
+    return {variant: ensure_variant(output_dir, key, variant) for variant in VARIANT_SPECS}
+
+def get_upload_image_path(output_dir, key):
+    """
+    Path of the file to publish for an image: the upload variant when it is smaller than the original,
+    otherwise the original itself.
+    """
+    original_path = image_store.get_image_path(output_dir, key)
+    variant_path = ensure_variant(output_dir, key, "upload")
+    if variant_path and os.path.getsize(variant_path) < os.path.getsize(original_path):
+        return variant_path
+    return original_path
+
+def delete_variants(output_dir, key):
+    """Removes cached variants of an image (called when the original is deleted)."""
+    for variant in VARIANT_SPECS:
+        variant_path = get_variant_path(output_dir, key, variant)
+        if os.path.exists(variant_path):
+            os.remove(variant_path)
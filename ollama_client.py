@@ -0,0 +1,183 @@
+# ollama_client.py
+#
+# Shared client for the local Ollama server. Requests from every thread go through one pooled
+# session and a bounded executor sized to the server's OLLAMA_NUM_PARALLEL, so concurrent
+# generator threads queue here instead of piling onto the server. Models are kept loaded with
+# keep_alive and re-warmed periodically while they are in use.
+
+import os
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Debugging setup ---
+DEBUG_OLLAMA_MODE = True
+
+def debug_ollama_print(message):
+    if DEBUG_OLLAMA_MODE:
+        print(f"[DEBUG - Ollama]: {message}")
+
+OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', "http://localhost:11434")
+# Should match the server's OLLAMA_NUM_PARALLEL; more in-flight requests than that just queue on the server
+OLLAMA_PARALLELISM = int(os.getenv('OLLAMA_NUM_PARALLEL', 1))
+# How long the server keeps a model loaded after a request (Ollama duration string or seconds)
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', "30m")
+# Re-warm recently used models this often, so idle gaps shorter than the keep-alive never cause a cold load
+OLLAMA_WARMUP_INTERVAL_SECONDS = int(os.getenv('OLLAMA_WARMUP_INTERVAL_SECONDS', 600))
+# Stop re-warming a model that has not been used for this long
+OLLAMA_WARM_IDLE_LIMIT_SECONDS = int(os.getenv('OLLAMA_WARM_IDLE_LIMIT_SECONDS', 3 * 3600))
+# Generation can be very slow on CPU-only machines; this mirrors the previous per-request timeout
+OLLAMA_REQUEST_TIMEOUT_SECONDS = 240000
+
+
+class OllamaClient:
+    def __init__(self, base_url=OLLAMA_BASE_URL, parallelism=OLLAMA_PARALLELISM, keep_alive=OLLAMA_KEEP_ALIVE,
+                 warmup_interval=OLLAMA_WARMUP_INTERVAL_SECONDS):
+        self.base_url = base_url.rstrip('/')
+        self.parallelism = max(1, parallelism)
+        self.keep_alive = keep_alive
+        self.warmup_interval = warmup_interval
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.parallelism + 1) # +1 for warmup requests
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="ollama")
+
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._model_last_used = {} # model -> time.time() of last request
+        self._warmup_thread = None
+
+    # --- Request multiplexing ---
+
+    def submit(self, model, prompt, options=None):
+        """
+        Queues a non-streaming /api/generate request and returns a Future resolving to the response JSON.
+        At most `parallelism` requests are sent to the server at once; the rest wait here.
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": options or {}
+        }
+        with self._lock:
+            self._queued += 1
+            self._model_last_used[model] = time.time()
+            queue_depth = self._queued
+        if queue_depth > 1:
+            debug_ollama_print(f"Request for {model} queued (queue depth {queue_depth}, in flight {self._in_flight}/{self.parallelism}).")
+        self._ensure_warmup_thread()
+        return self.executor.submit(self._send, payload)
+
+    def generate(self, model, prompt, options=None):
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(model, prompt, options).result()
+
+    def _send(self, payload):
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/generate",
+                headers={'Content-Type': 'application/json'},
+                data=json.dumps(payload),
+                timeout=(5, OLLAMA_REQUEST_TIMEOUT_SECONDS)
+            )
+            response.raise_for_status()
+            result = response.json()
+            with self._lock:
+                self._completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def get_stats(self):
+        """Queue depth and throughput counters, e.g. for logs or status pages."""
+        with self._lock:
+            return {
+                'queued': self._queued,
+                'in_flight': self._in_flight,
+                'parallelism': self.parallelism,
+                'completed': self._completed,
+                'failed': self._failed,
+                'warm_models': sorted(self._model_last_used)
+            }
+
+    # --- Warm-keeping ---
+
+    def warm_model(self, model):
+        """
+        Loads the model (an empty prompt makes Ollama load it without generating) and resets its keep-alive timer.
+        Returns True on success. Sent outside the executor so it never waits behind queued generations.
+        """
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/generate",
+                headers={'Content-Type': 'application/json'},
+                data=json.dumps({"model": model, "prompt": "", "stream": False, "keep_alive": self.keep_alive}),
+                timeout=(5, 600)
+            )
+            response.raise_for_status()
+            with self._lock:
+                self._model_last_used.setdefault(model, time.time())
+            debug_ollama_print(f"Model {model} warm (keep_alive={self.keep_alive}).")
+            return True
+        except requests.exceptions.RequestException as e:
+            debug_ollama_print(f"WARNING: Could not warm model {model}: {e}")
+            return False
+
+    def warm_model_async(self, model):
+        threading.Thread(target=self.warm_model, args=(model,), daemon=True).start()
+
+    def _ensure_warmup_thread(self):
+        if self.warmup_interval <= 0:
+            return
+        with self._lock:
+            if self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(target=self._warmup_loop, name="ollama-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def _warmup_loop(self):
+        while True:
+            time.sleep(self.warmup_interval)
+            now = time.time()
+            with self._lock:
+                models = [m for m, last_used in self._model_last_used.items() if now - last_used < OLLAMA_WARM_IDLE_LIMIT_SECONDS]
+                busy = self._in_flight > 0 or self._queued > 0
+                # Forget models that have been idle too long so they are allowed to unload
+                for m in [m for m in self._model_last_used if m not in models]:
+                    del self._model_last_used[m]
+            if busy:
+                continue # Active requests already keep the models loaded
+            for model in models:
+                self.warm_model(model)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the process-wide OllamaClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
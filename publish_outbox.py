@@ -0,0 +1,365 @@
+# publish_outbox.py
+#
+# Durable publishing state for posts (table publish_outbox, created by database_manager), so a crash or a
+# failed Graph call can never lose a post or publish it twice.
+#
+#   queued -> uploading_media -> media_uploaded -> publishing -> published
+#                    \                 \                \
+#                     +-----------------+----------------+--> failed_retryable -> (claimed again)
+#                                                         \-> failed_permanent
+#
+# Photos can also be uploaded ahead of time while an entry is still queued (see
+# facebook_scheduler.preupload_media); media_uploaded_at and media_image_key tell whether the stored
+# media_fbid is still usable when the post is published.
+#
+# With native Facebook scheduling, 'publishing' leads to 'scheduled' instead: Facebook holds the post
+# (facebook_post_id) until scheduled_publish_time, and the entry becomes 'published' once it is live.
+#
+# Every transition is a compare-and-set on the current state, so only one worker can claim a post. The
+# uploaded photo's media_fbid is stored as soon as it is known and reused by later attempts. A post is
+# marked published in the same transaction that records its Facebook ID on the posts row.
+#
+# A crash while 'publishing' leaves it unknown whether Facebook created the post. recover() (run at startup)
+# resolves those entries by looking for the post on the page before anything is retried. It only touches
+# entries idle for RECOVERY_STALE_SECONDS, so starting a publisher while another one is running is safe.
+
+import os
+import sys
+import time
+
+import database_manager
+
+# --- Debugging setup ---
+DEBUG_OUTBOX_MODE = True
+
+def debug_outbox_print(message):
+    if DEBUG_OUTBOX_MODE:
+        print(f"[DEBUG - Publish Outbox]: {message}")
+
+QUEUED = "queued"
+UPLOADING_MEDIA = "uploading_media"
+MEDIA_UPLOADED = "media_uploaded"
+PUBLISHING = "publishing"
+PUBLISHED = "published"
+FAILED_RETRYABLE = "failed_retryable"
+FAILED_PERMANENT = "failed_permanent"
+SCHEDULED = "scheduled"
+
+CLAIMABLE_STATES = (QUEUED, FAILED_RETRYABLE)
+IN_FLIGHT_STATES = (UPLOADING_MEDIA, MEDIA_UPLOADED, PUBLISHING)
+
+PUBLISH_MAX_ATTEMPTS = int(os.getenv('PUBLISH_MAX_ATTEMPTS', 5))
+RETRY_BACKOFF_SECONDS = float(os.getenv('PUBLISH_RETRY_BACKOFF_SECONDS', 60)) # Doubles with every attempt
+# In-flight entries untouched for this long belong to a dead publisher (live ones update within a Graph call timeout)
+RECOVERY_STALE_SECONDS = float(os.getenv('PUBLISH_RECOVERY_STALE_SECONDS', 600))
+# Unpublished photos are not kept by Facebook forever; older uploads are redone instead of attached
+MEDIA_MAX_AGE_HOURS = float(os.getenv('PUBLISH_MEDIA_MAX_AGE_HOURS', 24))
+
+# Graph API error codes worth retrying: unknown/temporary errors and the various rate limits
+RETRYABLE_GRAPH_ERROR_CODES = {1, 2, 4, 17, 32, 341, 368, 613, 80001}
+
+_ENTRY_COLUMNS = ('post_id', 'state', 'media_fbid', 'facebook_post_id', 'attempts', 'last_error', 'next_attempt_at', 'updated_at',
+                  'scheduled_publish_time', 'scheduled_image_key', 'media_uploaded_at', 'media_image_key')
+
+def _row_to_entry(row):
+    return dict(zip(_ENTRY_COLUMNS, row)) if row else None
+
+def get_entry(post_id, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM publish_outbox WHERE post_id = ?", (post_id,))
+        return _row_to_entry(cursor.fetchone())
+    finally:
+        if own_conn:
+            conn.close()
+
+def enqueue(post_id, retry_permanent=False):
+    """
+    Creates the outbox entry of a post (state 'queued') if it has none, and returns the entry.
+    With retry_permanent, a failed_permanent entry is put back in the queue (e.g. after the user fixed the page token).
+    """
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO publish_outbox (post_id, state, updated_at) VALUES (?, ?, ?)",
+                       (post_id, QUEUED, time.time()))
+        if retry_permanent:
+            cursor.execute("UPDATE publish_outbox SET state = ?, attempts = 0, next_attempt_at = NULL, updated_at = ? "
+                           "WHERE post_id = ? AND state = ?", (QUEUED, time.time(), post_id, FAILED_PERMANENT))
+        conn.commit()
+        return get_entry(post_id, conn)
+    finally:
+        conn.close()
+
+def transition(post_id, from_states, to_state, conn=None, **fields):
+    """
+    Moves an entry to to_state if it is currently in one of from_states, also setting the given columns
+    (media_fbid, facebook_post_id, last_error, next_attempt_at). Returns True if this caller made the move.
+    """
+    assignments = ["state = ?", "updated_at = ?"]
+    params = [to_state, time.time()]
+    for column, value in fields.items():
+        if column not in _ENTRY_COLUMNS:
+            raise ValueError(f"Unknown publish_outbox column: {column}")
+        assignments.append(f"{column} = ?")
+        params.append(value)
+    params.append(post_id)
+    params.extend(from_states)
+
+    own_conn = conn is None
+    if own_conn:
+        conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"UPDATE publish_outbox SET {', '.join(assignments)} "
+                       f"WHERE post_id = ? AND state IN ({','.join('?' * len(from_states))})", params)
+        if own_conn:
+            conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        if own_conn:
+            conn.close()
+
+def claim(post_id, retry_permanent=False):
+    """
+    Enqueues a post if needed and claims it for publishing (state 'uploading_media', attempts + 1).
+    Returns the claimed entry, or None if the post is already published, in flight elsewhere, or not due for a retry yet.
+    """
+    entry = enqueue(post_id, retry_permanent=retry_permanent)
+    if entry['state'] not in CLAIMABLE_STATES:
+        return None
+    if entry['state'] == FAILED_RETRYABLE and entry['next_attempt_at'] and entry['next_attempt_at'] > time.time():
+        return None
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"UPDATE publish_outbox SET state = ?, attempts = attempts + 1, updated_at = ? "
+                       f"WHERE post_id = ? AND state IN ({','.join('?' * len(CLAIMABLE_STATES))})",
+                       (UPLOADING_MEDIA, time.time(), post_id) + CLAIMABLE_STATES)
+        conn.commit()
+        if cursor.rowcount != 1:
+            return None # Another worker claimed it first
+        return get_entry(post_id, conn)
+    finally:
+        conn.close()
+
+def store_media(post_id, media_fbid, image_key, queued_only=False, conn=None):
+    """
+    Stores an uploaded photo for a post without changing its state. Returns False if the entry is past the
+    point where media can change (scheduled or published), or with queued_only, if a publisher has claimed it.
+    """
+    in_states = CLAIMABLE_STATES if queued_only else CLAIMABLE_STATES + (UPLOADING_MEDIA, PUBLISHING)
+    return _update_fields(post_id, in_states, conn=conn, media_fbid=media_fbid,
+                          media_uploaded_at=time.time() if media_fbid else None, media_image_key=image_key if media_fbid else None)
+
+def _update_fields(post_id, in_states, conn=None, **fields):
+    own_conn = conn is None
+    if own_conn:
+        conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"UPDATE publish_outbox SET {', '.join(f'{column} = ?' for column in fields)} "
+                       f"WHERE post_id = ? AND state IN ({','.join('?' * len(in_states))})",
+                       tuple(fields.values()) + (post_id,) + tuple(in_states))
+        if own_conn:
+            conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        if own_conn:
+            conn.close()
+
+def is_media_usable(entry, image_key, max_age_hours=MEDIA_MAX_AGE_HOURS):
+    """True if the entry's stored media_fbid was uploaded for image_key and has not expired."""
+    if not entry or not entry.get('media_fbid'):
+        return False
+    if entry.get('media_image_key') and entry['media_image_key'] != image_key:
+        return False # The post's image was replaced after the upload
+    uploaded_at = entry.get('media_uploaded_at')
+    return uploaded_at is None or time.time() - uploaded_at < max_age_hours * 3600
+
+def mark_published(post_id, facebook_post_id, fb_page_id=None, fb_access_token=None):
+    """Marks the entry published and records the Facebook ID on the post, in one transaction."""
+    facebook_post_id = database_manager.normalize_facebook_post_id(facebook_post_id, fb_page_id)
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        if fb_page_id and fb_access_token:
+            cursor.execute("UPDATE posts SET actual_post_id = ?, posted = 'Yes', facebook_page_id = ?, facebook_access_token = ? WHERE id = ?",
+                           (facebook_post_id, fb_page_id, fb_access_token, post_id))
+        else:
+            cursor.execute("UPDATE posts SET actual_post_id = ?, posted = 'Yes' WHERE id = ?", (facebook_post_id, post_id))
+        transition(post_id, IN_FLIGHT_STATES + CLAIMABLE_STATES + (SCHEDULED,), PUBLISHED, conn=conn,
+                   facebook_post_id=facebook_post_id, last_error=None)
+        conn.commit()
+        return facebook_post_id
+    finally:
+        conn.close()
+
+def mark_scheduled(post_id, facebook_post_id, scheduled_publish_time, image_key=None, fb_page_id=None):
+    """Records a post handed to Facebook's own scheduler. posts.posted stays 'No' until it goes live."""
+    facebook_post_id = database_manager.normalize_facebook_post_id(facebook_post_id, fb_page_id)
+    transition(post_id, IN_FLIGHT_STATES + (SCHEDULED,), SCHEDULED, facebook_post_id=facebook_post_id,
+               scheduled_publish_time=scheduled_publish_time, scheduled_image_key=image_key, last_error=None)
+    return facebook_post_id
+
+def get_scheduled_entries_to_sync(now=None):
+    """
+    Natively scheduled entries that need attention: the post was edited, unapproved or deleted since it was
+    handed to Facebook, or its publish time has passed. Each entry also carries the post's current fields
+    (None for deleted posts).
+    """
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {', '.join('o.' + column for column in _ENTRY_COLUMNS)}, p.id, p.posted, p.is_approved, p.updated_at
+            FROM publish_outbox o
+            LEFT JOIN posts p ON p.id = o.post_id
+            WHERE o.state = ?
+              AND (p.id IS NULL OR p.updated_at > o.updated_at OR o.scheduled_publish_time <= ?)
+        ''', (SCHEDULED, now or time.time()))
+        entries = []
+        for row in cursor.fetchall():
+            entry = _row_to_entry(row[:len(_ENTRY_COLUMNS)])
+            entry['post_exists'] = row[len(_ENTRY_COLUMNS)] is not None
+            entry['post_posted'], entry['post_is_approved'], entry['post_updated_at'] = row[len(_ENTRY_COLUMNS) + 1:]
+            entries.append(entry)
+        return entries
+    finally:
+        conn.close()
+
+def remove_entry(post_id):
+    conn = database_manager.connect_db()
+    try:
+        conn.execute("DELETE FROM publish_outbox WHERE post_id = ?", (post_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def is_retryable_error(status_code=None, graph_error_code=None, is_transient=False):
+    """Classifies a failed Graph call: network errors, 5xx, throttling and transient Graph errors are retried."""
+    if is_transient or graph_error_code in RETRYABLE_GRAPH_ERROR_CODES:
+        return True
+    return status_code is None or status_code >= 500 or status_code == 429
+
+def mark_failed(post_id, error, retryable):
+    """
+    Records a failed attempt. Retryable failures back off exponentially and become permanent after
+    PUBLISH_MAX_ATTEMPTS attempts. Any stored media_fbid is kept for the next attempt.
+    """
+    entry = get_entry(post_id)
+    if entry is None:
+        return None
+    attempts = entry['attempts'] or 0
+    if retryable and attempts < PUBLISH_MAX_ATTEMPTS:
+        state = FAILED_RETRYABLE
+        next_attempt_at = time.time() + RETRY_BACKOFF_SECONDS * (2 ** max(0, attempts - 1))
+    else:
+        state = FAILED_PERMANENT
+        next_attempt_at = None
+    transition(post_id, IN_FLIGHT_STATES + (QUEUED,), state, last_error=str(error)[:1000], next_attempt_at=next_attempt_at)
+    debug_outbox_print(f"Post ID {post_id} -> {state} after attempt {attempts}: {error}")
+    return state
+
+def get_entries(states):
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM publish_outbox WHERE state IN ({','.join('?' * len(states))})",
+                       tuple(states))
+        return [_row_to_entry(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def get_retry_due_post_ids(now=None):
+    """Posts in failed_retryable whose backoff has elapsed."""
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT post_id FROM publish_outbox WHERE state = ? AND (next_attempt_at IS NULL OR next_attempt_at <= ?)",
+                       (FAILED_RETRYABLE, now or time.time()))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def recover(find_published_post, stale_after_seconds=RECOVERY_STALE_SECONDS, stale_before=None, page_name=None):
+    """
+    Startup recovery scan for entries left in flight by a crashed publisher.
+
+    Args:
+        find_published_post: callable(post_details_dict, since_timestamp) -> (Facebook post ID, scheduled publish
+            time or None) if the post is already on the page (live or scheduled there), None if it is not, or raises
+            if that cannot be determined right now.
+        stale_before: unix time; entries updated after it are left alone (default: stale_after_seconds ago).
+        page_name: only settle entries of this page's posts (e.g. a page taken over from a dead worker).
+
+    Returns:
+        dict: counts of entries resolved per outcome.
+    """
+    stats = {'requeued': 0, 'published': 0, 'unresolved': 0}
+    if stale_before is None:
+        stale_before = time.time() - stale_after_seconds
+    for entry in get_entries(IN_FLIGHT_STATES):
+        if (entry['updated_at'] or 0) > stale_before:
+            continue # Probably still being worked on by a live publisher
+        post_id = entry['post_id']
+        post = database_manager.get_post_details_by_db_id(post_id)
+        if page_name is not None and (post is None or post.get('page_name') != page_name):
+            continue
+        if entry['state'] in (UPLOADING_MEDIA, MEDIA_UPLOADED):
+            # Nothing was posted yet; an unpublished photo is harmless and is reused if its ID was stored
+            transition(post_id, (entry['state'],), FAILED_RETRYABLE, next_attempt_at=None,
+                       last_error=f"Interrupted in state {entry['state']}")
+            stats['requeued'] += 1
+            continue
+
+        if post is None:
+            transition(post_id, (PUBLISHING,), FAILED_PERMANENT, last_error="Post no longer exists")
+            continue
+        try:
+            found = find_published_post(post, (entry['updated_at'] or time.time()) - 300)
+        except Exception as e:
+            print(f"WARNING: Could not check whether Post ID {post_id} was published ({e}); leaving it in '{PUBLISHING}'.")
+            stats['unresolved'] += 1
+            continue
+        if found:
+            facebook_post_id, scheduled_publish_time = found
+            if scheduled_publish_time:
+                mark_scheduled(post_id, facebook_post_id, scheduled_publish_time, post.get('generated_image_filename'),
+                               post.get('facebook_page_id'))
+            else:
+                mark_published(post_id, facebook_post_id, post.get('facebook_page_id'), post.get('facebook_access_token'))
+            print(f"Recovered Post ID {post_id}: it had been {'scheduled' if scheduled_publish_time else 'published'} as {facebook_post_id}.")
+            stats['published'] += 1
+        else:
+            transition(post_id, (PUBLISHING,), FAILED_RETRYABLE, next_attempt_at=None,
+                       last_error="Interrupted while publishing; not found on the page")
+            stats['requeued'] += 1
+    if any(stats.values()):
+        print(f"Publish outbox recovery: {stats}")
+    return stats
+
+def get_outbox_stats():
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT state, COUNT(*) FROM publish_outbox GROUP BY state")
+        return dict(cursor.fetchall())
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    # Usage: python publish_outbox.py stats
+    #        python publish_outbox.py requeue <post_id>
+    if len(sys.argv) > 1 and sys.argv[1] == 'stats':
+        print(get_outbox_stats())
+    elif len(sys.argv) > 2 and sys.argv[1] == 'requeue':
+        post_id = int(sys.argv[2])
+        requeued = transition(post_id, (FAILED_RETRYABLE, FAILED_PERMANENT), QUEUED, next_attempt_at=None, last_error=None)
+        print(f"Post ID {post_id} {'requeued' if requeued else 'was not in a failed state'}.")
+    else:
+        print("Usage: python publish_outbox.py stats | requeue <post_id>")
+        sys.exit(1)
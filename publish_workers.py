@@ -0,0 +1,372 @@
+# publish_workers.py
+#
+# Sharded publishing: several worker processes (on one host, sharing the SQLite database) publish due posts
+# in parallel, each owning a subset of pages through leases in the publish_leases table.
+#
+# A worker registers in publish_workers, then every cycle it renews its leases (heartbeat), finds the pages
+# with due posts, and claims unowned or expired page leases up to its fair share (pages with work divided
+# by live workers, in rendezvous-hash order so workers prefer different pages). It publishes only the due
+# posts of pages it holds and releases pages that have run out of work or exceed its share. A separate
+# heartbeat thread keeps the leases alive during long publishes (as long as posts keep completing); a
+# worker that dies or hangs stops renewing, its leases expire after PUBLISH_LEASE_SECONDS, and another
+# worker takes the pages over. Before publishing them it settles the page's posts the old owner left in
+# flight (outbox recovery for that page, treating everything last touched before the lease expired as stale).
+#
+# Leases only decide who should work on a page. What rules out double publishing is the publish outbox:
+# every publish starts with its compare-and-set claim, so even two workers that both believe they own a
+# page (e.g. one paused past its lease) cannot both send the same post.
+#
+# Housekeeping that must run once (native schedule sync, media pre-upload, periodic recovery scan) is
+# guarded by its own lease.
+#
+# Usage: python publish_workers.py <output_dir> [--workers N]
+#        python publish_workers.py --status
+
+import os
+import sys
+import math
+import time
+import uuid
+import socket
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+
+import database_manager
+import publish_outbox
+import facebook_scheduler
+
+# --- Debugging setup ---
+DEBUG_WORKERS_MODE = True
+
+def debug_workers_print(message):
+    if DEBUG_WORKERS_MODE:
+        print(f"[DEBUG - Publish Workers]: {message}")
+
+PUBLISH_WORKERS = int(os.getenv('PUBLISH_WORKERS', 4))
+# A lease not renewed for this long is considered abandoned and can be taken over
+PUBLISH_LEASE_SECONDS = float(os.getenv('PUBLISH_LEASE_SECONDS', 90))
+PUBLISH_HEARTBEAT_SECONDS = float(os.getenv('PUBLISH_HEARTBEAT_SECONDS', 20))
+PUBLISH_WORKER_POLL_SECONDS = float(os.getenv('PUBLISH_WORKER_POLL_SECONDS', 15))
+# A worker whose publishing loop has made no progress for this long stops renewing its leases, so a hung
+# process cannot hold its pages forever just because its heartbeat thread is still alive
+PUBLISH_WORKER_STALL_SECONDS = float(os.getenv('PUBLISH_WORKER_STALL_SECONDS', 600))
+HOUSEKEEPING_KEY = "task:housekeeping"
+# How often the housekeeping worker scans the outbox for posts stuck in flight (settled once stale)
+PUBLISH_RECOVERY_INTERVAL_SECONDS = float(os.getenv('PUBLISH_RECOVERY_INTERVAL_SECONDS', 60))
+WORKER_ROW_RETENTION_SECONDS = 86400
+SUPERVISOR_CHECK_SECONDS = 5
+
+def page_key(page_name):
+    return f"page:{page_name}"
+
+# --- Lease table ---
+
+def register_worker(worker_id):
+    now = time.time()
+    conn = database_manager.connect_db()
+    try:
+        conn.execute("DELETE FROM publish_workers WHERE heartbeat_at < ?", (now - WORKER_ROW_RETENTION_SECONDS,))
+        conn.execute("INSERT OR REPLACE INTO publish_workers (worker_id, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)",
+                     (worker_id, socket.gethostname(), os.getpid(), now, now))
+        conn.commit()
+    finally:
+        conn.close()
+
+def deregister_worker(worker_id):
+    """Releases every lease of the worker and removes its registration (clean shutdown)."""
+    conn = database_manager.connect_db()
+    try:
+        conn.execute("UPDATE publish_leases SET worker_id = NULL, lease_expires_at = 0 WHERE worker_id = ?", (worker_id,))
+        conn.execute("DELETE FROM publish_workers WHERE worker_id = ?", (worker_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def heartbeat(worker_id, lease_seconds=PUBLISH_LEASE_SECONDS):
+    """Renews the worker's registration and all leases it still holds. Returns the set of shard keys it holds."""
+    now = time.time()
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE publish_workers SET heartbeat_at = ? WHERE worker_id = ?", (now, worker_id))
+        cursor.execute("UPDATE publish_leases SET lease_expires_at = ?, heartbeat_at = ? WHERE worker_id = ?",
+                       (now + lease_seconds, now, worker_id))
+        cursor.execute("SELECT shard_key FROM publish_leases WHERE worker_id = ?", (worker_id,))
+        owned = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+        return owned
+    finally:
+        conn.close()
+
+def try_acquire(shard_key, worker_id, lease_seconds=PUBLISH_LEASE_SECONDS):
+    """
+    Takes the lease on shard_key if it is free, expired, or already ours.
+    Returns (acquired, previous owner, its lease expiry) - the last two are set when an expired lease was taken over.
+    """
+    now = time.time()
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE") # Read and update under the write lock, so two workers cannot both win
+        cursor.execute("SELECT worker_id, lease_expires_at FROM publish_leases WHERE shard_key = ?", (shard_key,))
+        row = cursor.fetchone()
+        if row and row[0] and row[0] != worker_id and row[1] > now:
+            conn.rollback()
+            return False, None, None
+        taken_over = bool(row and row[0] and row[0] != worker_id)
+        cursor.execute('''
+            INSERT INTO publish_leases (shard_key, worker_id, lease_expires_at, acquired_at, heartbeat_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(shard_key) DO UPDATE SET
+                worker_id = excluded.worker_id,
+                lease_expires_at = excluded.lease_expires_at,
+                acquired_at = excluded.acquired_at,
+                heartbeat_at = excluded.heartbeat_at
+        ''', (shard_key, worker_id, now + lease_seconds, now, now))
+        conn.commit()
+        return True, (row[0] if taken_over else None), (row[1] if taken_over else None)
+    finally:
+        conn.close()
+
+def release(shard_key, worker_id):
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE publish_leases SET worker_id = NULL, lease_expires_at = 0 WHERE shard_key = ? AND worker_id = ?",
+                       (shard_key, worker_id))
+        conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+def count_live_workers(lease_seconds=PUBLISH_LEASE_SECONDS):
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM publish_workers WHERE heartbeat_at > ?", (time.time() - lease_seconds,))
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+def get_status():
+    """(workers, leases) rows for monitoring: workers as (worker_id, host, pid, started_at, heartbeat_at)."""
+    conn = database_manager.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT worker_id, host, pid, started_at, heartbeat_at FROM publish_workers ORDER BY started_at")
+        workers = cursor.fetchall()
+        cursor.execute("SELECT shard_key, worker_id, lease_expires_at FROM publish_leases ORDER BY shard_key")
+        return workers, cursor.fetchall()
+    finally:
+        conn.close()
+
+# --- Worker ---
+
+class PublishWorker:
+    """One publishing process: owns some pages through leases and publishes their due posts."""
+    def __init__(self, output_dir, worker_id=None, lease_seconds=PUBLISH_LEASE_SECONDS,
+                 heartbeat_seconds=PUBLISH_HEARTBEAT_SECONDS, poll_seconds=PUBLISH_WORKER_POLL_SECONDS,
+                 max_lateness_minutes=facebook_scheduler.DAEMON_MAX_LATENESS_MINUTES):
+        self.output_dir = output_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.max_lateness = timedelta(minutes=max_lateness_minutes)
+        self._owned = set() # shard keys held, as of the last heartbeat or acquisition
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat_thread = None
+        self._last_preupload = 0.0
+        self._last_recovery = time.time() # run() starts with a recovery scan
+        self._last_progress = time.monotonic()
+
+    def _rendezvous_rank(self, page_name):
+        """Stable per-worker preference order, so workers starting together reach for different pages first."""
+        return hashlib.sha1(f"{self.worker_id}|{page_name}".encode('utf-8')).hexdigest()
+
+    def _heartbeat(self):
+        owned = heartbeat(self.worker_id, self.lease_seconds)
+        with self._lock:
+            lost = self._owned - owned
+            self._owned = owned
+        if lost:
+            print(f"WARNING: Worker {self.worker_id} lost lease(s) {sorted(lost)} (expired and taken over).")
+        return owned
+
+    def _mark_progress(self, *_):
+        self._last_progress = time.monotonic()
+
+    def _heartbeat_loop(self):
+        while not self._stop_event.wait(self.heartbeat_seconds):
+            stalled_for = time.monotonic() - self._last_progress
+            if stalled_for > PUBLISH_WORKER_STALL_SECONDS:
+                print(f"WARNING: Worker {self.worker_id} made no progress for {stalled_for:.0f}s; "
+                      f"not renewing its leases so other workers can take its pages over.")
+                continue
+            try:
+                self._heartbeat()
+            except Exception as e:
+                print(f"ERROR: Heartbeat of worker {self.worker_id} failed: {e}")
+
+    def _due_posts_by_page(self, now):
+        """{page_name: [post ids]} of posts due now (within the lateness window), including retries whose backoff ended."""
+        work = {}
+        for post_id, page_name, due_time in facebook_scheduler.get_due_posts_between(now - self.max_lateness, now):
+            work.setdefault(page_name, []).append(post_id)
+        for post_id in publish_outbox.get_retry_due_post_ids():
+            post = database_manager.get_post_details_by_db_id(post_id)
+            if post and post_id not in work.get(post['page_name'], []):
+                work.setdefault(post['page_name'], []).append(post_id)
+        return work
+
+    def _balance_leases(self, work):
+        """Claims pages with work up to this worker's fair share and releases pages without work or beyond it."""
+        owned = self._heartbeat()
+        live_workers = max(1, count_live_workers(self.lease_seconds))
+        fair_share = math.ceil(len(work) / live_workers) if work else 0
+        took_over = []
+        owned_pages = {key for key in owned if key in {page_key(page) for page in work}}
+        for page_name in sorted(work, key=self._rendezvous_rank):
+            if len(owned_pages) >= fair_share:
+                break
+            key = page_key(page_name)
+            if key in owned_pages:
+                continue
+            acquired, previous_owner, previous_expiry = try_acquire(key, self.worker_id, self.lease_seconds)
+            if acquired:
+                owned_pages.add(key)
+                if previous_owner:
+                    took_over.append((page_name, previous_owner, previous_expiry))
+
+        # Idle pages go back to the pool; so does anything beyond our share once other workers are up
+        keep = set(sorted(owned_pages, key=lambda key: self._rendezvous_rank(key[len("page:"):]))[:fair_share])
+        for key in owned:
+            if key.startswith("page:") and key not in keep:
+                release(key, self.worker_id)
+        with self._lock:
+            self._owned = {key for key in owned if not key.startswith("page:")} | keep
+        if work:
+            debug_workers_print(f"{self.worker_id} holds {len(keep)} of {len(work)} page(s) with due posts "
+                                f"(fair share {fair_share}, {live_workers} live worker(s)).")
+
+        for page_name, previous_owner, previous_expiry in took_over:
+            print(f"Worker {self.worker_id} took over page '{page_name}' from expired worker {previous_owner}.")
+            # The old owner touched nothing of this page after its lease expired, so whatever it left in flight
+            # is settled now instead of after the general RECOVERY_STALE_SECONDS
+            publish_outbox.recover(facebook_scheduler.find_published_post, stale_before=previous_expiry, page_name=page_name)
+        return keep
+
+    def _housekeeping(self):
+        """
+        Native schedule sync, media pre-upload and the periodic outbox recovery scan, run by whichever worker
+        holds the housekeeping lease. The scan settles posts a dead worker left in flight once they are stale.
+        """
+        acquired, _, _ = try_acquire(HOUSEKEEPING_KEY, self.worker_id, self.lease_seconds)
+        if not acquired:
+            return
+        with self._lock:
+            self._owned.add(HOUSEKEEPING_KEY)
+        facebook_scheduler.sync_native_schedules(self.output_dir)
+        if time.time() - self._last_recovery >= PUBLISH_RECOVERY_INTERVAL_SECONDS:
+            self._last_recovery = time.time()
+            publish_outbox.recover(facebook_scheduler.find_published_post)
+        if time.time() - self._last_preupload >= facebook_scheduler.PREUPLOAD_INTERVAL_MINUTES * 60:
+            self._last_preupload = time.time()
+            facebook_scheduler.preupload_media(self.output_dir)
+
+    def run_once(self, now=None):
+        """One cycle: rebalance leases, run housekeeping if ours, publish the due posts of owned pages."""
+        now = now or datetime.now()
+        self._mark_progress()
+        work = self._due_posts_by_page(now)
+        owned_pages = self._balance_leases(work)
+        self._housekeeping()
+        due_ids = [post_id for page_name, post_ids in work.items() if page_key(page_name) in owned_pages
+                   for post_id in post_ids if facebook_scheduler.is_publishable_now(post_id, now, self.max_lateness)]
+        if not due_ids:
+            return []
+        print(f"Worker {self.worker_id} publishing {len(due_ids)} due post(s) for {len(owned_pages)} page(s): {due_ids}")
+        return facebook_scheduler.publish_posts(due_ids, self.output_dir, progress_callback=self._mark_progress)
+
+    def run(self):
+        print(f"Publish worker {self.worker_id} started (lease {self.lease_seconds:g}s, heartbeat {self.heartbeat_seconds:g}s).")
+        register_worker(self.worker_id)
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="publish-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+        try:
+            publish_outbox.recover(facebook_scheduler.find_published_post)
+            while not self._stop_event.is_set():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"ERROR: Publish worker {self.worker_id} step failed: {e}")
+                self._stop_event.wait(self.poll_seconds)
+        finally:
+            self._stop_event.set()
+            deregister_worker(self.worker_id)
+            print(f"Publish worker {self.worker_id} stopped; its leases were released.")
+
+    def stop(self):
+        self._stop_event.set()
+
+def _worker_main(output_dir):
+    worker = PublishWorker(output_dir)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
+def run_workers(output_dir, num_workers=PUBLISH_WORKERS):
+    """Starts num_workers worker processes and restarts any that exit unexpectedly, until interrupted."""
+    def start(index):
+        process = multiprocessing.Process(target=_worker_main, args=(output_dir,), name=f"publish-worker-{index}")
+        process.start()
+        return process
+
+    processes = [start(index) for index in range(num_workers)]
+    print(f"Started {num_workers} publish worker process(es) for {output_dir}.")
+    try:
+        while True:
+            time.sleep(SUPERVISOR_CHECK_SECONDS)
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    print(f"WARNING: {process.name} exited (code {process.exitcode}); restarting it. "
+                          f"Its pages are picked up by the others once its leases expire.")
+                    processes[index] = start(index)
+    except KeyboardInterrupt:
+        print("Stopping publish workers...")
+    finally:
+        for process in processes:
+            process.join(timeout=PUBLISH_LEASE_SECONDS)
+            if process.is_alive():
+                process.terminate()
+
+def print_status():
+    workers, leases = get_status()
+    now = time.time()
+    print(f"{len(workers)} registered worker(s):")
+    for worker_id, host, pid, started_at, heartbeat_at in workers:
+        state = "live" if heartbeat_at and now - heartbeat_at < PUBLISH_LEASE_SECONDS else "stale"
+        print(f"  {worker_id} (pid {pid} on {host}): {state}, last heartbeat {now - (heartbeat_at or 0):.0f}s ago")
+    print(f"{len(leases)} lease(s):")
+    for shard_key, worker_id, lease_expires_at in leases:
+        if worker_id and lease_expires_at > now:
+            print(f"  {shard_key}: {worker_id}, expires in {lease_expires_at - now:.0f}s")
+        else:
+            print(f"  {shard_key}: free")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run sharded publishing worker processes that share pages through SQLite leases.")
+    parser.add_argument("output_dir", nargs='?', default=os.getenv('OUTPUT_DIR', "Generated_Posts_Output"), help="Base output directory containing generated_images.")
+    parser.add_argument("--workers", type=int, default=PUBLISH_WORKERS, help="Number of worker processes.")
+    parser.add_argument("--status", action="store_true", help="Show registered workers and page leases, then exit.")
+    args = parser.parse_args()
+    if args.status:
+        print_status()
+        sys.exit(0)
+    run_workers(args.output_dir, args.workers)
+    sys.exit(0)
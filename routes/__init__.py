@@ -4,6 +4,9 @@ from datetime import datetime
 from flask import Flask, Blueprint, session, redirect, url_for, flash, current_app
 from flask_moment import Moment
 import database_manager
+import text_generator
+import ollama_client
+import image_gc
 
 # Import the ConfigLoader from the same package
 from .config_loader import ConfigLoader, FACEBOOK_PAGES
@@ -75,6 +78,8 @@ def create_app(project_root=None):
         if FACEBOOK_PAGES:
             print(f"[DEBUG - __init__.py]: First page name: {FACEBOOK_PAGES[0].get('page_name')}")
         database_manager.create_tables()
+        # Periodic orphan cleanup / disk quota for generated images (IMAGE_GC_INTERVAL_HOURS=0 disables it)
+        image_gc.start_scheduled_gc(app.config['OUTPUT_DIR'])
         _app_initialized = True
 
     app.jinja_env.globals.update(
@@ -113,6 +118,16 @@ def get_api_key_status():
     gcp_project_id = os.getenv('GCP_PROJECT_ID')
     gcp_region = os.getenv('GCP_REGION')
     status['IMAGEN_STATUS'] = f"Set (Project: {gcp_project_id}, Region: {gcp_region})" if gcp_project_id and gcp_region else "Not Set (Required for Imagen)"
+
+    # Cached result; a stale entry is refreshed in the background so page renders never wait on Ollama
+    local_llm = text_generator.get_local_llm_status()
+    if local_llm['ok'] is None:
+        status['LOCAL_LLM_STATUS'] = "Checking..."
+    else:
+        status['LOCAL_LLM_STATUS'] = "Running" if local_llm['ok'] else "Not Reachable"
+    llm_queue = ollama_client.get_client().get_stats()
+    if llm_queue['queued'] or llm_queue['in_flight']:
+        status['LOCAL_LLM_STATUS'] += f" ({llm_queue['in_flight']}/{llm_queue['parallelism']} in flight, {llm_queue['queued']} queued)"
     
     return status
 
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, flash
 import ml_predictor # Correct module for ML logic
+import database_manager
 
 ml_routes = Blueprint('ml_routes', __name__)
 
@@ -15,6 +16,16 @@ def ml_dashboard_page():
     insights['generator_params'] = {'providers': [], 'models': [], 'temperatures': [], 'message': "No data processed."}
     insights['posting_times'] = {'hours': [], 'days': [], 'message': "No data processed."}
 
+    # API usage is a cheap aggregate query, so it is always shown (no model training needed)
+    try:
+        insights['api_usage'] = {
+            'stats': database_manager.get_api_call_stats(),
+            'summary': database_manager.get_api_cost_summary()
+        }
+    except Exception as e:
+        print(f"ML Dashboard API usage error: {e}")
+        insights['api_usage'] = {'stats': [], 'summary': None}
+
 
     # Trigger analysis on GET (initial load) or POST (explicit refresh)
     if request.method == 'POST' or request.args.get('run_analysis') == 'true':
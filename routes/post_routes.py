@@ -1,5 +1,5 @@
 # routes/post_routes.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, send_file, abort
 import os
 import json
 import threading
@@ -14,7 +14,11 @@ import re # Added for post_review_page regex check
 import database_manager
 import text_generator
 import image_generator
+import image_generation_service
 import ml_predictor
+import duplicate_detector
+import image_store
+import thumbnail_cache
 from .config_loader import FACEBOOK_PAGES, ConfigLoader # For accessing pages config and saving
 
 post_routes = Blueprint('post_routes', __name__)
@@ -113,6 +117,26 @@ def generate_posts_page():
                            generation_output_log=generation_output_log)
 
 
+@post_routes.route('/thumbnail/<path:image_key>')
+def image_thumbnail(image_key):
+    """
+    Serves a cached JPEG thumbnail of a stored image; ?size=N sets the bounding box (default 200), N being
+    one of thumbnail_cache.WEB_THUMBNAIL_SIZES so requests cannot fill the disk with arbitrary sizes.
+    """
+    output_dir = current_app.config['OUTPUT_DIR']
+    if (not image_store.is_valid_key(image_key)
+            or not image_store.is_inside_images_dir(output_dir, image_store.get_image_path(output_dir, image_key))):
+        abort(404)
+    size = request.args.get('size', thumbnail_cache.DEFAULT_THUMBNAIL_SIZE[0], type=int)
+    if size not in thumbnail_cache.WEB_THUMBNAIL_SIZES:
+        abort(400)
+    thumbnail_path = thumbnail_cache.ensure_thumbnail(output_dir, image_key, (size, size))
+    if not thumbnail_path:
+        abort(404)
+    # Thumbnails are keyed by image content, so a key's thumbnail only changes for re-written legacy names
+    return send_file(os.path.abspath(thumbnail_path), mimetype='image/jpeg', max_age=86400)
+
+
 # At the module level - BEFORE any background thread functions
 @post_routes.route('/post_review', methods=['GET', 'POST'])
 def post_review_page():
@@ -197,6 +221,7 @@ def post_review_page():
             )
             if success:
                 database_manager.update_post_approval_status(post_id, is_approved)
+                duplicate_detector.update_edited_post(post_id, updated_content_en, updated_content_ar)
                 flash(f"Post ID {post_id} updated successfully.", "success")
                 return redirect(
                     url_for('post_routes.post_review_page', filter=current_filter, selected_post_id=post_id))
@@ -208,16 +233,14 @@ def post_review_page():
         elif action == 'delete_post':
             success, image_filename_from_db = database_manager.delete_post_by_id(post_id)
             if success:
+                duplicate_detector.update_deleted_post(post_id)
                 if image_filename_from_db:
-                    image_save_dir = os.path.join(current_app.config['OUTPUT_DIR'], "generated_images")
-                    image_path = os.path.join(image_save_dir, image_filename_from_db)
-                    if os.path.exists(image_path):
-                        try:
-                            os.remove(image_path)
-                            print(f"Deleted associated image file: {image_path}")
-                        except Exception as e:
-                            print(f"Error deleting image file {image_path}: {e}")
-                            flash(f"Post deleted, but could not delete image file: {e}", "warning")
+                    try:
+                        # Identical images are stored once, so the file is only removed if no other post uses it
+                        image_store.delete_image_if_unreferenced(current_app.config['OUTPUT_DIR'], image_filename_from_db)
+                    except Exception as e:
+                        print(f"Error deleting image file {image_filename_from_db}: {e}")
+                        flash(f"Post deleted, but could not delete image file: {e}", "warning")
 
                 flash(f"Post ID {post_id} deleted successfully.", "success")
                 return redirect(url_for('post_routes.post_review_page', filter=current_filter))
@@ -251,12 +274,12 @@ def post_review_page():
                 return redirect(
                     url_for('post_routes.post_review_page', filter=current_filter, selected_post_id=post_id))
 
-            threading.Thread(target=_run_single_image_generation_background, args=(
+            _run_single_image_generation_background(
                 app_for_thread,
                 post_id, effective_prompt, image_gen_provider, image_gen_model,
                 current_app.config['OUTPUT_DIR'], image_prompt_en, image_prompt_ar,
                 current_filter
-            )).start()
+            )
 
             flash("Image generation started in background. Page will refresh upon completion.", "info")
             return redirect(url_for('post_routes.post_review_page', filter=current_filter, selected_post_id=post_id))
@@ -266,14 +289,9 @@ def post_review_page():
             if not image_file:
                 return jsonify(status='error', message='No image file provided.'), 400
 
-            destination_dir = os.path.join(current_app.config['OUTPUT_DIR'], "generated_images")
-            os.makedirs(destination_dir, exist_ok=True)
-
-            filename = f"uploaded_image_{post_id}_{int(datetime.now().timestamp())}{os.path.splitext(image_file.filename)[1]}"
-            filepath = os.path.join(destination_dir, filename)
-
             try:
-                image_file.save(filepath)
+                filename = image_store.store_image_stream(
+                    current_app.config['OUTPUT_DIR'], image_file.stream, os.path.splitext(image_file.filename)[1] or ".png")
                 database_manager.update_post_content_and_image(
                     post_id,
                     None, None,
@@ -290,22 +308,12 @@ def post_review_page():
         elif action == 'clear_image':
             image_filename_from_db = current_post_data.get('generated_image_filename')
             if image_filename_from_db:
-                image_path = os.path.join(current_app.config['OUTPUT_DIR'], "generated_images", image_filename_from_db)
-                if os.path.exists(image_path):
-                    try:
-                        os.remove(image_path)
-                        print(f"Deleted associated image file: {image_path}")
-                    except Exception as e:
-                        print(f"Error deleting image file {image_path}: {e}")
-                        flash(f"Post deleted, but could not delete image file: {e}", "warning")
-
-                database_manager.update_post_content_and_image(
-                    post_id,
-                    None, None,
-                    generated_image_filename=None,
-                    image_prompt_en=None,
-                    image_prompt_ar=None
-                )
+                database_manager.clear_post_image(post_id)
+                try:
+                    image_store.delete_image_if_unreferenced(current_app.config['OUTPUT_DIR'], image_filename_from_db)
+                except Exception as e:
+                    print(f"Error deleting image file {image_filename_from_db}: {e}")
+                    flash(f"Image cleared, but could not delete image file: {e}", "warning")
                 flash(f"Image for Post ID {post_id} cleared.", "success")
             else:
                 flash("No image to clear for selected post.", "info")
@@ -422,6 +430,7 @@ def _run_post_generation_background(app, num_posts, output_dir, text_gen_provide
             "--text_gen_provider", current_text_gen_provider,
             "--gemini_text_model", current_text_gen_model_final,
             "--openai_text_model", current_text_gen_model_final,
+            "--local_text_model", current_text_gen_model_final,
             "--openai_image_model", openai_image_model,
             "--temperature", str(current_gemini_temperature),
             "--start_date", initial_schedule_datetime.strftime("%Y-%m-%d"),
@@ -478,28 +487,34 @@ def _run_post_generation_background(app, num_posts, output_dir, text_gen_provide
 
 def _run_single_image_generation_background(app, post_id, effective_prompt, image_gen_provider, image_gen_model,
                                             output_dir, image_prompt_en, image_prompt_ar, current_filter):
-    with app.app_context():
-        _log_to_output(f"Starting single image generation for Post ID {post_id}...")
-        try:
-            generated_filename = image_generator.generate_image(
-                effective_prompt,
-                output_dir=output_dir,
-                provider=image_gen_provider,
-                model=image_gen_model
-            )
+    """Queues the image on the shared image generation pool; the post is updated when the future completes."""
+    _log_to_output(f"Starting single image generation for Post ID {post_id}...")
+    image_future = image_generation_service.get_service().submit_one(
+        effective_prompt,
+        output_dir=output_dir,
+        provider=image_gen_provider,
+        model=image_gen_model,
+        post_id=post_id
+    )
+
+    def on_image_generated(future):
+        with app.app_context():
+            try:
+                generated_filename = future.result()
+
+                if generated_filename:
+                    database_manager.update_post_content_and_image(
+                        post_id,
+                        None, None,
+                        generated_image_filename=generated_filename,
+                        image_prompt_en=image_prompt_en,
+                        image_prompt_ar=image_prompt_ar
+                    )
+                    _log_to_output(f"New image generated and saved for Post ID {post_id}.")
+                else:
+                    _log_to_output(f"AI image generation failed for Post ID {post_id}. See server console for details.")
+            except Exception as e:
+                _log_to_output(f"CRITICAL ERROR in single image generation for Post ID {post_id}: {e}")
 
-            if generated_filename:
-                database_manager.update_post_content_and_image(
-                    post_id,
-                    None, None,
-                    generated_image_filename=generated_filename,
-                    image_prompt_en=image_prompt_en,
-                    image_prompt_ar=image_prompt_ar
-                )
-                _log_to_output(f"New image generated and saved for Post ID {post_id}.")
-            else:
-                _log_to_output(f"AI image generation failed for Post ID {post_id}. See server console for details.")
-        except Exception as e:
-            _log_to_output(f"CRITICAL ERROR in single image generation thread for Post ID {post_id}: {e}")
-        finally:
-            pass
\ No newline at end of file
+    image_future.add_done_callback(on_image_generated)
+    return image_future
\ No newline at end of file
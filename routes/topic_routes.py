@@ -231,6 +231,7 @@ def _run_gemini_generation_background(app, topics_to_process, page_name_for_redi
                       "danger")  # Flash on main context
                 return
 
+            text_generator.ensure_apis_configured()  # genai.configure() is no longer done at import time
             client = genai.GenerativeModel(model_name=model_name, generation_config={"temperature": temperature})
 
             for i, topic_obj in enumerate(topics_to_process):
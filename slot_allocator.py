@@ -0,0 +1,250 @@
+# slot_allocator.py
+#
+# Places new posts into (page, date, hour) slots that do not collide with posts already in the database,
+# including posts of sibling pages and of earlier or concurrent generation runs.
+#
+# Rules: two posts of the same page are at least SLOT_MIN_PAGE_GAP_HOURS apart, at most
+# SLOT_MAX_POSTS_PER_HOUR posts (all pages together) share an hour, and optionally only SLOT_ALLOWED_HOURS
+# are used. A post goes to its desired hour if that is free, otherwise to the next free hour after it.
+#
+# Slots are indexed as hours since 0001-01-01. Occupied slots are loaded with one range scan on
+# idx_posts_slots, and two skip indexes answer "next usable hour at or after h": one over hours that are
+# full globally, one per page over hours within the gap of that page's posts. Both are path-compressed
+# next-pointers, so a placement costs near-constant amortized time plus the number of blocked stretches it
+# has to jump over. Posts saved by other processes are picked up through the updated_at index before each
+# placement.
+
+import os
+import time
+import threading
+from collections import Counter
+from datetime import datetime, date, timedelta
+
+import database_manager
+
+# --- Debugging setup ---
+DEBUG_SLOTS_MODE = True
+
+def debug_slots_print(message):
+    if DEBUG_SLOTS_MODE:
+        print(f"[DEBUG - Slot Allocator]: {message}")
+
+SLOT_MIN_PAGE_GAP_HOURS = int(os.getenv('SLOT_MIN_PAGE_GAP_HOURS', 2))
+SLOT_MAX_POSTS_PER_HOUR = int(os.getenv('SLOT_MAX_POSTS_PER_HOUR', 3))
+# Hours of the day posts may go out, e.g. "8-22" (inclusive); empty = any hour
+SLOT_ALLOWED_HOURS = os.getenv('SLOT_ALLOWED_HOURS', "")
+# Give up (and keep the desired slot) if no free slot exists this far after it
+SLOT_MAX_SEARCH_DAYS = int(os.getenv('SLOT_MAX_SEARCH_DAYS', 365))
+CHANGE_POLL_OVERLAP_SECONDS = 5
+
+def parse_allowed_hours(spec):
+    """'8-22' -> {8, ..., 22}; '9,13,18' and '22-2' (wrapping midnight) also work. Empty -> None (any hour)."""
+    if not spec or not spec.strip():
+        return None
+    hours = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = (int(value) % 24 for value in part.split('-', 1))
+            hour = start
+            hours.add(hour)
+            while hour != end:
+                hour = (hour + 1) % 24
+                hours.add(hour)
+        elif part:
+            hours.add(int(part) % 24)
+    return hours or None
+
+def to_slot(post_date, post_hour):
+    """('2025-07-21', 10) -> hours since 0001-01-01."""
+    if isinstance(post_date, str):
+        post_date = datetime.strptime(post_date, "%Y-%m-%d").date()
+    return post_date.toordinal() * 24 + int(post_hour)
+
+def from_slot(slot):
+    """Hours since 0001-01-01 -> datetime at the start of that hour."""
+    return datetime.combine(date.fromordinal(slot // 24), datetime.min.time()) + timedelta(hours=slot % 24)
+
+
+class _SkipIndex:
+    """
+    Next-pointer index over blocked hours (union-find with path halving): next_free(h) returns the first
+    hour >= h that was never blocked. Blocking is permanent, which suits slots that only ever fill up.
+    """
+    def __init__(self):
+        self._next = {} # blocked hour -> some later hour (not necessarily free)
+
+    def block(self, slot):
+        self._next.setdefault(slot, slot + 1)
+
+    def is_blocked(self, slot):
+        return slot in self._next
+
+    def next_free(self, slot):
+        root = slot
+        while root in self._next:
+            root = self._next[root]
+        while slot in self._next and self._next[slot] != root: # Point every visited hour straight at the answer
+            self._next[slot], slot = root, self._next[slot]
+        return root
+
+
+class SlotAllocator:
+    def __init__(self, min_page_gap_hours=SLOT_MIN_PAGE_GAP_HOURS, max_posts_per_hour=SLOT_MAX_POSTS_PER_HOUR,
+                 allowed_hours=SLOT_ALLOWED_HOURS, max_search_days=SLOT_MAX_SEARCH_DAYS):
+        self.min_page_gap_hours = max(1, min_page_gap_hours)
+        self.max_posts_per_hour = max(1, max_posts_per_hour)
+        self.allowed_hours = parse_allowed_hours(allowed_hours) if isinstance(allowed_hours, str) else allowed_hours
+        self.max_search_hours = max_search_days * 24
+
+        self._lock = threading.Lock()
+        self._posts_per_hour = Counter() # slot -> number of posts (all pages)
+        self._full_hours = _SkipIndex()
+        self._page_blocked = {} # page_name -> _SkipIndex of hours too close to that page's posts
+        self._known_posts = {} # post id -> (page_name, slot), so reloads never count a post twice
+        self._reserved = Counter() # (page_name, slot) placed by this allocator but not seen in the database yet
+        self._first_slot = None
+        self._last_change_check = None
+
+    # --- Index maintenance ---
+
+    def _occupy(self, page_name, slot):
+        self._posts_per_hour[slot] += 1
+        if self._posts_per_hour[slot] >= self.max_posts_per_hour:
+            self._full_hours.block(slot)
+        page_index = self._page_blocked.setdefault(page_name, _SkipIndex())
+        for blocked in range(slot - self.min_page_gap_hours + 1, slot + self.min_page_gap_hours):
+            page_index.block(blocked)
+
+    def _record_post(self, post_id, page_name, post_date, post_hour):
+        if post_id in self._known_posts or post_date is None or post_hour is None:
+            return
+        slot = to_slot(post_date, post_hour)
+        self._known_posts[post_id] = (page_name, slot)
+        if self._reserved[(page_name, slot)] > 0:
+            self._reserved[(page_name, slot)] -= 1 # Our own placement, already counted
+            return
+        self._occupy(page_name, slot)
+
+    def load(self, start_date):
+        """Indexes every post dated start_date (minus the page gap) or later. Returns the number of posts read."""
+        first_slot = to_slot(start_date, 0) - self.min_page_gap_hours
+        check_started = time.time()
+        conn = database_manager.connect_db()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, page_name, post_date, post_hour
+                FROM posts
+                WHERE post_date >= ?
+            ''', (from_slot(first_slot).strftime("%Y-%m-%d"),))
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            self._first_slot = first_slot if self._first_slot is None else min(self._first_slot, first_slot)
+            for post_id, page_name, post_date, post_hour in rows:
+                self._record_post(post_id, page_name, post_date, post_hour)
+            self._last_change_check = check_started - CHANGE_POLL_OVERLAP_SECONDS
+        debug_slots_print(f"Indexed {len(rows)} post(s) from {from_slot(first_slot):%Y-%m-%d} on.")
+        return len(rows)
+
+    def refresh(self):
+        """
+        Adds posts saved or moved since the last load/refresh (e.g. by a concurrent generation run).
+        A moved post keeps blocking its old slot too, which only makes placement more conservative.
+        """
+        if self._last_change_check is None:
+            return 0
+        check_started = time.time()
+        changed = database_manager.get_posts_changed_since(self._last_change_check)
+        added = 0
+        with self._lock:
+            for post_id, page_name, post_date, post_hour, _posted, _is_approved, _updated_at, _page_id in changed:
+                if post_date is None or post_hour is None or to_slot(post_date, post_hour) < self._first_slot:
+                    continue
+                known = self._known_posts.get(post_id)
+                if known and known != (page_name, to_slot(post_date, post_hour)):
+                    del self._known_posts[post_id] # Moved: index its new slot as well
+                if post_id not in self._known_posts:
+                    self._record_post(post_id, page_name, post_date, post_hour)
+                    added += 1
+            self._last_change_check = check_started - CHANGE_POLL_OVERLAP_SECONDS
+        if added:
+            debug_slots_print(f"Picked up {added} post(s) saved or moved elsewhere.")
+        return added
+
+    # --- Placement ---
+
+    def _next_allowed(self, slot):
+        if not self.allowed_hours:
+            return slot
+        for offset in range(24):
+            if (slot + offset) % 24 in self.allowed_hours:
+                return slot + offset
+        return slot
+
+    def is_free(self, page_name, slot):
+        page_index = self._page_blocked.get(page_name)
+        return (not self._full_hours.is_blocked(slot) and not (page_index and page_index.is_blocked(slot))
+                and (not self.allowed_hours or slot % 24 in self.allowed_hours))
+
+    def _find_free_slot(self, page_name, slot):
+        page_index = self._page_blocked.get(page_name)
+        limit = slot + self.max_search_hours
+        while slot <= limit:
+            candidate = self._next_allowed(self._full_hours.next_free(slot))
+            if page_index is not None:
+                candidate = page_index.next_free(candidate)
+            if candidate == slot:
+                return slot
+            slot = candidate
+        return None
+
+    def place(self, page_name, desired_datetime, not_before=None):
+        """
+        Reserves the first free slot for page_name at or after desired_datetime (and not_before, if given).
+        Returns the slot's datetime, or desired_datetime unchanged if nothing is free within max_search_days.
+        """
+        if self._first_slot is None:
+            self.load(desired_datetime.strftime("%Y-%m-%d"))
+        else:
+            self.refresh()
+        desired_slot = to_slot(desired_datetime.date(), desired_datetime.hour)
+        if not_before is not None:
+            desired_slot = max(desired_slot, to_slot(not_before.date(), not_before.hour + (1 if not_before.minute or not_before.second else 0)))
+        with self._lock:
+            slot = self._find_free_slot(page_name, desired_slot)
+            if slot is None:
+                print(f"WARNING: No free slot for page '{page_name}' within {self.max_search_hours // 24} days of "
+                      f"{desired_datetime:%Y-%m-%d %H}:00. Keeping the requested slot.")
+                return desired_datetime
+            self._occupy(page_name, slot)
+            self._reserved[(page_name, slot)] += 1
+        placed = from_slot(slot)
+        if slot != desired_slot:
+            debug_slots_print(f"Slot {desired_datetime:%Y-%m-%d %H}:00 is taken for page '{page_name}'; using {placed:%Y-%m-%d %H}:00.")
+        return placed
+
+    def place_many(self, page_name, desired_datetimes):
+        """Places several posts of one page in order. Returns their datetimes, aligned with the input."""
+        return [self.place(page_name, desired) for desired in desired_datetimes]
+
+    def get_hour_load(self, start_date, days=1):
+        """{datetime: number of posts} for every occupied hour in the given days (for reports)."""
+        first = to_slot(start_date, 0)
+        with self._lock:
+            return {from_slot(slot): count for slot, count in sorted(self._posts_per_hour.items())
+                    if first <= slot < first + days * 24 and count}
+
+if __name__ == '__main__':
+    # Usage: python slot_allocator.py <page_name> <YYYY-MM-DD HH:MM> [count]
+    #        Shows where that many new posts for the page would be placed (nothing is saved).
+    import sys
+    if len(sys.argv) < 3:
+        print("Usage: python slot_allocator.py <page_name> <YYYY-MM-DD HH:MM> [count]")
+        sys.exit(1)
+    allocator = SlotAllocator()
+    desired = datetime.strptime(sys.argv[2], "%Y-%m-%d %H:%M")
+    for i in range(int(sys.argv[3]) if len(sys.argv) > 3 else 1):
+        print(f"Post {i + 1}: {allocator.place(sys.argv[1], desired):%Y-%m-%d %H:%M}")
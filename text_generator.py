@@ -2,8 +2,14 @@
 
 import os
 import sys
-import requests # For local LLM API calls
+import requests # For the local LLM health check
 import json # For local LLM API calls
+import re
+import time
+import threading
+
+import api_usage_tracker
+import ollama_client
 
 # Conditional imports for Google Gemini and OpenAI
 try:
@@ -20,6 +26,11 @@ except ImportError:
     OPENAI_AVAILABLE = False
     print("WARNING: openai library not found. OpenAI features will be disabled.", file=sys.stderr)
 
+# Providers served by the local Ollama server
+LOCAL_LLM_PROVIDERS = ("DeepSeek", "Mistral")
+# Ollama model used for a local provider when the caller does not name one
+LOCAL_LLM_DEFAULT_MODELS = {"DeepSeek": "deepseek-r1", "Mistral": "mistral"}
+
 # --- Debugging setup ---
 DEBUG_GEN_MODE = True
 
@@ -27,39 +38,98 @@ def debug_gen_print(message):
     if DEBUG_GEN_MODE:
         print(f"[DEBUG - Generator - Text]: {message}")
 
-def configure_apis():
-    # Configure Gemini API
-    gemini_api_key = os.getenv('GEMINI_API_KEY')
-    if GEMINI_AVAILABLE and gemini_api_key: # Added GEMINI_AVAILABLE check here
-        genai.configure(api_key=gemini_api_key)
-        debug_gen_print("Gemini API configured.")
-    else:
-        debug_gen_print("WARNING: GEMINI_API_KEY environment variable not set or google-generativeai not available. Gemini generation will not work.")
-        debug_gen_print("WARNING: GEMINI_API_KEY environment variable not set. Gemini generation will not work.") # This line is redundant after adding the GEMINI_AVAILABLE check above.
-
-    # Configure OpenAI API
-    openai_api_key = os.getenv('OPENAI_API_KEY')
-    if openai_api_key:
-        # OpenAI client initialization moved to generate_text for specific model selection flexibility
-        debug_gen_print("OpenAI API key detected.")
-    else:
-        debug_gen_print("WARNING: OPENAI_API_KEY environment variable not set. OpenAI generation will not work.")
+OLLAMA_BASE_URL = ollama_client.OLLAMA_BASE_URL
+
+# How long a local LLM (Ollama) health check result is trusted before it is refreshed in the background
+OLLAMA_HEALTH_TTL_SECONDS = 60
+
+_config_lock = threading.Lock()
+_apis_configured = False
+
+# Cached local LLM health: ok is None until the first check has completed
+_ollama_health = {"ok": None, "detail": "not checked yet", "checked_at": 0.0}
+_ollama_health_lock = threading.Lock()
+_ollama_health_refreshing = False
+
+def ensure_apis_configured():
+    """
+    Configures the cloud provider clients on first use. No network calls are made here,
+    so importing this module (or calling this repeatedly) stays cheap.
+    """
+    global _apis_configured
+    if _apis_configured:
+        return
+    with _config_lock:
+        if _apis_configured:
+            return
+        # Configure Gemini API
+        gemini_api_key = os.getenv('GEMINI_API_KEY')
+        if GEMINI_AVAILABLE and gemini_api_key:
+            genai.configure(api_key=gemini_api_key)
+            debug_gen_print("Gemini API configured.")
+        else:
+            debug_gen_print("WARNING: GEMINI_API_KEY environment variable not set or google-generativeai not available. Gemini generation will not work.")
+
+        # Configure OpenAI API
+        if os.getenv('OPENAI_API_KEY'):
+            # OpenAI client initialization happens per call for specific model selection flexibility
+            debug_gen_print("OpenAI API key detected.")
+        else:
+            debug_gen_print("WARNING: OPENAI_API_KEY environment variable not set. OpenAI generation will not work.")
+        _apis_configured = True
 
-    # Local LLM (DeepSeek/Mistral example) - No direct API key, just endpoint check
-    deepseek_local_url = "http://localhost:11434/api/generate"
+def _check_local_llm_health():
+    """Probes the Ollama server once and stores the result in the health cache."""
+    global _ollama_health_refreshing
     try:
-        # A quick check to see if the local server is running
-        response = requests.get("http://localhost:11434/api/tags", timeout=2)
-        if response.status_code == 200:
-            debug_gen_print(f"Local LLM (Ollama) server detected at {deepseek_local_url}.")
+        try:
+            response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=2)
+            if response.status_code == 200:
+                ok, detail = True, f"Local LLM (Ollama) server detected at {OLLAMA_BASE_URL}."
+            else:
+                ok, detail = False, f"Local LLM (Ollama) server not reachable at {OLLAMA_BASE_URL} (status: {response.status_code})."
+        except requests.exceptions.RequestException as e:
+            ok, detail = False, f"Local LLM (Ollama) server not reachable at {OLLAMA_BASE_URL} ({e}). DeepSeek/Mistral generation may not work."
+        with _ollama_health_lock:
+            _ollama_health.update(ok=ok, detail=detail, checked_at=time.time())
+        debug_gen_print(detail if ok else f"WARNING: {detail}")
+    finally:
+        # Cleared whatever happened, or no refresh would ever be started again
+        with _ollama_health_lock:
+            _ollama_health_refreshing = False
+
+def get_local_llm_status(wait=False):
+    """
+    Returns the cached local LLM health as a dict: {"ok": True/False/None, "detail": str, "checked_at": float}.
+
+    A stale (older than OLLAMA_HEALTH_TTL_SECONDS) or missing result triggers a refresh on a background
+    thread, so callers never block on the network unless wait=True is passed.
+    """
+    global _ollama_health_refreshing
+    with _ollama_health_lock:
+        is_stale = time.time() - _ollama_health["checked_at"] > OLLAMA_HEALTH_TTL_SECONDS
+        start_refresh = is_stale and not _ollama_health_refreshing
+        if start_refresh:
+            _ollama_health_refreshing = True
+    if start_refresh:
+        if wait:
+            _check_local_llm_health()
         else:
-            debug_gen_print(f"WARNING: Local LLM (Ollama) server not reachable at {deepseek_local_url} (status: {response.status_code}).")
-    except requests.exceptions.RequestException as e:
-        debug_gen_print(f"WARNING: Local LLM (Ollama) server not reachable at {deepseek_local_url} ({e}). DeepSeek/Mistral generation may not work.")
+            threading.Thread(target=_check_local_llm_health, daemon=True).start()
+    with _ollama_health_lock:
+        return dict(_ollama_health)
 
+def configure_apis():
+    """Configures the cloud providers and starts a background local LLM health check. Never blocks on the network."""
+    ensure_apis_configured()
+    get_local_llm_status()
 
-# Call configure_apis once when module is imported
-configure_apis()
+
+def _build_full_post_prompts(prompt_en, prompt_ar, contact_info_en="", contact_info_ar=""):
+    """Appends the page contact information to the EN/AR post prompts."""
+    full_english_post_prompt = f"{prompt_en}\n\nEnsure this post concludes with the following contact information, integrated naturally: {contact_info_en}" if contact_info_en else prompt_en
+    full_arabic_post_prompt = f"{prompt_ar}\n\nتأكد من أن هذا المنشور ينتهي بمعلومات الاتصال التالية، مدمجة بشكل طبيعي: {contact_info_ar}" if contact_info_ar else prompt_ar
+    return full_english_post_prompt, full_arabic_post_prompt
 
 def generate_text(prompt_en, prompt_ar, target_language, provider, model, temperature=0.7, contact_info_en="", contact_info_ar=""):
     """
@@ -87,146 +157,348 @@ def generate_text(prompt_en, prompt_ar, target_language, provider, model, temper
     actual_prompt_ar_used = ""
 
     # Construct prompts with contact info, guiding the LLM to integrate naturally
-    full_english_post_prompt = f"{prompt_en}\n\nEnsure this post concludes with the following contact information, integrated naturally: {contact_info_en}" if contact_info_en else prompt_en
-    full_arabic_post_prompt = f"{prompt_ar}\n\nتأكد من أن هذا المنشور ينتهي بمعلومات الاتصال التالية، مدمجة بشكل طبيعي: {contact_info_ar}" if contact_info_ar else prompt_ar
+    full_english_post_prompt, full_arabic_post_prompt = _build_full_post_prompts(prompt_en, prompt_ar, contact_info_en, contact_info_ar)
+
+    if provider not in ("Gemini", "OpenAI") and provider not in LOCAL_LLM_PROVIDERS:
+        debug_gen_print(f"Unknown text generation provider: {provider}")
+        return "ERROR: Unknown text provider", "", "", ""
+    if provider == "Gemini" and not GEMINI_AVAILABLE:
+        return "Gemini API not available.", "Gemini API not available.", "", ""
+    if provider == "OpenAI" and not OPENAI_AVAILABLE:
+        return "OpenAI API not available.", "OpenAI API not available.", "", ""
+
+    if (target_language == "English" or target_language == "Both") and full_english_post_prompt:
+        try:
+            debug_gen_print(f"{provider} (EN) prompt: {full_english_post_prompt[:100]}...")
+            generated_content_en = _complete(provider, model, full_english_post_prompt, temperature)
+            actual_prompt_en_used = full_english_post_prompt
+            debug_gen_print(f"{provider} (EN) generated content (first 50 chars): {generated_content_en[:50]}...")
+        except Exception as e:
+            debug_gen_print(f"Error during {provider} (EN) generation: {e}")
+            if provider not in LOCAL_LLM_PROVIDERS:
+                return f"Generation failed ({provider} API Error): {e}", "", full_english_post_prompt, full_arabic_post_prompt
+            generated_content_en = f"Generation failed ({provider} EN API Error): {e}"
+
+    if (target_language == "Arabic" or target_language == "Both") and full_arabic_post_prompt:
+        try:
+            debug_gen_print(f"{provider} (AR) prompt: {full_arabic_post_prompt[:100]}...")
+            generated_content_ar = _complete(provider, model, full_arabic_post_prompt, temperature)
+            actual_prompt_ar_used = full_arabic_post_prompt
+            debug_gen_print(f"{provider} (AR) generated content (first 50 chars): {generated_content_ar[:50]}...")
+        except Exception as e:
+            debug_gen_print(f"Error during {provider} (AR) generation: {e}")
+            if provider not in LOCAL_LLM_PROVIDERS:
+                return f"Generation failed ({provider} API Error): {e}", "", full_english_post_prompt, full_arabic_post_prompt
+            generated_content_ar = f"Generation failed ({provider} AR API Error): {e}"
+
+    return generated_content_en, generated_content_ar, actual_prompt_en_used, actual_prompt_ar_used
 
+# --- Batch (multi-post) generation ---
+
+# Upper bound on posts requested in one call; keeps responses well inside typical output limits.
+MAX_BATCH_SIZE = 8
+
+def _strip_local_llm_artifacts(text):
+    """Removes <think> blocks and stop tokens that local models sometimes leave in the output."""
+    text = text.split('<think>')[0].strip() if '<think>' in text else text
+    text = text.split('</think>')[0].strip() if '</think>' in text else text
+    text = text.split('</s>')[0].strip() if '</s>' in text else text
+    return text
+
+def _complete(provider, model, prompt, temperature=0.7, max_tokens=1000):
+    """
+    Sends a single prompt to the given provider and returns the raw response text.
+    Every call is recorded in the api_calls table (tokens, wall time, outcome, estimated cost).
+    Raises an exception on any provider error so callers can decide how to fall back.
+    """
+    ensure_apis_configured()
+    started_at = time.perf_counter()
+    prompt_tokens = None
+    completion_tokens = None
+    try:
+        if provider == "Gemini":
+            if not GEMINI_AVAILABLE:
+                raise RuntimeError("Gemini API not available.")
+            client = genai.GenerativeModel(model_name=model)
+            response = client.generate_content(
+                prompt,
+                generation_config=genai.types.GenerationConfig(temperature=temperature)
+            )
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                prompt_tokens = getattr(usage, "prompt_token_count", None)
+                completion_tokens = getattr(usage, "candidates_token_count", None)
+            text = response.text.strip()
+
+        elif provider == "OpenAI":
+            if not OPENAI_AVAILABLE:
+                raise RuntimeError("OpenAI API not available.")
+            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+            response = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature
+            )
+            if response.usage is not None:
+                prompt_tokens = response.usage.prompt_tokens
+                completion_tokens = response.usage.completion_tokens
+            text = response.choices[0].message.content.strip()
+
+        elif provider in LOCAL_LLM_PROVIDERS:
+            if get_local_llm_status()["ok"] is False:
+                debug_gen_print(f"WARNING: Last local LLM health check failed; trying {provider} anyway.")
+            # Shared client: keeps the model warm and caps in-flight requests at OLLAMA_NUM_PARALLEL
+            response_json = ollama_client.get_client().generate(model, prompt, options={
+                "temperature": temperature,
+                "num_predict": max_tokens,
+                "stop": ["</think>", "</s>"] # </s> is a common stop token for Mistral/Llama models
+            })
+            prompt_tokens = response_json.get('prompt_eval_count')
+            completion_tokens = response_json.get('eval_count')
+            text = _strip_local_llm_artifacts(response_json['response'].strip())
 
-    if provider == "Gemini":
-        if GEMINI_AVAILABLE:
-            try:
-                client = genai.GenerativeModel(model_name=model)
-                if (target_language == "English" or target_language == "Both") and full_english_post_prompt:
-                    debug_gen_print(f"Gemini (EN) prompt: {full_english_post_prompt[:100]}...")
-                    response_en = client.generate_content(
-                        full_english_post_prompt,
-                        generation_config=genai.types.GenerationConfig(temperature=temperature)
-                    )
-                    generated_content_en = response_en.text.strip()
-                    actual_prompt_en_used = full_english_post_prompt
-                    debug_gen_print(f"Gemini (EN) generated content (first 50 chars): {generated_content_en[:50]}...")
-                if (target_language == "Arabic" or target_language == "Both") and full_arabic_post_prompt:
-                    debug_gen_print(f"Gemini (AR) prompt: {full_arabic_post_prompt[:100]}...")
-                    response_ar = client.generate_content(
-                        full_arabic_post_prompt,
-                        generation_config=genai.types.GenerationConfig(temperature=temperature)
-                    )
-                    generated_content_ar = response_ar.text.strip()
-                    actual_prompt_ar_used = full_arabic_post_prompt
-                    debug_gen_print(f"Gemini (AR) generated content (first 50 chars): {generated_content_ar[:50]}...")
-
-            except Exception as e:
-                debug_gen_print(f"Error during Gemini generation: {e}")
-                return f"Generation failed (Gemini API Error): {e}", "", full_english_post_prompt, full_arabic_post_prompt
         else:
-            generated_content_en = "Gemini API not available."
-            generated_content_ar = "Gemini API not available."
-
-    elif provider == "OpenAI":
-        if OPENAI_AVAILABLE:
-            try:
-                client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-                if (target_language == "English" or target_language == "Both") and full_english_post_prompt:
-                    debug_gen_print(f"OpenAI (EN) prompt: {full_english_post_prompt[:100]}...")
-                    response_en = client.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": full_english_post_prompt}],
-                        temperature=temperature
-                    )
-                    generated_content_en = response_en.choices[0].message.content.strip()
-                    actual_prompt_en_used = full_english_post_prompt
-                    debug_gen_print(f"OpenAI (EN) generated content (first 50 chars): {generated_content_en[:50]}...")
-                if (target_language == "Arabic" or target_language == "Both") and full_arabic_post_prompt:
-                    debug_gen_print(f"OpenAI (AR) prompt: {full_arabic_post_prompt[:100]}...")
-                    response_ar = client.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": full_arabic_post_prompt}],
-                        temperature=temperature
-                    )
-                    generated_content_ar = response_ar.choices[0].message.content.strip()
-                    actual_prompt_ar_used = full_arabic_post_prompt
-                    debug_gen_print(f"OpenAI (AR) generated content (first 50 chars): {generated_content_ar[:50]}...")
-
-            except Exception as e:
-                debug_gen_print(f"Error during OpenAI generation: {e}")
-                return f"Generation failed (OpenAI API Error): {e}", "", full_english_post_prompt, full_arabic_post_prompt
+            raise ValueError(f"Unknown text generation provider: {provider}")
+
+    except Exception as e:
+        api_usage_tracker.record_api_call("text", provider, model, started_at, "error", error_message=e)
+        raise
+
+    api_usage_tracker.record_api_call(
+        "text", provider, model, started_at, "success",
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        estimated_cost=api_usage_tracker.estimate_text_cost(provider, model, prompt_tokens, completion_tokens)
+    )
+    return text
+
+def _build_batch_prompt(full_post_prompt, n, arabic=False):
+    """Wraps a single-post prompt so the model returns n distinct posts as a JSON array of strings."""
+    if arabic:
+        return (
+            f"{full_post_prompt}\n\n"
+            f"اكتب {n} منشورات مختلفة ومتميزة عن بعضها بناءً على التعليمات أعلاه. "
+            f"أعد النتيجة فقط كمصفوفة JSON تحتوي على {n} نصوص (strings)، كل نص هو منشور كامل، "
+            f"بدون أي شرح أو تنسيق Markdown."
+        )
+    return (
+        f"{full_post_prompt}\n\n"
+        f"Write {n} distinct posts following the instructions above. Each post must take a different angle or hook. "
+        f"Return ONLY a JSON array of {n} strings, each string being one complete post, "
+        f"with no explanations and no Markdown formatting."
+    )
+
+def _extract_json_payload(raw_text, opener, closer):
+    """
+    Pulls the outermost JSON value delimited by opener/closer ('[' ']' or '{' '}') out of a model response.
+    Tolerates Markdown code fences, <think> blocks and leading/trailing chatter. Returns None if nothing parses.
+    """
+    if not raw_text:
+        return None
+    text = raw_text
+    if '</think>' in text:
+        text = text.split('</think>', 1)[1]
+    text = text.replace("```json", "```").strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+
+    start = text.find(opener)
+    end = text.rfind(closer)
+    if start == -1 or end <= start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+
+def parse_batch_response(raw_text):
+    """
+    Extracts a list of post strings from a model response that should contain a JSON array.
+    Accepts arrays of strings or of objects (e.g. [{"post": "..."}]).
+    Returns an empty list if nothing usable can be parsed.
+    """
+    items = _extract_json_payload(raw_text, '[', ']')
+    if not isinstance(items, list):
+        return []
+
+    posts = []
+    for item in items:
+        if isinstance(item, str):
+            candidate = item
+        elif isinstance(item, dict):
+            candidate = next((item[k] for k in ("post", "text", "content", "message") if isinstance(item.get(k), str)), "")
         else:
-            generated_content_en = "OpenAI API not available."
-            generated_content_ar = "OpenAI API not available."
-
-    elif provider == "DeepSeek" or provider == "Mistral": # Group DeepSeek and Mistral as local LLMs
-        local_llm_url = "http://localhost:11434/api/generate" # Assuming Ollama default
-        local_llm_model = model # model parameter holds the ollama model tag
-        headers = {'Content-Type': 'application/json'}
-
-        # Increased timeout to 240000 seconds (4000 minutes or ~66 hours) as requested
-        # Be aware this is an extremely long timeout.
-        TIMEOUT_SECONDS = 240000
-
-        # Common options for DeepSeek/Mistral models
-        common_ollama_options = {
-            "temperature": temperature,
-            "num_predict": 1000, # Max tokens to predict
-            "stop": ["</think>", "</s>"] # Add </s> as a common stop token for Mistral/Llama models
-        }
-
-
-        if (target_language == "English" or target_language == "Both") and full_english_post_prompt:
-            payload_en = {
-                "model": local_llm_model,
-                "prompt": full_english_post_prompt,
-                "stream": False,
-                "options": common_ollama_options # Apply common options
-            }
-            try:
-                debug_gen_print(f"{provider} (EN) API Payload SENT: {json.dumps(payload_en)}") # ADDED DEBUG PRINT
-                debug_gen_print(f"{provider} (EN) prompt: {full_english_post_prompt[:100]}...")
-                response_en = requests.post(local_llm_url, headers=headers, data=json.dumps(payload_en), timeout=TIMEOUT_SECONDS)
-                response_en.raise_for_status()
-                generated_content_en = response_en.json()['response'].strip()
-                # Clean up any residual <think> tags if they were generated before stop took effect
-                generated_content_en = generated_content_en.split('<think>')[0].strip() if '<think>' in generated_content_en else generated_content_en
-                generated_content_en = generated_content_en.split('</think>')[0].strip() if '</think>' in generated_content_en else generated_content_en
-                # Also strip </s> if present
-                generated_content_en = generated_content_en.split('</s>')[0].strip() if '</s>' in generated_content_en else generated_content_en
-
-
-                actual_prompt_en_used = full_english_post_prompt
-                debug_gen_print(f"{provider} (EN) generated content (first 50 chars): {generated_content_en[:50]}...")
-            except Exception as e:
-                debug_gen_print(f"Error during {provider} (EN) generation: {e}")
-                generated_content_en = f"Generation failed ({provider} EN API Error): {e}"
-
-        if (target_language == "Arabic" or target_language == "Both") and full_arabic_post_prompt:
-            payload_ar = {
-                "model": local_llm_model,
-                "prompt": full_arabic_post_prompt,
-                "stream": False,
-                "options": common_ollama_options # Apply common options
-            }
-            try:
-                debug_gen_print(f"{provider} (AR) API Payload SENT: {json.dumps(payload_ar)}") # ADDED DEBUG PRINT
-                debug_gen_print(f"{provider} (AR) prompt: {full_arabic_post_prompt[:100]}...")
-                response_ar = requests.post(local_llm_url, headers=headers, data=json.dumps(payload_ar), timeout=TIMEOUT_SECONDS)
-                response_ar.raise_for_status()
-                generated_content_ar = response_ar.json()['response'].strip()
-                # Clean up any residual <think> tags if they were generated before stop took effect
-                generated_content_ar = generated_content_ar.split('<think>')[0].strip() if '<think>' in generated_content_ar else generated_content_ar
-                generated_content_ar = generated_content_ar.split('</think>')[0].strip() if '</think>' in generated_content_ar else generated_content_ar
-                # Also strip </s> if present
-                generated_content_ar = generated_content_ar.split('</s>')[0].strip() if '</s>' in generated_content_ar else generated_content_ar
-
-
-                actual_prompt_ar_used = full_arabic_post_prompt
-                debug_gen_print(f"{provider} (AR) generated content (first 50 chars): {generated_content_ar[:50]}...")
-            except Exception as e:
-                debug_gen_print(f"Error during {provider} (AR) generation: {e}")
-                generated_content_ar = f"Generation failed ({provider} AR API Error): {e}"
+            candidate = ""
+        candidate = candidate.strip()
+        if candidate:
+            posts.append(candidate)
+    return posts
+
+def generate_text_batch(prompt_en, prompt_ar, target_language, provider, model, n, temperature=0.7, contact_info_en="", contact_info_ar="", bilingual=True):
+    """
+    Generates n distinct posts for the same topic, asking for each language's posts in a single call.
 
+    Falls back to one generate_text() call per missing post when the batch response cannot be
+    parsed or contains fewer than n posts, so the caller always gets n results.
+
+    Args:
+        Same as generate_text(), plus:
+        n (int): Number of distinct posts to generate.
+        bilingual (bool): For target_language 'Both', request matching EN/AR pairs in one call
+                          (see generate_text_bilingual) instead of one batch per language.
+
+    Returns:
+        list: n tuples of (generated_content_en, generated_content_ar, actual_prompt_en_used, actual_prompt_ar_used),
+              where the prompts are the single-post prompts the batch was derived from.
+    """
+    if n <= 1:
+        if bilingual and target_language == "Both":
+            return [generate_text_bilingual(prompt_en, prompt_ar, provider, model, temperature, contact_info_en, contact_info_ar)]
+        return [generate_text(prompt_en, prompt_ar, target_language, provider, model, temperature, contact_info_en, contact_info_ar)]
+
+    full_english_post_prompt, full_arabic_post_prompt = _build_full_post_prompts(prompt_en, prompt_ar, contact_info_en, contact_info_ar)
+
+    want_en = (target_language == "English" or target_language == "Both") and bool(full_english_post_prompt)
+    want_ar = (target_language == "Arabic" or target_language == "Both") and bool(full_arabic_post_prompt)
+
+    def _batch_for(full_prompt, arabic, label):
+        try:
+            debug_gen_print(f"{provider} ({label}) batch request for {n} posts...")
+            raw = _complete(provider, model, _build_batch_prompt(full_prompt, n, arabic=arabic), temperature, max_tokens=1000 * n)
+        except Exception as e:
+            debug_gen_print(f"Error during {provider} ({label}) batch generation: {e}. Falling back to single calls.")
+            return []
+        posts = parse_batch_response(raw)
+        if len(posts) < n:
+            debug_gen_print(f"{provider} ({label}) batch returned {len(posts)}/{n} usable posts. Remaining posts will use single calls.")
+        return posts[:n]
+
+    if bilingual and want_en and want_ar:
+        try:
+            debug_gen_print(f"{provider} (EN+AR) bilingual batch request for {n} posts...")
+            raw = _complete(provider, model, _build_bilingual_prompt(full_english_post_prompt, full_arabic_post_prompt, n), temperature, max_tokens=2000 * n)
+            pairs = parse_bilingual_batch_response(raw)[:n]
+        except Exception as e:
+            debug_gen_print(f"Error during {provider} bilingual batch generation: {e}. Falling back to single calls.")
+            pairs = []
+        if len(pairs) < n:
+            debug_gen_print(f"{provider} bilingual batch returned {len(pairs)}/{n} usable posts. Remaining posts will use single calls.")
+        results = [(content_en, content_ar, full_english_post_prompt, full_arabic_post_prompt) for content_en, content_ar in pairs]
+        for _ in range(n - len(pairs)):
+            results.append(generate_text_bilingual(prompt_en, prompt_ar, provider, model, temperature, contact_info_en, contact_info_ar))
+        return results
+
+    batch_en = _batch_for(full_english_post_prompt, False, "EN") if want_en else []
+    batch_ar = _batch_for(full_arabic_post_prompt, True, "AR") if want_ar else []
+
+    results = []
+    for i in range(n):
+        content_en = batch_en[i] if i < len(batch_en) else None
+        content_ar = batch_ar[i] if i < len(batch_ar) else None
+        missing_en = want_en and content_en is None
+        missing_ar = want_ar and content_ar is None
+
+        if missing_en or missing_ar:
+            # Only regenerate the language(s) the batch did not cover for this slot
+            if missing_en and missing_ar:
+                fallback_language = "Both"
+            else:
+                fallback_language = "English" if missing_en else "Arabic"
+            fb_en, fb_ar, _, _ = generate_text(prompt_en, prompt_ar, fallback_language, provider, model, temperature, contact_info_en, contact_info_ar)
+            if missing_en:
+                content_en = fb_en
+            if missing_ar:
+                content_ar = fb_ar
+
+        results.append((
+            content_en or "",
+            content_ar or "",
+            full_english_post_prompt if want_en else "",
+            full_arabic_post_prompt if want_ar else ""
+        ))
+    return results
+
+# --- Bilingual (EN + AR in one call) generation ---
+
+ARABIC_CHAR_PATTERN = re.compile(r'[\u0600-\u06FF]')
+
+def _build_bilingual_prompt(full_english_post_prompt, full_arabic_post_prompt, n=1):
+    """Combines the EN and AR post prompts into one request for matching EN/AR versions as JSON."""
+    if n > 1:
+        shape = (
+            f'Return ONLY a JSON array of {n} objects, each of the form {{"en": "<English post>", "ar": "<Arabic post>"}}. '
+            f"The {n} posts must be distinct from each other, each taking a different angle or hook."
+        )
     else:
-        debug_gen_print(f"Unknown text generation provider: {provider}")
-        return "ERROR: Unknown text provider", "", "", ""
+        shape = 'Return ONLY a JSON object of the form {"en": "<English post>", "ar": "<Arabic post>"}.'
+    return (
+        "You are writing a Facebook post that will be published in both English and Arabic. "
+        "The Arabic version must convey the same content, offer and key points as the English version, "
+        "written natively in Arabic (not a literal translation).\n\n"
+        f"English version instructions:\n{full_english_post_prompt}\n\n"
+        f"Arabic version instructions:\n{full_arabic_post_prompt}\n\n"
+        f"{shape} Do not add explanations or Markdown formatting."
+    )
+
+def _validate_bilingual_item(item):
+    """Returns (en, ar) if item is a usable {"en": ..., "ar": ...} object, otherwise None."""
+    if not isinstance(item, dict):
+        return None
+    content_en = item.get("en")
+    content_ar = item.get("ar")
+    if not isinstance(content_en, str) or not isinstance(content_ar, str):
+        return None
+    content_en = content_en.strip()
+    content_ar = content_ar.strip()
+    if not content_en or not content_ar or not ARABIC_CHAR_PATTERN.search(content_ar):
+        return None
+    return content_en, content_ar
+
+def parse_bilingual_response(raw_text):
+    """Parses a {"en": ..., "ar": ...} response. Returns (en, ar) or None if invalid."""
+    return _validate_bilingual_item(_extract_json_payload(raw_text, '{', '}'))
+
+def parse_bilingual_batch_response(raw_text):
+    """Parses a JSON array of {"en": ..., "ar": ...} objects, keeping only the valid entries."""
+    items = _extract_json_payload(raw_text, '[', ']')
+    if not isinstance(items, list):
+        return []
+    pairs = []
+    for item in items:
+        pair = _validate_bilingual_item(item)
+        if pair:
+            pairs.append(pair)
+    return pairs
+
+def generate_text_bilingual(prompt_en, prompt_ar, provider, model, temperature=0.7, contact_info_en="", contact_info_ar=""):
+    """
+    Generates matching English and Arabic versions of one post in a single call.
 
-    return generated_content_en, generated_content_ar, actual_prompt_en_used, actual_prompt_ar_used
+    The model is asked for {"en": ..., "ar": ...}; if the call fails or the response does not validate
+    (missing keys, empty text, Arabic version without Arabic script), falls back to generate_text(..., "Both"),
+    which makes one call per language.
+
+    Returns:
+        tuple: Same shape as generate_text().
+    """
+    full_english_post_prompt, full_arabic_post_prompt = _build_full_post_prompts(prompt_en, prompt_ar, contact_info_en, contact_info_ar)
+    if not full_english_post_prompt or not full_arabic_post_prompt:
+        return generate_text(prompt_en, prompt_ar, "Both", provider, model, temperature, contact_info_en, contact_info_ar)
+
+    try:
+        debug_gen_print(f"{provider} (EN+AR) bilingual request...")
+        raw = _complete(provider, model, _build_bilingual_prompt(full_english_post_prompt, full_arabic_post_prompt), temperature, max_tokens=2000)
+        pair = parse_bilingual_response(raw)
+    except Exception as e:
+        debug_gen_print(f"Error during {provider} bilingual generation: {e}")
+        pair = None
+
+    if not pair:
+        debug_gen_print(f"{provider} bilingual response unusable. Falling back to separate EN and AR calls.")
+        return generate_text(prompt_en, prompt_ar, "Both", provider, model, temperature, contact_info_en, contact_info_ar)
+
+    debug_gen_print(f"{provider} (EN+AR) generated content (first 50 chars): {pair[0][:50]}...")
+    return pair[0], pair[1], full_english_post_prompt, full_arabic_post_prompt
 
 if __name__ == '__main__':
     import sys
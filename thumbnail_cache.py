@@ -0,0 +1,167 @@
+# thumbnail_cache.py
+#
+# Thumbnails for the review UIs (Tk review tab and the web review page).
+#
+# Thumbnails are cached on disk under generated_images/.thumbnails, keyed by the image's SHA-256 and the
+# requested size, so they survive restarts and are shared by every post using the same image. Decoded
+# thumbnails are also kept in a small in-memory LRU, so re-selecting a post needs no disk access or decoding.
+# Small sizes are rendered from the cached preview variant (see image_variants) instead of the full PNG.
+
+import os
+import re
+import io
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import image_store
+import image_variants
+
+# --- Debugging setup ---
+DEBUG_THUMBNAIL_MODE = False
+
+def debug_thumbnail_print(message):
+    if DEBUG_THUMBNAIL_MODE:
+        print(f"[DEBUG - Thumbnails]: {message}")
+
+THUMBNAILS_SUBDIR = ".thumbnails"
+DEFAULT_THUMBNAIL_SIZE = (200, 200)
+# Square sizes the web UI may request (?size=N); each one is a separate file per image on disk
+WEB_THUMBNAIL_SIZES = (100, 200, 400)
+MAX_THUMBNAIL_SIDE = 1024
+THUMBNAIL_JPEG_QUALITY = 80
+MEMORY_CACHE_MAX_ITEMS = 256
+
+_SHA256_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+_memory_cache = OrderedDict() # (image hash, size) -> decoded PIL image
+_legacy_hashes = {} # (original path, mtime, file size) -> sha256 of non content-addressed images
+_lock = threading.Lock()
+
+def normalize_size(size):
+    """Clamps a requested (width, height) to 16..MAX_THUMBNAIL_SIDE pixels per side."""
+    width, height = size
+    return (max(16, min(int(width), MAX_THUMBNAIL_SIDE)), max(16, min(int(height), MAX_THUMBNAIL_SIDE)))
+
+def get_image_hash(output_dir, key):
+    """SHA-256 of the image: taken from content-addressed keys, computed (and memoized) for legacy names."""
+    stem = os.path.splitext(os.path.basename(key))[0]
+    if _SHA256_KEY_PATTERN.match(stem):
+        return stem
+    original_path = image_store.get_image_path(output_dir, key)
+    stat = os.stat(original_path)
+    cache_key = (original_path, stat.st_mtime, stat.st_size)
+    with _lock:
+        if cache_key in _legacy_hashes:
+            return _legacy_hashes[cache_key]
+    digest = image_store.hash_file(original_path)
+    with _lock:
+        _legacy_hashes[cache_key] = digest
+    return digest
+
+def _thumbnail_path(output_dir, image_hash, size):
+    return os.path.join(image_store.get_images_dir(output_dir), THUMBNAILS_SUBDIR, image_hash[:2],
+                        f"{image_hash}_{size[0]}x{size[1]}.jpg")
+
+def _source_path(output_dir, key, size):
+    """Renders from the preview variant when it is at least as large as the thumbnail, else from the original."""
+    preview_max = image_variants.VARIANT_SPECS["preview"]["max_size"]
+    if size[0] <= preview_max[0] and size[1] <= preview_max[1]:
+        preview_path = image_variants.ensure_variant(output_dir, key, "preview")
+        if preview_path:
+            return preview_path
+    return image_store.get_image_path(output_dir, key)
+
+def ensure_thumbnail(output_dir, key, size=DEFAULT_THUMBNAIL_SIZE):
+    """
+    Returns the path of the cached JPEG thumbnail for an image, rendering it on first use.
+    Returns None if the image does not exist or cannot be decoded.
+    """
+    if not key or key.startswith("ERROR_") or Image is None:
+        return None
+    if not os.path.exists(image_store.get_image_path(output_dir, key)):
+        return None
+    size = normalize_size(size)
+    thumbnail_path = _thumbnail_path(output_dir, get_image_hash(output_dir, key), size)
+    if os.path.exists(thumbnail_path):
+        return thumbnail_path
+    try:
+        with Image.open(_source_path(output_dir, key, size)) as img:
+            img = img.convert("RGB")
+            img.thumbnail(size, Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=THUMBNAIL_JPEG_QUALITY, optimize=True)
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        temp_path = image_store.create_temp_file(output_dir)
+        with open(temp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(temp_path, thumbnail_path)
+        debug_thumbnail_print(f"Rendered {size[0]}x{size[1]} thumbnail for {key}")
+        return thumbnail_path
+    except Exception as e:
+        print(f"WARNING: Could not render thumbnail for {key}: {e}")
+        return None
+
+def get_cached_thumbnail_image(output_dir, key, size=DEFAULT_THUMBNAIL_SIZE):
+    """Returns the decoded thumbnail if it is in the in-memory LRU, without touching the disk; else None."""
+    if not key or key.startswith("ERROR_"):
+        return None
+    stem = os.path.splitext(os.path.basename(key))[0]
+    if not _SHA256_KEY_PATTERN.match(stem):
+        return None # Legacy names need hashing (disk access) to find their cache entry
+    cache_key = (stem, normalize_size(size))
+    with _lock:
+        if cache_key in _memory_cache:
+            _memory_cache.move_to_end(cache_key)
+            return _memory_cache[cache_key]
+    return None
+
+def get_thumbnail_image(output_dir, key, size=DEFAULT_THUMBNAIL_SIZE):
+    """
+    Returns the decoded thumbnail (PIL image) for an image, from the in-memory LRU if possible.
+    May read and render from disk, so UI code should call it off the main thread.
+    """
+    if not key or key.startswith("ERROR_") or Image is None:
+        return None
+    size = normalize_size(size)
+    try:
+        cache_key = (get_image_hash(output_dir, key), size)
+    except OSError:
+        return None
+    with _lock:
+        if cache_key in _memory_cache:
+            _memory_cache.move_to_end(cache_key)
+            return _memory_cache[cache_key]
+
+    thumbnail_path = ensure_thumbnail(output_dir, key, size)
+    if not thumbnail_path:
+        return None
+    with Image.open(thumbnail_path) as img:
+        img.load()
+        thumbnail = img.copy()
+    with _lock:
+        _memory_cache[cache_key] = thumbnail
+        _memory_cache.move_to_end(cache_key)
+        while len(_memory_cache) > MEMORY_CACHE_MAX_ITEMS:
+            _memory_cache.popitem(last=False)
+    return thumbnail
+
+def delete_thumbnails(output_dir, key):
+    """Removes the cached thumbnails of an image (all sizes)."""
+    try:
+        image_hash = get_image_hash(output_dir, key)
+    except OSError:
+        return
+    thumbnails_dir = os.path.join(image_store.get_images_dir(output_dir), THUMBNAILS_SUBDIR, image_hash[:2])
+    if not os.path.isdir(thumbnails_dir):
+        return
+    for name in os.listdir(thumbnails_dir):
+        if name.startswith(f"{image_hash}_"):
+            os.remove(os.path.join(thumbnails_dir, name))
+    with _lock:
+        for cache_key in [k for k in _memory_cache if k[0] == image_hash]:
+            del _memory_cache[cache_key]